@@ -0,0 +1 @@
+# Puts the repository root on sys.path, so tests import src.* the way the modules do
@@ -0,0 +1,55 @@
+import os
+from typing import List
+from pathlib import Path
+from src.pc_methods.pc_base import Base
+from src.evaluation.evaluate import GEOMETRY_METRICS, COLOR_METRICS
+
+# Value printed for every metric by the stub pc_error
+STUB_METRIC_VALUE = '0'
+
+
+def write_stub_pcerror(pcerror_dir: Path) -> Path:
+    """
+    Write a pc_error stand-in that prints every metric line Evaluator scrapes, with a constant value, without
+    reading its inputs. Its cost is one process start, so benchmarks measure the harness rather than the metric.
+    :param pcerror_dir: pcerror directory, the script is written to pcerror_dir/test/pc_error
+    :return: script file
+    """
+    script = Path(pcerror_dir).joinpath('test', 'pc_error')
+    script.parent.mkdir(parents=True, exist_ok=True)
+    lines = [m.replace('\\', '') + STUB_METRIC_VALUE for m in GEOMETRY_METRICS + COLOR_METRICS]
+    with open(script, 'w') as f:
+        f.write('#!/bin/sh\ncat <<\'EOF\'\n' + '\n'.join(lines) + '\nEOF\n')
+    os.chmod(script, 0o755)
+    return script
+
+
+class StubCodec(Base):
+    """
+    Codec that "encodes" and "decodes" by copying the PC file, to measure the overhead of the harness itself.
+    Dataset, experiments and pcerror directories all live under workspace, no cfg file is read.
+    """
+
+    def __init__(self, workspace):
+        self.workspace = Path(workspace)
+        super().__init__()
+
+    def __post_init__(self):
+        self.dataset_dir = self.workspace.joinpath('datasets')
+        self.expt_dir = self.workspace.joinpath('experiments')
+        self.pcerror = self.workspace.joinpath('pcerror')
+        self.cfg_dir = None
+        write_stub_pcerror(self.pcerror)
+        self.cfg = {'pcc_directory': str(self.workspace),
+                    'encoder': 'cp',
+                    'decoder': 'cp',
+                    'bin_extension': '.bin',
+                    'params': [{'id': 'r0'}]}
+
+    def encode(self, orig_pc, enc_pc) -> List[str]:
+        cmd = [self.cfg['encoder'], str(orig_pc), str(enc_pc)]
+        return cmd
+
+    def decode(self, enc_file, dec_file) -> List[str]:
+        cmd = [self.cfg['decoder'], str(enc_file), str(dec_file)]
+        return cmd
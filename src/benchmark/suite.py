@@ -0,0 +1,255 @@
+import os
+import csv
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import resource
+import platform
+import subprocess as sp
+import numpy as np
+from pathlib import Path
+from multiprocessing import Process, Pipe
+from typing import Union, List, Dict, Iterable
+from src.evaluation.ply_io import write_vertex, count_points
+from src.evaluation.statisticize import statisticize
+from src.evaluation.aggregate import aggregate
+from src.evaluation.dataset_index import DatasetIndex
+from src.benchmark.stub_codec import StubCodec
+
+logger = logging.getLogger(__name__)
+
+# Bump when the fields of a result record change, so records of different runs are only compared if they match
+BENCHMARK_VERSION = 2
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000, 5_000_000)
+DEFAULT_POOL_SIZES = (1, 2, 4, os.cpu_count())
+
+
+def make_synthetic_pc(
+        num_points: int,
+        depth: int = 10,
+        seed: int = 0
+) -> np.ndarray:
+    """
+    Make a voxelized PC of num_points distinct voxels on a 2**depth grid, drawn uniformly, with random colors and
+    unit normals, so neither the codec nor the index has to estimate anything.
+    :param num_points: number of points, at most 2**(3 * depth)
+    :param depth: bit depth of the voxel coordinates. Default: 10
+    :param seed: random seed. Default: 0
+    :return: structured vertex array with x, y, z, red, green, blue, nx, ny, nz
+    """
+    rng = np.random.default_rng(seed)
+    keys = np.unique(rng.integers(0, 2 ** (3 * depth), int(num_points * 1.05) + 16))
+    while len(keys) < num_points:
+        keys = np.unique(np.concatenate([keys, rng.integers(0, 2 ** (3 * depth), num_points)]))
+    keys = rng.permutation(keys)[:num_points]
+    mask = 2 ** depth - 1
+    voxels = np.column_stack([(keys >> (2 * depth)) & mask, (keys >> depth) & mask, keys & mask])
+    normals = rng.normal(size=(num_points, 3))
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+
+    fields = [(axis, 'f4') for axis in ('x', 'y', 'z')] + [(c, 'u1') for c in ('red', 'green', 'blue')] + \
+             [(n, 'f4') for n in ('nx', 'ny', 'nz')]
+    vertex = np.empty(num_points, dtype=fields)
+    for i, axis in enumerate(('x', 'y', 'z')):
+        vertex[axis] = voxels[:, i]
+    for i, c in enumerate(('red', 'green', 'blue')):
+        vertex[c] = rng.integers(0, 256, num_points)
+    for i, n in enumerate(('nx', 'ny', 'nz')):
+        vertex[n] = normals[:, i]
+    return vertex
+
+
+def make_synthetic_dataset(
+        dataset_dir: Union[str, Path],
+        num_points: int,
+        num_files: int,
+        depth: int = 10
+) -> str:
+    """
+    Write a synthetic dataset of num_files PCs of num_points points, see make_synthetic_pc. Files that exist with
+    the right point count are kept, so the datasets of earlier benchmark runs are reused.
+    :param dataset_dir: dataset directory of the benchmark workspace
+    :param num_points: number of points per file
+    :param num_files: number of files
+    :param depth: bit depth of the voxel coordinates. Default: 10
+    :return: dataset name
+    """
+    dataset_name = f'synthetic_{num_points}_depth{depth}'
+    out_dir = Path(dataset_dir).joinpath(dataset_name)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(num_files):
+        pc_file = out_dir.joinpath(f'synthetic_{i:04d}.ply')
+        if pc_file.exists() and count_points(pc_file) == num_points:
+            continue
+        tmp_file = pc_file.parent / (pc_file.name + '.tmp')
+        write_vertex(tmp_file, make_synthetic_pc(num_points, depth, seed=i))
+        tmp_file.replace(pc_file)
+    return dataset_name
+
+
+def read_stage_summary(summary_file: Path) -> Dict[str, Dict[str, float]]:
+    """
+    Read the per-stage latency summary of a traced run, see export_trace.
+    :param summary_file: stage_summary.csv of the run
+    :return: summary columns per stage
+    """
+    with open(summary_file, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+    return {row.pop('stage'): {k: float(v) for k, v in row.items()} for row in rows}
+
+
+def run_case(
+        workspace: Path,
+        dataset_name: str,
+        depth: int,
+        num_processes: int,
+        options: Dict,
+        conn
+):
+    """
+    Run the stub codec over a dataset and send the measurements through conn. Meant to run in a fresh process,
+    so peak RSS is not carried over from earlier cases. The statistics are computed by statisticize with the JSON
+    sink and by aggregate with the others.
+    :param workspace: benchmark workspace
+    :param dataset_name: dataset's name
+    :param depth: dataset's resolution
+    :param num_processes: number of pool workers
+    :param options: further options of run_experiments
+    :param conn: connection the measurements are sent through
+    :return: None
+    """
+    codec = StubCodec(workspace)
+    start = time.perf_counter()
+    codec.run_experiments(dataset_name, depth, color=True, use_cache=False, trace=True,
+                          num_processes=num_processes, **options)
+    wall_time = time.perf_counter() - start
+
+    stage_summary = read_stage_summary(Path(codec.trace_dir).joinpath('stage_summary.csv'))
+    # Every task of this run writes its result once, whatever the sink and earlier runs left in the workspace
+    num_tasks = int(stage_summary.get('write_result', {}).get('count', 0))
+    start = time.perf_counter()
+    if options.get('results_sink', 'json') == 'json':
+        dataset_dir = Path(codec.expt_dir).joinpath(codec.get_pc_method_name(), dataset_name)
+        for eval_dir in sorted(dataset_dir.glob('*/eval')):
+            statisticize(str(eval_dir), color=True)
+    else:
+        # Other sinks write no eval JSON files, statisticize would find nothing to read
+        aggregate(codec.expt_dir)
+    statistics_time = time.perf_counter() - start
+
+    conn.send({'Tasks': num_tasks,
+               'Wall time in sec': wall_time,
+               'Tasks per sec': num_tasks / wall_time,
+               'Statistics time in sec': statistics_time,
+               'Main peak RSS in KB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               'Worker peak RSS in KB': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+               'Stages': stage_summary,
+               'Trace': str(codec.trace_dir)})
+    conn.close()
+
+
+def get_environment() -> Dict[str, str]:
+    """
+    Describe where the benchmark runs, so results of different machines and revisions can be told apart.
+    :return: host, CPU count, Python version and git revision (None outside of a git checkout)
+    """
+    try:
+        revision = sp.run(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).parent, stdout=sp.PIPE,
+                          stderr=sp.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, sp.CalledProcessError):
+        revision = None
+    return {'Host': socket.gethostname(),
+            'CPU count': os.cpu_count(),
+            'Python': platform.python_version(),
+            'Git revision': revision}
+
+
+def run_benchmark(
+        workspace: Union[str, Path],
+        results_file: Union[str, Path],
+        sizes: Iterable[int] = DEFAULT_SIZES,
+        pool_sizes: Iterable[int] = DEFAULT_POOL_SIZES,
+        num_files: int = 8,
+        depth: int = 10,
+        repeats: int = 1,
+        **options
+) -> List[Dict]:
+    """
+    Measure the overhead of the harness with a codec that copies files and a pc_error that prints constants:
+    tasks per second, per-stage latency (see export_trace) and peak RSS for every PC size and pool size.
+    Every case runs in a fresh process. One JSON record per case is appended to results_file, so runs on
+    different revisions can be compared over time.
+    :param workspace: benchmark workspace holding the synthetic datasets, experiments and the stub pc_error
+    :param results_file: JSON-lines file the records are appended to
+    :param sizes: points per synthetic PC. Default: DEFAULT_SIZES
+    :param pool_sizes: numbers of pool workers. Default: DEFAULT_POOL_SIZES
+    :param num_files: PC files per size. Default: 8
+    :param depth: bit depth of the synthetic PCs. Default: 10
+    :param repeats: runs per case. Default: 1
+    :param options: further options of run_experiments, e.g. metric_backend='in_process' or results_sink='sqlite'
+    :return: result records
+    """
+    workspace = Path(workspace)
+    environment = get_environment()
+    records = []
+    for num_points in sizes:
+        dataset_name = make_synthetic_dataset(workspace.joinpath('datasets'), num_points, num_files, depth)
+        if options.get('use_index', True):
+            # Index the dataset up front, so the first case does not pay for it. Normals as in Base.needs_normals
+            dataset_dir = workspace.joinpath('datasets')
+            normals = (options.get('precomputed_normals', False) or options.get('approximate') is not None
+                       or options.get('metric_backend', 'pc_error') != 'pc_error')
+            DatasetIndex(dataset_dir.joinpath('.index', dataset_name), normals=normals).update(
+                sorted(dataset_dir.joinpath(dataset_name).glob('*.ply')))
+        for num_processes in sorted(set(pool_sizes)):
+            for repeat in range(repeats):
+                recv_conn, send_conn = Pipe(duplex=False)
+                p = Process(target=run_case,
+                            args=(workspace, dataset_name, depth, num_processes, options, send_conn))
+                p.start()
+                send_conn.close()
+                try:
+                    measurements = recv_conn.recv()
+                except EOFError:
+                    p.join()
+                    logger.error(f'Benchmark of {dataset_name} with {num_processes} workers failed, '
+                                 f'exit code {p.exitcode}')
+                    continue
+                p.join()
+                record = {'Benchmark version': BENCHMARK_VERSION,
+                          'Time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                          **environment,
+                          'Points': num_points,
+                          'Files': num_files,
+                          'Pool size': num_processes,
+                          'Repeat': repeat,
+                          'Options': options,
+                          **measurements}
+                logger.info(f'{dataset_name}, {num_processes} workers: {record["Tasks per sec"]:.2f} tasks/sec, '
+                            f'worker peak RSS {record["Worker peak RSS in KB"] / 1024:.0f} MB')
+                with open(results_file, 'a') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+                records.append(record)
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the harness with synthetic PCs and a stub codec')
+    parser.add_argument('--workspace', default='benchmark_workspace')
+    parser.add_argument('--results', default='benchmark_results.jsonl')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=DEFAULT_POOL_SIZES)
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--metric-backend', default='pc_error', choices=('pc_error', 'in_process'))
+    parser.add_argument('--results-sink', default='json', choices=('json', 'sqlite'))
+    parser.add_argument('--no-index', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    run_benchmark(args.workspace, args.results, args.sizes, args.pool_sizes, args.files, args.depth, args.repeats,
+                  metric_backend=args.metric_backend, results_sink=args.results_sink, use_index=not args.no_index)
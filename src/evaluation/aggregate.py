@@ -0,0 +1,200 @@
+import csv
+import json
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Union, List, Dict, Tuple
+from src.evaluation.results_store import ResultsStore
+
+logger = logging.getLogger(__name__)
+
+GROUP_COLUMNS = ('pc_method', 'dataset', 'rate')
+STATISTICS = ('count', 'mean', 'std', 'min', 'max')
+
+
+def to_float(value) -> float:
+    """
+    Convert a metric value to float. pc_error values are scraped as strings, e.g. ' 71.3', 'inf' or 'NaN'.
+    :param value: metric value
+    :return: float value, NaN if the value is not numeric
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def load_records(
+        expt_dir: Union[str, Path],
+        state: Dict
+) -> Dict[str, Dict]:
+    """
+    Load the results of an experiments tree, re-reading only what changed since the state was saved:
+    eval JSON files that are new or whose size/modification time changed, and results store rows
+    appended after the last row read. Records of deleted JSON files are dropped.
+    :param expt_dir: experiments directory, laid out as pc_method/dataset/rate/eval/*.json
+    :param state: state of the previous aggregation, updated in place
+    :return: evaluation data per slot pc_method/dataset/rate/file
+    """
+    json_state = state.setdefault('json', {})
+    seen = set()
+    num_read = 0
+    for eval_file in Path(expt_dir).glob('*/*/*/eval/*.json'):
+        relpath = str(eval_file.relative_to(expt_dir))
+        seen.add(relpath)
+        stat = eval_file.stat()
+        entry = json_state.get(relpath)
+        if entry is not None and (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            continue
+        try:
+            with open(eval_file, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            logger.warning(f'Skipping corrupted {eval_file}')
+            continue
+        json_state[relpath] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'data': data}
+        num_read += 1
+    for relpath in set(json_state) - seen:
+        del json_state[relpath]
+
+    store_state = state.setdefault('sqlite', {'last_id': 0, 'records': {}})
+    db_file = Path(expt_dir).joinpath('results.sqlite')
+    if db_file.exists():
+        rows, store_state['last_id'] = ResultsStore(db_file).read_new(store_state['last_id'])
+        for pc_method, dataset, rate, pc_file, data in rows:
+            store_state['records'][f'{pc_method}/{dataset}/{rate}/{pc_file}'] = data
+        num_read += len(rows)
+    logger.info(f'Read {num_read} new or changed results')
+
+    # eval/<file>.json -> <file>, the results store wins over the JSON files of the same slot
+    records = {}
+    for relpath, entry in json_state.items():
+        pc_method, dataset, rate, _, name = Path(relpath).parts
+        records[f'{pc_method}/{dataset}/{rate}/{name[:-len(".json")]}'] = entry['data']
+    records.update(store_state['records'])
+    return records
+
+
+def to_columns(
+        records: Dict[str, Dict]
+) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Turn the records into columns: one row per record, one float column per numeric metric.
+    :param records: evaluation data per slot pc_method/dataset/rate/file
+    :return:
+        groups: (N, 3) array of pc_method, dataset, rate
+        columns: (N,) float array per metric, NaN where a record lacks the metric
+    """
+    slots = sorted(records)
+    groups = np.array([slot.split('/')[:3] for slot in slots], dtype=object).reshape(len(slots), 3)
+    metrics = {}
+    for i, slot in enumerate(slots):
+        for metric, value in records[slot].items():
+            metrics.setdefault(metric, {})[i] = to_float(value)
+    columns = {}
+    for metric, values in metrics.items():
+        column = np.full(len(slots), np.nan)
+        column[list(values)] = list(values.values())
+        # Paths and names are not metrics
+        if not np.isnan(column).all():
+            columns[metric] = column
+    return groups, columns
+
+
+def group_statistics(
+        codes: np.ndarray,
+        num_groups: int,
+        column: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    Count, mean, std, min and max of a column per group, ignoring NaN. inf values propagate,
+    e.g. the PSNR of a lossless result.
+    :param codes: (N,) group index of every row
+    :param num_groups: number of groups
+    :param column: (N,) values
+    :return: (num_groups,) array per statistic
+    """
+    valid = ~np.isnan(column)
+    codes, values = codes[valid], column[valid]
+    count = np.bincount(codes, minlength=num_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(codes, weights=values, minlength=num_groups) / count
+        sq_dev = (values - mean[codes]) ** 2
+        std = np.sqrt(np.bincount(codes, weights=sq_dev, minlength=num_groups) / count)
+    minimum = np.full(num_groups, np.inf)
+    maximum = np.full(num_groups, -np.inf)
+    np.minimum.at(minimum, codes, values)
+    np.maximum.at(maximum, codes, values)
+    empty = count == 0
+    minimum[empty] = np.nan
+    maximum[empty] = np.nan
+    return {'count': count, 'mean': mean, 'std': std, 'min': minimum, 'max': maximum}
+
+
+def load_table(
+        expt_dir: Union[str, Path]
+) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Load the results of an experiments tree as columns, reading only results that are new since the last call.
+    :param expt_dir: experiments directory
+    :return: groups and metric columns, see to_columns
+    """
+    state_file = Path(expt_dir).joinpath('.aggregate', 'state.json')
+    state = {}
+    if state_file.exists():
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    records = load_records(expt_dir, state)
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = state_file.parent / (state_file.name + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    tmp_file.replace(state_file)
+    return to_columns(records)
+
+
+def group_means(
+        groups: np.ndarray,
+        columns: Dict[str, np.ndarray]
+) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Mean of every metric per (pc_method, dataset, rate), e.g. the points of the RD curves.
+    :param groups: (N, 3) array of pc_method, dataset, rate
+    :param columns: (N,) float array per metric
+    :return:
+        keys: (G, 3) array of pc_method, dataset, rate
+        means: (G,) mean per metric
+    """
+    keys, codes = np.unique(['\0'.join(g) for g in groups], return_inverse=True)
+    means = {metric: group_statistics(codes, len(keys), column)['mean'] for metric, column in columns.items()}
+    return np.array([key.split('\0') for key in keys], dtype=object).reshape(len(keys), 3), means
+
+
+def aggregate(
+        expt_dir: Union[str, Path],
+        out_file: Union[str, Path] = None
+) -> Path:
+    """
+    Aggregate the whole experiments tree into one tidy statistics table with a row per
+    (pc_method, dataset, rate, metric) and the count, mean, std, min and max over the PC files.
+    Only results that are new since the last call are read, see load_records.
+    :param expt_dir: experiments directory
+    :param out_file: [optional] CSV file to be written. Default: expt_dir/statistics.csv
+    :return: path to the statistics table
+    """
+    groups, columns = load_table(expt_dir)
+    keys, codes = np.unique(['\0'.join(g) for g in groups], return_inverse=True)
+    rows = []
+    for metric, column in columns.items():
+        stats = group_statistics(codes, len(keys), column)
+        for i, key in enumerate(keys):
+            rows.append([*key.split('\0'), metric, *[stats[s][i] for s in STATISTICS]])
+    rows.sort(key=lambda r: r[:4])
+
+    out_file = Path(expt_dir).joinpath('statistics.csv') if out_file is None else Path(out_file)
+    with open(out_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([*GROUP_COLUMNS, 'metric', *STATISTICS])
+        writer.writerows(rows)
+    logger.info(f'Wrote statistics of {len(groups)} results in {len(keys)} groups to {out_file}')
+    return out_file
@@ -0,0 +1,160 @@
+import csv
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Union, List, Dict, Tuple
+from src.evaluation.evaluate import GEOMETRY_METRICS, COLOR_METRICS
+from src.evaluation.aggregate import load_table, group_means
+
+logger = logging.getLogger(__name__)
+
+BPP_METRIC = 'Bits per point bpp after cps'
+# PSNR metric of every RD curve: symmetric D1, D2 and luma PSNR as printed by pc_error
+RD_METRICS = {'p2point': GEOMETRY_METRICS[1],
+              'p2plane': GEOMETRY_METRICS[3],
+              'colour': COLOR_METRICS[3],
+              }
+
+
+def fit_polynomials(
+        x: np.ndarray,
+        y: np.ndarray,
+        mask: np.ndarray,
+        degree: int = 3
+) -> np.ndarray:
+    """
+    Least-squares polynomial fits of many curves at once. Curves are padded to the same number of points,
+    padded points are masked out of the fit.
+    :param x: (C, P) x values
+    :param y: (C, P) y values
+    :param mask: (C, P) True for the points of every curve
+    :param degree: polynomial degree. Default: 3
+    :return: (C, degree + 1) coefficients, lowest order first
+    """
+    x = np.where(mask, x, 0.0)
+    vander = x[..., None] ** np.arange(degree + 1) * mask[..., None]
+    return (np.linalg.pinv(vander) @ np.where(mask, y, 0.0)[..., None])[..., 0]
+
+
+def integrate_polynomials(
+        coef: np.ndarray,
+        lo: np.ndarray,
+        hi: np.ndarray
+) -> np.ndarray:
+    """
+    Definite integrals of many polynomials.
+    :param coef: (N, D + 1) coefficients, lowest order first
+    :param lo: (N,) lower bounds
+    :param hi: (N,) upper bounds
+    :return: (N,) integrals
+    """
+    powers = np.arange(1, coef.shape[1] + 1)
+    return ((hi[:, None] ** powers - lo[:, None] ** powers) * coef / powers).sum(axis=1)
+
+
+def bd_average(
+        x: np.ndarray,
+        y: np.ndarray,
+        mask: np.ndarray,
+        anchor: np.ndarray,
+        test: np.ndarray
+) -> np.ndarray:
+    """
+    Average difference test - anchor of cubic fits y(x), over the x interval covered by both curves.
+    :param x: (C, P) x values of all curves
+    :param y: (C, P) y values of all curves
+    :param mask: (C, P) True for the points of every curve
+    :param anchor: (N,) anchor curve of every pair
+    :param test: (N,) test curve of every pair
+    :return: (N,) average differences, NaN where a curve has fewer than 4 points or the curves do not overlap
+    """
+    coef = fit_polynomials(x, y, mask)
+    x_min = np.where(mask, x, np.inf).min(axis=1)
+    x_max = np.where(mask, x, -np.inf).max(axis=1)
+    lo = np.maximum(x_min[anchor], x_min[test])
+    hi = np.minimum(x_max[anchor], x_max[test])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        diff = (integrate_polynomials(coef[test], lo, hi) - integrate_polynomials(coef[anchor], lo, hi)) / (hi - lo)
+    num_points = mask.sum(axis=1)
+    valid = (num_points[anchor] > 3) & (num_points[test] > 3) & (hi > lo)
+    return np.where(valid, diff, np.nan)
+
+
+def get_rd_curves(
+        keys: np.ndarray,
+        means: Dict[str, np.ndarray]
+) -> Tuple[List[Tuple[str, str, str]], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Build one padded RD curve per (pc_method, dataset, RD metric) from the per-rate means.
+    Points with a non-positive bpp or a non-finite PSNR (e.g. lossless) are left out.
+    :param keys: (G, 3) array of pc_method, dataset, rate
+    :param means: (G,) mean per metric
+    :return:
+        curves: (pc_method, dataset, RD metric name) of every curve
+        bpp: (C, P) bpp values
+        psnr: (C, P) PSNR values
+        mask: (C, P) True for the points of every curve
+    """
+    nan = np.full(len(keys), np.nan)
+    bpp = means.get(BPP_METRIC, nan)
+    points = {}
+    for name, metric in RD_METRICS.items():
+        psnr = means.get(metric, nan)
+        valid = (bpp > 0) & np.isfinite(bpp) & np.isfinite(psnr)
+        for i in np.flatnonzero(valid):
+            points.setdefault((keys[i, 0], keys[i, 1], name), []).append((bpp[i], psnr[i]))
+    curves = sorted(points)
+    num_points = max((len(p) for p in points.values()), default=0)
+    rd = np.zeros((len(curves), num_points, 2))
+    mask = np.zeros((len(curves), num_points), dtype=bool)
+    for c, curve in enumerate(curves):
+        rd[c, :len(points[curve])] = sorted(points[curve])
+        mask[c, :len(points[curve])] = True
+    return curves, rd[..., 0], rd[..., 1], mask
+
+
+def compute_bd(
+        expt_dir: Union[str, Path],
+        out_dir: Union[str, Path] = None
+) -> Tuple[Path, Path]:
+    """
+    Compute BD-rate and BD-PSNR for every ordered pair of PC methods on every dataset and RD metric
+    (p2point, p2plane, colour), from the mean bpp and PSNR of every rate. All curves are fitted and all pairs
+    are integrated as NumPy batches. BD-rate uses log10(bpp) over PSNR, BD-PSNR uses PSNR over log10(bpp).
+    :param expt_dir: experiments directory, read incrementally, see load_table
+    :param out_dir: [optional] directory of the output tables. Default: expt_dir
+    :return:
+        bd_file: CSV with dataset, metric, anchor, test, BD-rate in % and BD-PSNR in dB
+        rd_file: CSV with the RD curve points
+    """
+    keys, means = group_means(*load_table(expt_dir))
+    curves, bpp, psnr, mask = get_rd_curves(keys, means)
+
+    # Every ordered pair of curves of the same dataset and RD metric
+    pairs = [(a, t) for a, anchor in enumerate(curves) for t, test in enumerate(curves)
+             if a != t and anchor[1:] == test[1:]]
+    anchor = np.array([a for a, _ in pairs], dtype=int)
+    test = np.array([t for _, t in pairs], dtype=int)
+    log_bpp = np.log10(np.where(mask, bpp, 1.0))
+    bd_psnr = bd_average(log_bpp, psnr, mask, anchor, test)
+    bd_rate = (10 ** bd_average(psnr, log_bpp, mask, anchor, test) - 1) * 100
+    if np.isnan(bd_rate).any():
+        logger.warning('BD values are NaN for curves with fewer than 4 rates or without overlap')
+
+    out_dir = Path(expt_dir) if out_dir is None else Path(out_dir)
+    bd_file = out_dir.joinpath('bd_metrics.csv')
+    with open(bd_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['dataset', 'metric', 'anchor', 'test', 'BD-rate in %', 'BD-PSNR in dB'])
+        for (a, t), rate, psnr_diff in zip(pairs, bd_rate, bd_psnr):
+            writer.writerow([curves[a][1], curves[a][2], curves[a][0], curves[t][0], rate, psnr_diff])
+
+    rd_file = out_dir.joinpath('rd_curves.csv')
+    with open(rd_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['pc_method', 'dataset', 'metric', 'bpp', 'PSNR'])
+        for c, (pc_method, dataset, name) in enumerate(curves):
+            for p in np.flatnonzero(mask[c]):
+                writer.writerow([pc_method, dataset, name, bpp[c, p], psnr[c, p]])
+    logger.info(f'Wrote {len(pairs)} BD pairs to {bd_file} and {len(curves)} RD curves to {rd_file}')
+    return bd_file, rd_file
@@ -0,0 +1,163 @@
+import json
+import functools
+import logging
+import numpy as np
+from tqdm import tqdm
+from pathlib import Path
+from scipy.spatial import cKDTree
+from multiprocessing import Pool
+from dataclasses import dataclass, field
+from typing import Union, List, Dict, Optional
+from src.evaluation.ply_io import read_header, write_vertex
+from src.evaluation.metrics import read_points, estimate_normals
+from src.utils.hashing import hash_file
+
+logger = logging.getLogger(__name__)
+
+
+def index_file(
+        pc_file: Union[str, Path],
+        normals_dir: Union[str, Path] = None,
+        knn: int = 12
+) -> Dict:
+    """
+    Compute the index entry of an original PC file. With normals_dir, PCs without normals get their normals
+    estimated and written next to the index as a binary PLY with x, y, z, nx, ny, nz.
+    :param pc_file: original PC file
+    :param normals_dir: [optional] directory of the normals PLYs. If None, no normals are estimated. Default: None
+    :param knn: neighbours used to estimate normals
+    :return: index entry
+    """
+    pc_file = Path(pc_file)
+    stat = pc_file.stat()
+    points, normals = read_points(pc_file)
+    entry = {'size': stat.st_size,
+             'mtime_ns': stat.st_mtime_ns,
+             'sha256': hash_file(pc_file),
+             'num_points': read_header(pc_file).element('vertex').count,
+             'bbox_min': points.min(axis=0).tolist(),
+             'bbox_max': points.max(axis=0).tolist(),
+             'has_normals': normals is not None,
+             'normals': None,
+             }
+    if normals is None and normals_dir is not None:
+        normals = estimate_normals(points, cKDTree(points), knn)
+        normals_file = Path(normals_dir).joinpath(pc_file.name + '.normals.ply')
+        vertex = np.empty(len(points), dtype=[(n, 'f8') for n in ('x', 'y', 'z', 'nx', 'ny', 'nz')])
+        for i, n in enumerate(('x', 'y', 'z')):
+            vertex[n] = points[:, i]
+            vertex['n' + n] = normals[:, i]
+        write_vertex(normals_file, vertex)
+        entry['normals'] = normals_file.name
+    return entry
+
+
+@dataclass
+class DatasetIndex:
+    index_dir: Union[str, Path]
+    normals: bool = False
+    entries: Dict[str, Dict] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.index_file = Path(self.index_dir).joinpath('index.json')
+        if self.index_file.exists():
+            with open(self.index_file, 'r') as f:
+                self.entries = json.load(f)
+
+    def is_current(
+            self,
+            pc_file: Union[str, Path]
+    ) -> bool:
+        """
+        Check if the entry of a PC file exists and matches the file's size and modification time.
+        With normals, the entry also has to come with the normals of a PC that carries none.
+        :param pc_file: original PC file
+        :return: True if the entry can be used
+        """
+        entry = self.entries.get(Path(pc_file).name)
+        if entry is None:
+            return False
+        # Entries of older indexes have no has_normals and always come with their normals
+        if self.normals and entry['normals'] is None and not entry.get('has_normals', True):
+            return False
+        stat = Path(pc_file).stat()
+        return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+    def update(
+            self,
+            files: List[Union[str, Path]],
+            num_processes: int = None
+    ):
+        """
+        Index the files that are new or changed since the last update, in parallel, and persist the index.
+        Entries of files that no longer exist are dropped. With normals, the normals of PCs that carry none are
+        estimated too, for precomputed_normals and the in-process metrics.
+        :param files: original PC files of the dataset
+        :param num_processes: [optional] number of pool workers. If None, num_processes = cpu_count. Default: None
+        :return: None
+        """
+        files = [Path(f) for f in files]
+        names = {f.name for f in files}
+        stale = [f for f in files if not self.is_current(f)]
+        removed = [name for name in self.entries if name not in names]
+        for name in removed:
+            self.drop(name)
+        for f in stale:
+            # Also drops the normals PLY of an outdated entry
+            if f.name in self.entries:
+                self.drop(f.name)
+        if stale:
+            logger.info(f'Indexing {len(stale)} of {len(files)} files in {self.index_dir}')
+            Path(self.index_dir).mkdir(parents=True, exist_ok=True)
+            with Pool(processes=num_processes) as p:
+                index_f = functools.partial(index_file, normals_dir=self.index_dir if self.normals else None)
+                entries = list(tqdm(p.imap(index_f, stale), total=len(stale)))
+            for f, entry in zip(stale, entries):
+                self.entries[f.name] = entry
+        if stale or removed:
+            # Write then rename, so an interrupted update never leaves a truncated index behind
+            tmp_file = self.index_file.parent / (self.index_file.name + '.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(self.entries, f, indent=4)
+            tmp_file.replace(self.index_file)
+
+    def drop(
+            self,
+            name: str
+    ):
+        """
+        Drop the entry of a PC file together with its normals PLY.
+        :param name: PC file name
+        :return: None
+        """
+        entry = self.entries.pop(name)
+        if entry['normals'] is not None:
+            Path(self.index_dir).joinpath(entry['normals']).unlink(missing_ok=True)
+
+    def get(
+            self,
+            pc_file: Union[str, Path]
+    ) -> Optional[Dict]:
+        """
+        Get the entry of a PC file.
+        :param pc_file: original PC file
+        :return: index entry, or None if the file is not indexed or changed since
+        """
+        if not self.is_current(pc_file):
+            return None
+        return self.entries[Path(pc_file).name]
+
+    def get_normals_file(
+            self,
+            pc_file: Union[str, Path]
+    ) -> Optional[Path]:
+        """
+        Get the PLY with the precomputed normals of a PC file.
+        :param pc_file: original PC file
+        :return: normals PLY, or None if the PC carries its own normals, the index builds no normals or the PC is not
+                 indexed
+        """
+        entry = self.get(pc_file)
+        if entry is None or entry['normals'] is None:
+            return None
+        return Path(self.index_dir).joinpath(entry['normals'])
@@ -1,9 +1,36 @@
 import re
 import subprocess as sp
 from pathlib import Path
-from plyfile import PlyData
 from dataclasses import dataclass
 from typing import Union, Dict, List
+from src.evaluation.ply_io import count_points
+from src.evaluation.metrics import geometry_distortion, approximate_distortion
+from src.evaluation.dataset_index import DatasetIndex
+from src.evaluation.reference_cache import get_reference_cache
+
+GEOMETRY_METRICS = ['mseF      \\(p2point\\): ',
+                    'mseF,PSNR \\(p2point\\): ',
+                    'mseF      \\(p2plane\\): ',
+                    'mseF,PSNR \\(p2plane\\): ',
+                    'h.        \\(p2point\\): ',
+                    'h.,PSNR   \\(p2point\\): ',
+                    'h.        \\(p2plane\\): ',
+                    'h.,PSNR   \\(p2plane\\): ',
+                    ]
+
+COLOR_METRICS = ['c\\[0\\],    F         : ',
+                 'c\\[1\\],    F         : ',
+                 'c\\[2\\],    F         : ',
+                 'c\\[0\\],PSNRF         : ',
+                 'c\\[1\\],PSNRF         : ',
+                 'c\\[2\\],PSNRF         : ',
+                 'h.c\\[0\\],    F         : ',
+                 'h.c\\[1\\],    F         : ',
+                 'h.c\\[2\\],    F         : ',
+                 'h.c\\[0\\],PSNRF         : ',
+                 'h.c\\[1\\],PSNRF         : ',
+                 'h.c\\[2\\],PSNRF         : ',
+                 ]
 
 
 @dataclass
@@ -14,6 +41,10 @@ class Evaluator:
     pcerror: Union[str, Path]
     color: bool = None
     resolution: int = None
+    backend: str = 'pc_error'
+    index: DatasetIndex = None
+    approximate: Dict = None
+    precomputed_normals: bool = False
 
     @staticmethod
     def find_pattern(metrics, results) -> List[str]:
@@ -42,31 +73,40 @@ class Evaluator:
         :param dec_pc: Decoded PC file to be evaluated
         :return: geoemtry_distortion values such as MSE-PSNR, H-PSNR, Y-PSNR (if applicable)
         """
-        metrics = ['mseF      \(p2point\): ',
-                   'mseF,PSNR \(p2point\): ',
-                   'mseF      \(p2plane\): ',
-                   'mseF,PSNR \(p2plane\): ',
-                   'h.        \(p2point\): ',
-                   'h.,PSNR   \(p2point\): ',
-                   'h.        \(p2plane\): ',
-                   'h.,PSNR   \(p2plane\): ',
-                   ]
+        metrics = self.get_metrics()
+        if self.approximate is not None:
+            return self.run_approximate(orig_pc, dec_pc, metrics)
+        if self.backend == 'in_process':
+            metrics_vals = self.run_in_process(orig_pc, dec_pc)
+        elif self.backend == 'pc_error':
+            metrics_vals = self.run_pcerror(orig_pc, dec_pc, metrics)
+        else:
+            raise ValueError(f'Unknown distortion backend: {self.backend}')
+
+        geometric_distortion = dict(zip(metrics, metrics_vals))
+        return geometric_distortion
 
+    def get_metrics(self) -> List[str]:
+        """
+        Get the metric patterns this evaluator reports, the color metrics only for PCs with color.
+        :return: metric patterns
+        """
+        metrics = list(GEOMETRY_METRICS)
         if self.color:
-            metrics.extend(
-                ['c\[0\],    F         : ',
-                'c\[1\],    F         : ',
-                'c\[2\],    F         : ',
-                'c\[0\],PSNRF         : ',
-                'c\[1\],PSNRF         : ',
-                'c\[2\],PSNRF         : ',
-                'h.c\[0\],    F         : ',
-                'h.c\[1\],    F         : ',
-                'h.c\[2\],    F         : ',
-                'h.c\[0\],PSNRF         : ',
-                'h.c\[1\],PSNRF         : ',
-                'h.c\[2\],PSNRF         : ']
-            )
+            metrics.extend(COLOR_METRICS)
+        return metrics
+
+    def get_pcerror_cmd(
+            self,
+            orig_pc,
+            dec_pc
+    ) -> List[str]:
+        """
+        Get the pc_error command line, run from the pcerror directory.
+        :param orig_pc: Original PC file to be evaluated
+        :param dec_pc: Decoded PC file to be evaluated
+        :return: pc_error command
+        """
         pcerror_cmd = ['./test/pc_error',
                        '--fileA=' + str(orig_pc),
                        '--fileB=' + str(dec_pc),
@@ -76,43 +116,111 @@ class Evaluator:
 
         if self.color:
             pcerror_cmd.append('--color=1')
+        if self.precomputed_normals and self.index is not None:
+            normals_pc = self.index.get_normals_file(orig_pc)
+            if normals_pc is not None:
+                pcerror_cmd.append('--inputNorm=' + str(normals_pc))
+        return pcerror_cmd
+
+    def run_pcerror(
+            self,
+            orig_pc,
+            dec_pc,
+            metrics
+    ) -> List[str]:
+        """
+        Run the pc_error binary and scrape the given metrics from its output.
+        :param orig_pc: Original PC file to be evaluated
+        :param dec_pc: Decoded PC file to be evaluated
+        :param metrics: metric patterns to look for in pc_error output
+        :return: metric values, 'NaN' for the ones pc_error did not print
+        """
         pcerror = sp.run(
-            pcerror_cmd,
+            self.get_pcerror_cmd(orig_pc, dec_pc),
             cwd=self.pcerror,
             stdout=sp.PIPE,
             stderr=sp.DEVNULL,
             universal_newlines=True
         )
         results = pcerror.stdout.splitlines()
-        metrics_vals = self.find_pattern(metrics, results)
+        return self.find_pattern(metrics, results)
 
-        geometric_distortion = dict(zip(metrics, metrics_vals))
-        return geometric_distortion
+    def run_in_process(
+            self,
+            orig_pc,
+            dec_pc
+    ) -> List[Union[float, str]]:
+        """
+        Compute the pc_error metrics in-process with NumPy and KD-trees.
+        The original PC is taken from the reference cache of the current process, so its points, normals and
+        KD-tree are shared by every rate and PC method evaluated against it. The color metrics reuse the two
+        nearest neighbours the geometry pass queries and only look up the points with tied neighbours again,
+        see neighbour_colors.
+        :param orig_pc: Original PC file to be evaluated
+        :param dec_pc: Decoded PC file to be evaluated
+        :return: metric values in the same order as GEOMETRY_METRICS (+ COLOR_METRICS)
+        """
+        normals_pc = self.index.get_normals_file(orig_pc) if self.index is not None else None
+        reference = get_reference_cache().get(orig_pc, normals_pc)
+        return geometry_distortion(orig_pc, dec_pc, self.resolution, reference=reference, color=bool(self.color))
+
+    def run_approximate(
+            self,
+            orig_pc,
+            dec_pc,
+            metrics
+    ) -> Dict[str, Union[float, str, bool]]:
+        """
+        Estimate the metrics in-process from a sample of the points, whatever the backend.
+        See approximate_distortion for the options in self.approximate, e.g. {'fraction': 0.05}.
+        :param orig_pc: Original PC file to be evaluated
+        :param dec_pc: Decoded PC file to be evaluated
+        :param metrics: metric patterns to report
+        :return: estimated metric values, a '<metric>CI low'/'<metric>CI high' pair per PSNR metric,
+                 and 'Approximate distortion' set to True
+        """
+        normals_pc = self.index.get_normals_file(orig_pc) if self.index is not None else None
+        reference = get_reference_cache().get(orig_pc, normals_pc)
+        values, bounds = approximate_distortion(orig_pc, dec_pc, self.resolution, reference=reference,
+                                                color=bool(self.color), **self.approximate)
+        distortion = dict(zip(metrics, values))
+        for i, (low, high) in bounds.items():
+            distortion[metrics[i] + 'CI low'] = low
+            distortion[metrics[i] + 'CI high'] = high
+        distortion['Approximate distortion'] = True
+        distortion['Distortion confidence'] = self.approximate.get('confidence', 0.95)
+        return distortion
 
     def evaluate_bpp(
             self,
             orig_pc,
             enc_pc,
-            dec_pc
+            dec_pc,
+            enc_share: float = None
     ) -> Dict[str, float]:
         """
         Evaluate bits per point (bpp) between the original PC and decoded PC
         :param orig_pc: Original PC file to be evaluated
         :param enc_pc: Encoded PC file to be evaluated
         :param dec_pc: Decoded PC file to be evaluated
+        :param enc_share:   [optional]
+                            share of enc_pc that belongs to orig_pc, for bitstreams of several PCs. Default: None
         :return: bpp: bits per point
         """
-        orig_ply = PlyData.read(orig_pc)
+        entry = self.index.get(orig_pc) if self.index is not None else None
+        num_points = entry['num_points'] if entry is not None else count_points(orig_pc)
 
-        orig_size = Path.stat(orig_pc).st_size / 1000
+        orig_size = (entry['size'] if entry is not None else Path.stat(orig_pc).st_size) / 1000
         enc_size = Path.stat(enc_pc).st_size / 1000
+        if enc_share is not None:
+            enc_size *= enc_share
         dec_size = Path.stat(dec_pc).st_size / 1000
         compression_ratio = orig_size / enc_size
-        bpp_orig = (orig_size * 1000 * 8) / len(orig_ply['vertex']['x'])
-        bpp = (enc_size * 1000 * 8) / len(orig_ply['vertex']['x'])
+        bpp_orig = (orig_size * 1000 * 8) / num_points
+        bpp = (enc_size * 1000 * 8) / num_points
 
         bpp_values = {'Orig PC size in KB': orig_size,
-                      'Orig num points': len(orig_ply['vertex']['x']),
+                      'Orig num points': num_points,
                       'Enc PC size in KB': enc_size,
                       'Dec PC size in KB': dec_size,
                       'Compression Ratio': compression_ratio,
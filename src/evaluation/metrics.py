@@ -0,0 +1,456 @@
+import numpy as np
+from pathlib import Path
+from statistics import NormalDist
+from scipy.spatial import cKDTree
+from src.evaluation.ply_io import read_vertex
+from typing import Union, List, Dict, Tuple, Optional
+
+# Bump when the values of the in-process metrics change, so results cached with them are recomputed
+METRICS_VERSION = 3
+
+
+def read_points(
+        pc_file: Union[str, Path]
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Read point positions and, if present, point normals of a PC file.
+    :param pc_file: PC file to be read
+    :return:
+        points: (N, 3) float64 array of x, y, z
+        normals: (N, 3) float64 array of nx, ny, nz, or None if the file has no normals
+    """
+    vertex = read_vertex(pc_file)
+    names = vertex.dtype.names
+    points = np.column_stack([vertex[axis] for axis in ('x', 'y', 'z')]).astype(np.float64)
+    normals = None
+    if all(n in names for n in ('nx', 'ny', 'nz')):
+        normals = np.column_stack([vertex[n] for n in ('nx', 'ny', 'nz')]).astype(np.float64)
+    return points, normals
+
+
+def read_colors(
+        pc_file: Union[str, Path]
+) -> Optional[np.ndarray]:
+    """
+    Read the point colors of a PC file as YCbCr, see rgb_to_ycbcr.
+    :param pc_file: PC file to be read
+    :return: (N, 3) float64 array of Y, Cb, Cr, or None if the file has no colors
+    """
+    vertex = read_vertex(pc_file)
+    if not all(c in vertex.dtype.names for c in ('red', 'green', 'blue')):
+        return None
+    return rgb_to_ycbcr(np.column_stack([vertex[c] for c in ('red', 'green', 'blue')]).astype(np.float64))
+
+
+def rgb_to_ycbcr(rgb: np.ndarray) -> np.ndarray:
+    """
+    Convert 8-bit RGB to YCbCr with the BT.709 matrix, as pc_error does before computing color metrics.
+    :param rgb: (N, 3) R, G, B values in [0, 255]
+    :return: (N, 3) Y, Cb, Cr values, Cb and Cr offset by 128
+    """
+    bt709 = np.array([[0.2126, 0.7152, 0.0722],
+                      [-0.1146, -0.3854, 0.5],
+                      [0.5, -0.4542, -0.0458]])
+    return rgb @ bt709.T + np.array([0.0, 128.0, 128.0])
+
+
+def estimate_normals(
+        points: np.ndarray,
+        tree: cKDTree,
+        knn: int = 12
+) -> np.ndarray:
+    """
+    Estimate unit normals by PCA over the k nearest neighbours of every point.
+    Only used when the original PC does not carry normals.
+    :param points: (N, 3) point positions
+    :param tree: KD-tree built over points
+    :param knn: number of neighbours used for each local plane fit
+    :return: (N, 3) unit normals
+    """
+    k = min(knn, len(points))
+    _, idx = tree.query(points, k=k, workers=-1)
+    neighbours = points[idx.reshape(len(points), k)]
+    centered = neighbours - neighbours.mean(axis=1, keepdims=True)
+    cov = np.einsum('nki,nkj->nij', centered, centered) / k
+    # eigh sorts eigenvalues ascending, the normal is the smallest one's eigenvector
+    _, eig_vecs = np.linalg.eigh(cov)
+    return eig_vecs[:, :, 0]
+
+
+def transfer_normals(
+        normals_a: np.ndarray,
+        a_to_b: np.ndarray,
+        b_to_a: np.ndarray,
+        num_b: int
+) -> np.ndarray:
+    """
+    Transfer the normals of cloud A onto cloud B the way pc_error does: every B point averages the normals of
+    the A points whose nearest neighbour it is, and B points hit by no A point take the normal of their own
+    nearest neighbour in A.
+    :param normals_a: (N_A, 3) normals of cloud A
+    :param a_to_b: (N_A,) index of the nearest B point for every A point
+    :param b_to_a: (N_B,) index of the nearest A point for every B point
+    :param num_b: number of points in cloud B
+    :return: (N_B, 3) normals of cloud B
+    """
+    normals_b = np.zeros((num_b, 3), dtype=np.float64)
+    counts = np.bincount(a_to_b, minlength=num_b)
+    np.add.at(normals_b, a_to_b, normals_a)
+    hit = counts > 0
+    normals_b[hit] /= counts[hit, None]
+    normals_b[~hit] = normals_a[b_to_a[~hit]]
+    return normals_b
+
+
+def get_psnr(
+        dist,
+        peak: float,
+        factor: float = 3.0
+):
+    """
+    PSNR as computed by pc_error: 10 * log10(factor * peak^2 / dist). Geometry uses factor 3.
+    :param dist: distortion value(s)
+    :param peak: peak signal value, e.g. 2**resolution - 1
+    :param factor: multiplier applied to the peak energy
+    :return: PSNR value(s), inf where dist is 0
+    """
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(factor * peak * peak / np.asarray(dist, dtype=np.float64))
+
+
+def one_way_errors(
+        ref_points: np.ndarray,
+        ref_normals: np.ndarray,
+        test_points: np.ndarray,
+        test_to_ref: np.ndarray,
+        sq_dist: np.ndarray
+) -> Tuple[float, float, float, float]:
+    """
+    Distortion of a test cloud against a reference cloud, looping over the test points.
+    :param ref_points: (N_ref, 3) reference points
+    :param ref_normals: (N_ref, 3) reference normals
+    :param test_points: (N_test, 3) test points
+    :param test_to_ref: (N_test,) index of the nearest reference point for every test point
+    :param sq_dist: (N_test,) squared distance to that nearest reference point
+    :return: p2point mse, p2plane mse, p2point hausdorff, p2plane hausdorff
+    """
+    err = test_points - ref_points[test_to_ref]
+    proj = np.einsum('ij,ij->i', err, ref_normals[test_to_ref]) ** 2
+    return float(sq_dist.mean()), float(proj.mean()), float(sq_dist.max()), float(proj.max())
+
+
+def is_tied(dist: np.ndarray) -> np.ndarray:
+    """
+    Check which distances equal the nearest distance of their row.
+    :param dist: (M, k) ascending neighbour distances, inf for missing neighbours
+    :return: (M, k) bool
+    """
+    return np.isclose(dist, dist[:, :1], rtol=1e-9, atol=1e-9)
+
+
+def neighbour_colors(
+        tree: cKDTree,
+        colors: np.ndarray,
+        query_points: np.ndarray,
+        nearest: Tuple[np.ndarray, np.ndarray] = None,
+        max_neighbours: int = 32,
+        chunk_size: int = 65536
+) -> np.ndarray:
+    """
+    Color of the nearest neighbour of every query point. Like pc_error, the colors of all neighbours at the same
+    nearest distance are averaged, which is the common case on voxel grids. At most max_neighbours ties are taken.
+    Only the query points whose two nearest neighbours are tied are looked up again, with 8 neighbours and then,
+    for the few points where all of them are tied, with max_neighbours.
+    :param tree: KD-tree of the cloud the colors belong to
+    :param colors: (N, 3) colors of that cloud
+    :param query_points: (M, 3) points looking up a color
+    :param nearest: [optional] (distances, indices), both (M, 2), of the two nearest neighbours of every query
+                    point, e.g. from the geometry pass. If None, they are queried here. Default: None
+    :param max_neighbours: most neighbours at the nearest distance to average. Default: 32
+    :param chunk_size: query points per KD-tree query, bounds the memory of the neighbour lists. Default: 65536
+    :return: (M, 3) averaged colors
+    """
+    if nearest is None:
+        nearest = tree.query(query_points, k=2, workers=-1)
+    dist, idx = nearest
+    out = colors[idx[:, 0]].astype(np.float64)
+    tied = np.flatnonzero(is_tied(dist)[:, 1])
+    k = 2
+    while len(tied) and k < min(max_neighbours, len(colors)):
+        k = min(k * 4, max_neighbours, len(colors))
+        more = []
+        for begin in range(0, len(tied), chunk_size):
+            rows = tied[begin:begin + chunk_size]
+            dist, idx = tree.query(query_points[rows], k=k, workers=-1)
+            tie = is_tied(dist)
+            out[rows] = np.einsum('nk,nkc->nc', tie / tie.sum(axis=1, keepdims=True), colors[idx])
+            # Points whose k neighbours are all tied may have more
+            more.append(rows[tie[:, -1]])
+        tied = np.concatenate(more)
+    return out
+
+
+def color_distortion(
+        colors_a: np.ndarray,
+        colors_b: np.ndarray,
+        colors_b_at_a: np.ndarray,
+        colors_a_at_b: np.ndarray
+) -> List[float]:
+    """
+    Symmetric color distortion between cloud A and cloud B. Every point is compared with the color of its nearest
+    neighbour(s) in the other cloud, see neighbour_colors, the final value of every channel is the worse of both
+    directions.
+    :param colors_a: (N_A, 3) YCbCr colors of cloud A
+    :param colors_b: (N_B, 3) YCbCr colors of cloud B
+    :param colors_b_at_a: (N_A, 3) color of the nearest B point(s) for every A point
+    :param colors_a_at_b: (N_B, 3) color of the nearest A point(s) for every B point
+    :return: values in pc_error's print order, see COLOR_METRICS:
+        c[0..2] mse, c[0..2] PSNR, h.c[0..2] hausdorff, h.c[0..2] PSNR
+    """
+    # 1. A as reference, loop over B. 2. B as reference, loop over A
+    sq_err_1 = (colors_b - colors_a_at_b) ** 2
+    sq_err_2 = (colors_a - colors_b_at_a) ** 2
+    mse = np.maximum(sq_err_1.mean(axis=0), sq_err_2.mean(axis=0))
+    hausdorff = np.maximum(sq_err_1.max(axis=0), sq_err_2.max(axis=0))
+    return [*mse.tolist(), *get_psnr(mse, 255, factor=1.0).tolist(),
+            *hausdorff.tolist(), *get_psnr(hausdorff, 255, factor=1.0).tolist()]
+
+
+def load_reference(
+        orig_pc: Union[str, Path],
+        knn: int = 12,
+        normals_pc: Union[str, Path] = None,
+        reference=None,
+        color: bool = False
+) -> Tuple[np.ndarray, np.ndarray, cKDTree, Optional[np.ndarray]]:
+    """
+    Get the points, normals, KD-tree and colors of the original PC, from the reference cache if given.
+    See geometry_distortion for the parameters.
+    :return: points, normals, KD-tree and YCbCr colors (None without color or if orig_pc has none)
+    """
+    if reference is not None:
+        return reference.points, reference.normals, reference.tree, reference.colors
+    points, normals = read_points(orig_pc)
+    if normals is None and normals_pc is not None:
+        _, normals = read_points(normals_pc)
+    tree = cKDTree(points)
+    if normals is None:
+        normals = estimate_normals(points, tree, knn)
+    return points, normals, tree, read_colors(orig_pc) if color else None
+
+
+def geometry_distortion(
+        orig_pc: Union[str, Path],
+        dec_pc: Union[str, Path],
+        resolution: int,
+        knn: int = 12,
+        normals_pc: Union[str, Path] = None,
+        reference=None,
+        color: bool = False
+) -> List[float]:
+    """
+    Symmetric D1 (p2point) and D2 (p2plane) geometry distortion between the original PC (A) and the decoded
+    PC (B), computed in-process with KD-trees instead of the pc_error binary.
+    :param orig_pc: Original PC file to be evaluated
+    :param dec_pc: Decoded PC file to be evaluated
+    :param resolution: dataset resolution, the PSNR peak is 2**resolution - 1
+    :param knn: neighbours used to estimate normals if orig_pc has none
+    :param normals_pc: [optional] PC file with precomputed normals of orig_pc, see DatasetIndex. Default: None
+    :param reference:   [optional]
+                        already loaded points, normals, colors and KD-tree of orig_pc, see ReferenceCache.
+                        Default: None
+    :param color:   also compute the color metrics from the same correspondences, see color_distortion. They are NaN
+                    if either PC has no colors. Default: False
+    :return: values in pc_error's print order:
+        mseF p2point, mseF PSNR p2point, mseF p2plane, mseF PSNR p2plane,
+        h. p2point, h. PSNR p2point, h. p2plane, h. PSNR p2plane
+        followed by the 12 color values with color
+    """
+    points_a, normals_a, tree_a, colors_a = load_reference(orig_pc, knn, normals_pc, reference, color)
+    points_b, _ = read_points(dec_pc)
+    tree_b = cKDTree(points_b)
+
+    # With color, the second nearest neighbour tells which points have tied neighbours, see neighbour_colors
+    k = 2 if color else 1
+    nearest_ba = tree_a.query(points_b, k=k, workers=-1)
+    nearest_ab = tree_b.query(points_a, k=k, workers=-1)
+    sq_dist_ba, b_to_a = (v.reshape(len(points_b), k)[:, 0] for v in nearest_ba)
+    sq_dist_ab, a_to_b = (v.reshape(len(points_a), k)[:, 0] for v in nearest_ab)
+    sq_dist_ba = sq_dist_ba ** 2
+    sq_dist_ab = sq_dist_ab ** 2
+    normals_b = transfer_normals(normals_a, a_to_b, b_to_a, len(points_b))
+
+    # 1. A as reference, loop over B. 2. B as reference, loop over A. Final value is the worse of the two.
+    errors_1 = one_way_errors(points_a, normals_a, points_b, b_to_a, sq_dist_ba)
+    errors_2 = one_way_errors(points_b, normals_b, points_a, a_to_b, sq_dist_ab)
+    mse_p2point, mse_p2plane, h_p2point, h_p2plane = np.maximum(errors_1, errors_2).tolist()
+
+    peak = 2 ** resolution - 1
+    values = [mse_p2point, float(get_psnr(mse_p2point, peak)),
+              mse_p2plane, float(get_psnr(mse_p2plane, peak)),
+              h_p2point, float(get_psnr(h_p2point, peak)),
+              h_p2plane, float(get_psnr(h_p2plane, peak))]
+    if color:
+        colors_b = read_colors(dec_pc)
+        if colors_a is None or colors_b is None:
+            values.extend([float('nan')] * 12)
+        else:
+            values.extend(color_distortion(colors_a, colors_b, neighbour_colors(tree_b, colors_b, points_a, nearest_ab),
+                                           neighbour_colors(tree_a, colors_a, points_b, nearest_ba)))
+    return values
+
+
+def sample_indices(
+        points: np.ndarray,
+        size: int,
+        stratified: bool,
+        rng: np.random.Generator,
+        grid: int = 64
+) -> np.ndarray:
+    """
+    Pick a random subset of the points. Stratified sampling orders the points by the cells of a coarse grid and
+    picks one random point out of every run of len(points) / size consecutive points, so every part of
+    the cloud is covered in proportion to its points.
+    :param points: (N, 3) point positions
+    :param size: number of points to pick
+    :param stratified: stratify by position instead of sampling uniformly
+    :param rng: random generator
+    :param grid: number of grid cells along the longest side of the bounding box. Default: 64
+    :return: (size,) sorted point indices, all points if size >= N
+    """
+    n = len(points)
+    if size >= n:
+        return np.arange(n)
+    if not stratified:
+        return np.sort(rng.choice(n, size, replace=False))
+    cell_size = max(np.ptp(points, axis=0).max() / grid, 1e-12)
+    cells = np.floor((points - points.min(axis=0)) / cell_size).astype(np.int64)
+    order = np.lexsort((cells[:, 2], cells[:, 1], cells[:, 0]))
+    step = n / size
+    return np.sort(order[((np.arange(size) + rng.random(size)) * step).astype(np.int64)])
+
+
+def mean_interval(
+        samples: np.ndarray,
+        population: int,
+        z: float
+) -> Tuple[float, float]:
+    """
+    Estimate the mean of a population from a sample, with the normal-approximation confidence interval
+    and the finite population correction.
+    :param samples: (n,) sampled values
+    :param population: population size N
+    :param z: standard normal quantile of the confidence level
+    :return: estimated mean, half width of the interval
+    """
+    n = len(samples)
+    std = samples.std(ddof=1) if n > 1 else 0.0
+    return float(samples.mean()), float(z * std / np.sqrt(n) * np.sqrt(max(1 - n / population, 0.0)))
+
+
+def approximate_distortion(
+        orig_pc: Union[str, Path],
+        dec_pc: Union[str, Path],
+        resolution: int,
+        fraction: float = None,
+        count: int = None,
+        stratified: bool = True,
+        confidence: float = 0.95,
+        seed: int = 0,
+        knn: int = 12,
+        normals_pc: Union[str, Path] = None,
+        reference=None,
+        color: bool = False
+) -> Tuple[List[float], Dict[int, Tuple[float, float]]]:
+    """
+    Estimate the metrics of geometry_distortion from a random subset of the points of each cloud. Only the
+    sampled points are looked up in the KD-tree of the other cloud. MSE values are estimated with a confidence
+    interval, the symmetric value takes the worse of both directions for the estimate and for each bound.
+    p2plane towards B uses the normals of the sampled A points instead of the normals transferred onto B,
+    and Hausdorff values are the maximum over the sample, i.e. lower bounds of the full ones.
+    :param orig_pc: Original PC file to be evaluated
+    :param dec_pc: Decoded PC file to be evaluated
+    :param resolution: dataset resolution, the PSNR peak is 2**resolution - 1
+    :param fraction: [optional] fraction of the points of each cloud to sample. Default: None
+    :param count: [optional] number of points of each cloud to sample, used if fraction is None. Default: None
+    :param stratified: stratify the sample by position, see sample_indices. Default: True
+    :param confidence: confidence level of the intervals. Default: 0.95
+    :param seed: seed of the sample, so reruns pick the same points. Default: 0
+    :param knn: see geometry_distortion
+    :param normals_pc: see geometry_distortion
+    :param reference: see geometry_distortion
+    :param color: see geometry_distortion
+    :return:
+        values: estimated values in the order of geometry_distortion
+        bounds: (low, high) PSNR bounds per position of a PSNR value in values
+    """
+    points_a, normals_a, tree_a, colors_a = load_reference(orig_pc, knn, normals_pc, reference, color)
+    points_b, _ = read_points(dec_pc)
+    tree_b = cKDTree(points_b)
+
+    def sample_size(n):
+        return n if fraction is None and count is None else \
+            max(int(np.ceil(fraction * n)) if fraction is not None else count, 2)
+
+    rng = np.random.default_rng(seed)
+    sample_b = sample_indices(points_b, sample_size(len(points_b)), stratified, rng)
+    sample_a = sample_indices(points_a, sample_size(len(points_a)), stratified, rng)
+    colors_b = read_colors(dec_pc) if color else None
+    k = 2 if colors_a is not None and colors_b is not None else 1
+    nearest_ba = tree_a.query(points_b[sample_b], k=k, workers=-1)
+    nearest_ab = tree_b.query(points_a[sample_a], k=k, workers=-1)
+    dist_ba, b_to_a = (v.reshape(len(sample_b), k)[:, 0] for v in nearest_ba)
+    dist_ab, a_to_b = (v.reshape(len(sample_a), k)[:, 0] for v in nearest_ab)
+    err_ba = points_b[sample_b] - points_a[b_to_a]
+    err_ab = points_a[sample_a] - points_b[a_to_b]
+    # (errors looping over B, errors looping over A) of every metric
+    errors = [(dist_ba ** 2, dist_ab ** 2),
+              (np.einsum('ij,ij->i', err_ba, normals_a[b_to_a]) ** 2,
+               np.einsum('ij,ij->i', err_ab, normals_a[sample_a]) ** 2)]
+    peaks = [(2 ** resolution - 1, 3.0)] * 2
+    if k == 2:
+        sq_err_1 = (colors_b[sample_b] - neighbour_colors(tree_a, colors_a, points_b[sample_b], nearest_ba)) ** 2
+        sq_err_2 = (colors_a[sample_a] - neighbour_colors(tree_b, colors_b, points_a[sample_a], nearest_ab)) ** 2
+        errors.extend((sq_err_1[:, c], sq_err_2[:, c]) for c in range(3))
+        peaks.extend([(255, 1.0)] * 3)
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    mse, psnr, hausdorff, h_psnr, psnr_bounds = [], [], [], [], []
+    for (err_1, err_2), (peak, factor) in zip(errors, peaks):
+        (mean_1, half_1), (mean_2, half_2) = mean_interval(err_1, len(points_b), z), \
+            mean_interval(err_2, len(points_a), z)
+        mse.append(max(mean_1, mean_2))
+        psnr.append(float(get_psnr(mse[-1], peak, factor)))
+        # A higher MSE bound is a lower PSNR bound
+        psnr_bounds.append((float(get_psnr(max(mean_1 + half_1, mean_2 + half_2), peak, factor)),
+                            float(get_psnr(max(mean_1 - half_1, mean_2 - half_2, 0.0), peak, factor))))
+        hausdorff.append(float(max(err_1.max(), err_2.max())))
+        h_psnr.append(float(get_psnr(hausdorff[-1], peak, factor)))
+
+    values = [mse[0], psnr[0], mse[1], psnr[1], hausdorff[0], h_psnr[0], hausdorff[1], h_psnr[1]]
+    bounds = {1: psnr_bounds[0], 3: psnr_bounds[1]}
+    if color:
+        if len(mse) == 2:
+            values.extend([float('nan')] * 12)
+        else:
+            values.extend([*mse[2:], *psnr[2:], *hausdorff[2:], *h_psnr[2:]])
+            bounds.update({11 + c: psnr_bounds[2 + c] for c in range(3)})
+    return values, bounds
+
+
+def compare_with_pcerror(
+        values: List[float],
+        pcerror_values: List[str],
+        rtol: float = 1e-4
+) -> List[int]:
+    """
+    Compare in-process values with values scraped from a recorded pc_error run.
+    :param values: values returned by the in-process backend
+    :param pcerror_values: values returned by Evaluator.find_pattern on pc_error output
+    :param rtol: relative tolerance
+    :return: positions of the metrics that do not match
+    """
+    expected = np.array([float(v) for v in pcerror_values])
+    actual = np.asarray(values, dtype=np.float64)
+    close = np.isclose(actual, expected, rtol=rtol, equal_nan=True)
+    return np.flatnonzero(~close).tolist()
@@ -0,0 +1,164 @@
+import numpy as np
+from pathlib import Path
+from plyfile import PlyData, PlyElement
+from dataclasses import dataclass, field
+from typing import Union, List, Tuple
+
+PLY_TYPES = {'char': 'i1', 'int8': 'i1',
+             'uchar': 'u1', 'uint8': 'u1',
+             'short': 'i2', 'int16': 'i2',
+             'ushort': 'u2', 'uint16': 'u2',
+             'int': 'i4', 'int32': 'i4',
+             'uint': 'u4', 'uint32': 'u4',
+             'float': 'f4', 'float32': 'f4',
+             'double': 'f8', 'float64': 'f8',
+             }
+
+BYTE_ORDER = {'binary_little_endian': '<',
+              'binary_big_endian': '>',
+              'ascii': '='
+              }
+
+
+@dataclass
+class PlyElementHeader:
+    name: str
+    count: int
+    properties: List[Tuple[str, str]] = field(default_factory=list)
+    has_list: bool = False
+
+
+@dataclass
+class PlyHeader:
+    format: str
+    elements: List[PlyElementHeader]
+    header_size: int
+
+    def element(self, name: str) -> PlyElementHeader:
+        for element in self.elements:
+            if element.name == name:
+                return element
+        raise KeyError(f'PLY file has no element named {name}')
+
+
+def read_header(
+        pc_file: Union[str, Path]
+) -> PlyHeader:
+    """
+    Parse only the header of a PLY file, without touching the data section.
+    :param pc_file: PC file to be read
+    :return: PLY header with format, elements and the byte size of the header
+    """
+    elements = []
+    ply_format = None
+    with open(pc_file, 'rb') as f:
+        if f.readline().strip() != b'ply':
+            raise ValueError(f'{pc_file} is not a PLY file')
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f'{pc_file} has no end_header')
+            words = line.decode('ascii').split()
+            if not words or words[0] in ('comment', 'obj_info'):
+                continue
+            if words[0] == 'end_header':
+                break
+            if words[0] == 'format':
+                ply_format = words[1]
+            elif words[0] == 'element':
+                elements.append(PlyElementHeader(words[1], int(words[2])))
+            elif words[0] == 'property':
+                if words[1] == 'list':
+                    elements[-1].has_list = True
+                    elements[-1].properties.append((words[4], words[3]))
+                else:
+                    elements[-1].properties.append((words[2], PLY_TYPES[words[1]]))
+        header_size = f.tell()
+    return PlyHeader(ply_format, elements, header_size)
+
+
+def count_points(
+        pc_file: Union[str, Path]
+) -> int:
+    """
+    Get the number of points of a PC file from its header alone.
+    :param pc_file: PC file to be read
+    :return: number of vertices
+    """
+    return read_header(pc_file).element('vertex').count
+
+
+def read_vertex(
+        pc_file: Union[str, Path]
+) -> np.ndarray:
+    """
+    Read the vertex element of a PC file as a structured array.
+    Binary files are returned as a read-only zero-copy np.memmap view, ASCII files are parsed in one pass
+    with NumPy. Files whose data cannot be mapped directly (list properties before/in the vertex element)
+    fall back to plyfile.
+    :param pc_file: PC file to be read
+    :return: structured array with one field per vertex property (x, y, z, and e.g. red, green, blue, nx, ny, nz)
+    """
+    header = read_header(pc_file)
+    order = BYTE_ORDER[header.format]
+    offset = header.header_size
+    for element in header.elements:
+        if element.has_list:
+            return PlyData.read(str(pc_file))['vertex'].data
+        dtype = np.dtype([(name, order + kind) for name, kind in element.properties])
+        if element.name == 'vertex':
+            break
+        if header.format == 'ascii':
+            # Preceding ASCII elements have to be skipped line by line, leave that to plyfile
+            return PlyData.read(str(pc_file))['vertex'].data
+        offset += element.count * dtype.itemsize
+    else:
+        raise KeyError('PLY file has no element named vertex')
+
+    if header.format != 'ascii':
+        return np.memmap(pc_file, dtype=dtype, mode='r', offset=offset, shape=(element.count,))
+
+    with open(pc_file, 'rb') as f:
+        f.seek(offset)
+        lines = [f.readline() for _ in range(element.count)]
+    values = np.fromstring(b' '.join(lines), dtype=np.float64, sep=' ')
+    values = values.reshape(element.count, len(element.properties))
+    vertex = np.empty(element.count, dtype=dtype)
+    for i, name in enumerate(dtype.names):
+        vertex[name] = values[:, i]
+    return vertex
+
+
+def write_vertex(
+        pc_file: Union[str, Path],
+        vertex: np.ndarray
+):
+    """
+    Write a structured vertex array as a binary little-endian PLY file.
+    :param pc_file: PC file to be written
+    :param vertex: structured array with one field per vertex property
+    :return: None
+    """
+    PlyData([PlyElement.describe(vertex, 'vertex')], byte_order='<').write(str(pc_file))
+
+
+def same_vertices(
+        pc_a: Union[str, Path],
+        pc_b: Union[str, Path]
+) -> bool:
+    """
+    Check if two PC files hold the same points with the same properties, regardless of the header, the storage
+    format and the point order.
+    :param pc_a: PC file
+    :param pc_b: PC file
+    :return: True if both files hold the same vertices
+    """
+    vertex_a, vertex_b = read_vertex(pc_a), read_vertex(pc_b)
+    if sorted(vertex_a.dtype.names) != sorted(vertex_b.dtype.names) or len(vertex_a) != len(vertex_b):
+        return False
+    names = sorted(vertex_a.dtype.names)
+    rows_a = np.column_stack([vertex_a[name] for name in names]).astype(np.float64)
+    rows_b = np.column_stack([vertex_b[name] for name in names]).astype(np.float64)
+    rows_a = rows_a[np.lexsort(rows_a.T[::-1])]
+    rows_b = rows_b[np.lexsort(rows_b.T[::-1])]
+    return bool(np.array_equal(rows_a, rows_b))
@@ -0,0 +1,241 @@
+import os
+import re
+import json
+import shutil
+import logging
+import functools
+import numpy as np
+from pathlib import Path
+from scipy.spatial import cKDTree
+from multiprocessing import Pool
+from typing import Union, List, Dict, Tuple, Optional
+from src.evaluation.ply_io import read_vertex, write_vertex
+from src.evaluation.metrics import estimate_normals
+from src.utils.hashing import hash_file, make_key
+
+logger = logging.getLogger(__name__)
+
+# Bump when the output of preprocess_file changes, so cached outputs are rebuilt
+PREPROCESS_VERSION = 1
+
+# Frame-numbered file names, e.g. longdress_vox10_1051
+FRAME_NAME = re.compile(r'^(?P<prefix>.*?)\d+$')
+
+
+def voxelize(
+        points: np.ndarray,
+        colors: Optional[np.ndarray],
+        depth: int,
+        bbox: Tuple[List[float], List[float]] = None
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Voxelize a PC to a grid of 2**depth voxels along the longest side of a bounding box.
+    Points that fall into the same voxel are merged, their colors averaged.
+    :param points: (N, 3) point positions
+    :param colors: (N, 3) RGB colors, or None
+    :param depth: bit depth of the voxel coordinates
+    :param bbox:    [optional]
+                    (min, max) corners of the bounding box, e.g. of all frames of a sequence, so that every frame
+                    gets the same scale and offset. It has to contain the points. If None, the bounding box of
+                    the points. Default: None
+    :return:
+        voxels: (M, 3) int64 voxel coordinates in [0, 2**depth - 1], sorted by x, y, z
+        colors: (M, 3) average RGB color of every voxel, or None
+    """
+    if bbox is None:
+        bbox = (points.min(axis=0), points.max(axis=0))
+    bbox_min, bbox_max = np.asarray(bbox[0], dtype=np.float64), np.asarray(bbox[1], dtype=np.float64)
+    extent = (bbox_max - bbox_min).max()
+    scale = (2 ** depth - 1) / extent if extent > 0 else 1.0
+    voxels = np.round((points - bbox_min) * scale).astype(np.int64)
+    keys = (voxels[:, 0] << (2 * depth)) | (voxels[:, 1] << depth) | voxels[:, 2]
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    voxels = voxels[first]
+    if colors is None:
+        return voxels, None
+    counts = np.bincount(inverse)
+    colors = np.column_stack([np.bincount(inverse, weights=colors[:, c]) / counts for c in range(3)])
+    return voxels, colors
+
+
+def preprocess_file(
+        src_file: Union[str, Path],
+        dst_file: Union[str, Path],
+        depth: int,
+        normals: bool = False,
+        knn: int = 12,
+        bbox: Tuple[List[float], List[float]] = None
+) -> int:
+    """
+    Voxelize a raw PC file and write it as a binary PLY with x, y, z (+ red, green, blue) (+ nx, ny, nz).
+    :param src_file: raw PC file
+    :param dst_file: PC file to be written
+    :param depth: bit depth of the voxel coordinates
+    :param normals: estimate normals of the voxelized PC. Default: False
+    :param knn: neighbours used to estimate normals. Default: 12
+    :param bbox: [optional] bounding box to voxelize in, see voxelize. Default: None
+    :return: number of points of the voxelized PC
+    """
+    vertex = read_vertex(src_file)
+    points = np.column_stack([vertex[axis] for axis in ('x', 'y', 'z')]).astype(np.float64)
+    colors = None
+    if all(c in vertex.dtype.names for c in ('red', 'green', 'blue')):
+        colors = np.column_stack([vertex[c] for c in ('red', 'green', 'blue')]).astype(np.float64)
+    voxels, colors = voxelize(points, colors, depth, bbox)
+
+    fields = [(axis, 'f4') for axis in ('x', 'y', 'z')]
+    if colors is not None:
+        fields += [(c, 'u1') for c in ('red', 'green', 'blue')]
+    if normals:
+        fields += [(n, 'f4') for n in ('nx', 'ny', 'nz')]
+    out = np.empty(len(voxels), dtype=fields)
+    for i, axis in enumerate(('x', 'y', 'z')):
+        out[axis] = voxels[:, i]
+    if colors is not None:
+        for i, c in enumerate(('red', 'green', 'blue')):
+            out[c] = np.clip(np.round(colors[:, i]), 0, 255)
+    if normals:
+        voxel_points = voxels.astype(np.float64)
+        estimated = estimate_normals(voxel_points, cKDTree(voxel_points), knn)
+        for i, n in enumerate(('nx', 'ny', 'nz')):
+            out[n] = estimated[:, i]
+
+    # Write then rename, so an interrupted run never leaves a truncated PLY behind
+    dst_file = Path(dst_file)
+    tmp_file = dst_file.parent / (dst_file.name + '.tmp')
+    write_vertex(tmp_file, out)
+    tmp_file.replace(dst_file)
+    return len(voxels)
+
+
+def get_bounds(src_file: Union[str, Path]) -> Tuple[List[float], List[float]]:
+    """
+    Get the bounding box of a raw PC file.
+    :param src_file: raw PC file
+    :return: (min, max) corners
+    """
+    vertex = read_vertex(src_file)
+    points = np.column_stack([vertex[axis] for axis in ('x', 'y', 'z')]).astype(np.float64)
+    return points.min(axis=0).tolist(), points.max(axis=0).tolist()
+
+
+def is_frame_sequence(files: List[Path]) -> bool:
+    """
+    Check if raw PC files are the numbered frames of one sequence, e.g. longdress_vox10_1051.ply ... _1350.ply.
+    :param files: raw PC files
+    :return: True if all file names are one prefix followed by a frame number
+    """
+    matches = [FRAME_NAME.match(f.stem) for f in files]
+    return len(files) > 1 and all(matches) and len({m.group('prefix') for m in matches}) == 1
+
+
+def hash_sources(
+        files: List[Path],
+        state_file: Path
+) -> Dict[str, str]:
+    """
+    Get the SHA-256 of every raw PC file, re-hashing only files whose size or modification time changed.
+    :param files: raw PC files
+    :param state_file: JSON file of the hashes of the previous run
+    :return: hash per file path
+    """
+    state = {}
+    if state_file.exists():
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    hashes = {}
+    for f in files:
+        stat = f.stat()
+        entry = state.get(str(f.resolve()))
+        if entry is None or (entry['size'], entry['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': hash_file(f)}
+            state[str(f.resolve())] = entry
+        hashes[str(f)] = entry['sha256']
+    tmp_file = state_file.parent / (state_file.name + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=4)
+    tmp_file.replace(state_file)
+    return hashes
+
+
+def is_same_file(
+        out_file: Path,
+        cache_file: Path
+) -> bool:
+    """
+    Check if a dataset file is the hard link or the copy of a cache entry.
+    :param out_file: dataset file
+    :param cache_file: cache entry
+    :return: True if out_file is up to date
+    """
+    if not out_file.exists():
+        return False
+    out_stat, cache_stat = out_file.stat(), cache_file.stat()
+    return os.path.samestat(out_stat, cache_stat) or \
+        (out_stat.st_size, out_stat.st_mtime_ns) == (cache_stat.st_size, cache_stat.st_mtime_ns)
+
+
+def prepare_dataset(
+        raw_dir: Union[str, Path],
+        out_dir: Union[str, Path],
+        depth: int,
+        normals: bool = False,
+        knn: int = 12,
+        cache_dir: Union[str, Path] = None,
+        num_processes: int = None,
+        common_bbox: bool = None
+) -> List[Path]:
+    """
+    Prepare a dataset from raw PC files: voxelize every file to the target bit depth, in parallel.
+    Every file is scaled by its own bounding box, or with common_bbox by the bounding box of all files, so that
+    the frames of a sequence keep their relative scale and position.
+    Outputs are cached by the content hash of the raw file and the parameters, so preparing the same raw files
+    again, e.g. at another depth or after some files changed, only processes what is not cached yet.
+    Outputs are hard-linked (or copied) from the cache into out_dir under the name of their raw file.
+    :param raw_dir: directory of the raw PLY files
+    :param out_dir: dataset directory to be written, e.g. dataset_dir/<dataset name>
+    :param depth: bit depth of the voxel coordinates, i.e. the resolution passed to run_experiments
+    :param normals: estimate normals of the voxelized PCs. Default: False
+    :param knn: neighbours used to estimate normals. Default: 12
+    :param cache_dir: [optional] cache directory, shared by datasets. Default: out_dir/../.preprocess
+    :param num_processes: [optional] number of pool workers. If None, num_processes = cpu_count. Default: None
+    :param common_bbox: [optional]
+                        voxelize every file in the bounding box of all files. If None, only if the files are the
+                        numbered frames of one sequence, see is_frame_sequence. Default: None
+    :return: PC files of the prepared dataset
+    """
+    files = sorted(Path(raw_dir).glob('*.ply'))
+    out_dir = Path(out_dir)
+    cache_dir = out_dir.parent.joinpath('.preprocess') if cache_dir is None else Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    hashes = hash_sources(files, cache_dir.joinpath('sources.json'))
+    params = {'depth': depth, 'normals': normals, 'knn': knn if normals else None, 'version': PREPROCESS_VERSION}
+    bbox = None
+    if common_bbox or (common_bbox is None and is_frame_sequence(files)):
+        with Pool(processes=num_processes) as p:
+            bounds = p.map(get_bounds, files)
+        bbox = (np.min([b[0] for b in bounds], axis=0).tolist(), np.max([b[1] for b in bounds], axis=0).tolist())
+        params['bbox'] = bbox
+        logger.info(f'Voxelizing all files in their common bounding box {bbox}')
+    cache_files = [cache_dir.joinpath(make_key({'sha256': hashes[str(f)], **params}) + '.ply') for f in files]
+    stale = [(f, c) for f, c in zip(files, cache_files) if not c.exists()]
+    if stale:
+        logger.info(f'Voxelizing {len(stale)} of {len(files)} files to depth {depth}')
+        with Pool(processes=num_processes) as p:
+            preprocess_f = functools.partial(preprocess_file, depth=depth, normals=normals, knn=knn, bbox=bbox)
+            p.starmap(preprocess_f, stale)
+
+    out_files = []
+    for f, cache_file in zip(files, cache_files):
+        out_file = out_dir.joinpath(f.name)
+        if not is_same_file(out_file, cache_file):
+            out_file.unlink(missing_ok=True)
+            try:
+                os.link(cache_file, out_file)
+            except OSError:
+                shutil.copy2(cache_file, out_file)
+        out_files.append(out_file)
+    logger.info(f'Prepared {len(out_files)} files in {out_dir}')
+    return out_files
@@ -0,0 +1,152 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from pathlib import Path
+from scipy.spatial import cKDTree
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Union, Tuple, Optional
+from src.evaluation.metrics import read_points, read_colors, estimate_normals
+
+# Points the reference caches of all workers of a pool hold together, split evenly across the workers
+REFERENCE_CACHE_POINTS = 20_000_000
+
+
+@dataclass
+class ReferenceCloud:
+    points: np.ndarray
+    normals: np.ndarray
+    tree: cKDTree
+    colors: np.ndarray = None
+
+    @property
+    def num_points(self) -> int:
+        return len(self.points)
+
+
+# With a share_dir, the points, normals and colors of every loaded cloud are also written there as .npy files,
+# and other processes memory-map them instead of parsing the PC and estimating its normals again. Only the
+# KD-tree is built per process.
+@dataclass
+class ReferenceCache:
+    max_points: int = 20_000_000
+    share_dir: Union[str, Path] = None
+    clouds: OrderedDict = field(default_factory=OrderedDict)
+
+    def get(
+            self,
+            orig_pc: Union[str, Path],
+            normals_pc: Union[str, Path] = None,
+            knn: int = 12
+    ) -> ReferenceCloud:
+        """
+        Get the points, normals, YCbCr colors and KD-tree of an original PC, loading them on a miss. The least
+        recently used clouds are evicted once the cached clouds hold more than max_points points, the latest one
+        is always kept.
+        :param orig_pc: Original PC file
+        :param normals_pc: [optional] PC file with precomputed normals of orig_pc, see DatasetIndex. Default: None
+        :param knn: neighbours used to estimate normals if neither orig_pc nor normals_pc has them
+        :return: reference cloud
+        """
+        key = self.get_key(orig_pc)
+        if key in self.clouds:
+            self.clouds.move_to_end(key)
+            return self.clouds[key]
+        shared_dir = None
+        if self.share_dir is not None:
+            digest = hashlib.sha256(json.dumps([*key, str(normals_pc), knn]).encode()).hexdigest()
+            shared_dir = Path(self.share_dir).joinpath(digest)
+        cloud = load_shared(shared_dir) if shared_dir is not None else None
+        if cloud is None:
+            points, normals = read_points(orig_pc)
+            if normals is None and normals_pc is not None:
+                _, normals = read_points(normals_pc)
+            tree = cKDTree(points)
+            if normals is None:
+                normals = estimate_normals(points, tree, knn)
+            cloud = ReferenceCloud(points, normals, tree, read_colors(orig_pc))
+            if shared_dir is not None:
+                store_shared(shared_dir, cloud)
+        self.clouds[key] = cloud
+        while len(self.clouds) > 1 and sum(c.num_points for c in self.clouds.values()) > self.max_points:
+            self.clouds.popitem(last=False)
+        return cloud
+
+    @staticmethod
+    def get_key(orig_pc: Union[str, Path]) -> Tuple[str, int, int]:
+        """
+        Cache key of an original PC: its path, size and modification time, so a changed file is reloaded.
+        :param orig_pc: Original PC file
+        :return: cache key
+        """
+        stat = Path(orig_pc).stat()
+        return str(Path(orig_pc).resolve()), stat.st_size, stat.st_mtime_ns
+
+
+def load_shared(shared_dir: Path) -> Optional[ReferenceCloud]:
+    """
+    Memory-map a reference cloud another process stored, see store_shared, and build its KD-tree.
+    :param shared_dir: directory of the cloud in the share_dir of the cache
+    :return: reference cloud, None if no process stored it yet
+    """
+    if not shared_dir.is_dir():
+        return None
+    points = np.load(shared_dir.joinpath('points.npy'), mmap_mode='r')
+    normals = np.load(shared_dir.joinpath('normals.npy'), mmap_mode='r')
+    colors_file = shared_dir.joinpath('colors.npy')
+    colors = np.load(colors_file, mmap_mode='r') if colors_file.exists() else None
+    return ReferenceCloud(points, normals, cKDTree(points), colors)
+
+
+def store_shared(
+        shared_dir: Path,
+        cloud: ReferenceCloud
+):
+    """
+    Store the arrays of a reference cloud for other processes. The directory is written under a temporary name
+    and renamed, so readers never see a partial cloud; if another process stored it first, its copy is kept.
+    :param shared_dir: directory of the cloud in the share_dir of the cache
+    :param cloud: reference cloud
+    :return: None
+    """
+    shared_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=shared_dir.name + '.', dir=shared_dir.parent))
+    np.save(tmp_dir.joinpath('points.npy'), cloud.points)
+    np.save(tmp_dir.joinpath('normals.npy'), cloud.normals)
+    if cloud.colors is not None:
+        np.save(tmp_dir.joinpath('colors.npy'), cloud.colors)
+    try:
+        tmp_dir.rename(shared_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# Every process, e.g. every pool worker, keeps its own cache. Pools default to cpu_count workers
+_reference_cache = ReferenceCache(max_points=REFERENCE_CACHE_POINTS // (os.cpu_count() or 1))
+
+
+def get_reference_cache() -> ReferenceCache:
+    """
+    Get the reference cache of the current process.
+    :return: reference cache
+    """
+    return _reference_cache
+
+
+def set_reference_cache_size(
+        max_points: int,
+        share_dir: Union[str, Path] = None
+):
+    """
+    Bound the reference cache of the current process, e.g. as a pool initializer with
+    REFERENCE_CACHE_POINTS // number of workers.
+    :param max_points: maximum number of points held by the cached clouds
+    :param share_dir: [optional] directory the workers of a pool share loaded clouds through, see ReferenceCache.
+                      Default: None
+    :return: None
+    """
+    _reference_cache.max_points = max_points
+    _reference_cache.share_dir = share_dir
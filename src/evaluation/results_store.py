@@ -0,0 +1,191 @@
+import os
+import json
+import sqlite3
+import logging
+from pathlib import Path
+from multiprocessing import util
+from dataclasses import dataclass, field
+from typing import Union, List, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pc_method TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    rate TEXT NOT NULL,
+    pc_file TEXT NOT NULL,
+    data TEXT NOT NULL,
+    cache_key TEXT
+);
+CREATE INDEX IF NOT EXISTS results_slot ON results (pc_method, dataset, rate, pc_file);
+"""
+
+
+# The store lives in the shared experiments directory, e.g. on NFS, so it keeps SQLite's rollback journal:
+# WAL needs shared memory and does not work across hosts. Rows carry the cache key of their task (see
+# Base.get_cache_keys), so with the sqlite sink the store is also the result cache: a result and its cache entry
+# are committed in the same transaction, and a buffered result lost with its process is simply recomputed.
+
+
+@dataclass
+class ResultsStore:
+    db_file: Union[str, Path]
+    batch_size: int = 64
+    pending: List[Tuple[str, str, str, str, str, str]] = field(default_factory=list)
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the store, creating it on first use, and add the cache_key column to stores of earlier versions.
+        :return: connection
+        """
+        Path(self.db_file).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_file), timeout=60)
+        conn.executescript(SCHEMA)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(results)')]
+        if 'cache_key' not in columns:
+            with conn:
+                conn.execute('ALTER TABLE results ADD COLUMN cache_key TEXT')
+        return conn
+
+    def append(
+            self,
+            pc_method: str,
+            dataset: str,
+            rate: str,
+            pc_file: str,
+            data: Dict,
+            cache_key: str = None
+    ):
+        """
+        Append the result of a (file, rate) task. Records are committed in batches of batch_size, see flush.
+        :param pc_method: PC method name
+        :param dataset: dataset name
+        :param rate: rate id
+        :param pc_file: original PC file name
+        :param data: evaluation data
+        :param cache_key: [optional] cache key of the task, see cache_keys. Default: None
+        :return: None
+        """
+        self.pending.append((pc_method, dataset, rate, pc_file, json.dumps(data), cache_key))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Commit the pending records in one transaction.
+        :return: None
+        """
+        if not self.pending:
+            return
+        conn = self.connect()
+        with conn:
+            conn.executemany('INSERT INTO results (pc_method, dataset, rate, pc_file, data, cache_key) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+        conn.close()
+        self.pending = []
+
+    def read(
+            self,
+            pc_method: str = None,
+            dataset: str = None,
+            rate: str = None
+    ) -> List[Tuple[str, str, str, str, Dict]]:
+        """
+        Read the latest record of every (PC method, dataset, rate, file), optionally filtered.
+        :param pc_method: [optional] PC method name. Default: None
+        :param dataset: [optional] dataset name. Default: None
+        :param rate: [optional] rate id. Default: None
+        :return: list of (pc_method, dataset, rate, pc_file, data)
+        """
+        filters = {'pc_method': pc_method, 'dataset': dataset, 'rate': rate}
+        where = ''.join(f' AND {column} = ?' for column, value in filters.items() if value is not None)
+        conn = self.connect()
+        rows = conn.execute('SELECT pc_method, dataset, rate, pc_file, data FROM results WHERE id IN '
+                            '(SELECT MAX(id) FROM results GROUP BY pc_method, dataset, rate, pc_file)' + where +
+                            ' ORDER BY pc_method, dataset, rate, pc_file',
+                            [value for value in filters.values() if value is not None]).fetchall()
+        conn.close()
+        return [(*row[:4], json.loads(row[4])) for row in rows]
+
+    def cache_keys(
+            self,
+            pc_method: str
+    ) -> Dict[Tuple[str, str, str], str]:
+        """
+        Get the cache key of the latest committed record of every (dataset, rate, file) of a PC method.
+        :param pc_method: PC method name
+        :return: cache key per (dataset, rate, pc_file), None for records stored without one
+        """
+        conn = self.connect()
+        rows = conn.execute('SELECT dataset, rate, pc_file, cache_key FROM results WHERE id IN '
+                            '(SELECT MAX(id) FROM results WHERE pc_method = ? GROUP BY dataset, rate, pc_file)',
+                            (pc_method,)).fetchall()
+        conn.close()
+        return {tuple(row[:3]): row[3] for row in rows}
+
+    def read_new(
+            self,
+            after_id: int = 0
+    ) -> Tuple[List[Tuple[str, str, str, str, Dict]], int]:
+        """
+        Read the records appended after a given row, oldest first, e.g. to aggregate results incrementally.
+        :param after_id: id of the last row read before. Default: 0
+        :return:
+            records: list of (pc_method, dataset, rate, pc_file, data)
+            last_id: id of the last row read
+        """
+        conn = self.connect()
+        rows = conn.execute('SELECT id, pc_method, dataset, rate, pc_file, data FROM results WHERE id > ? ORDER BY id',
+                            (after_id,)).fetchall()
+        conn.close()
+        last_id = rows[-1][0] if rows else after_id
+        return [(*row[1:5], json.loads(row[5])) for row in rows], last_id
+
+    def export_json(
+            self,
+            expt_dir: Union[str, Path],
+            **filters
+    ) -> int:
+        """
+        Export the latest records in the per-file JSON layout, i.e. expt_dir/pc_method/dataset/rate/eval/file.json.
+        :param expt_dir: experiments directory
+        :param filters: [optional] pc_method, dataset and/or rate, see read
+        :return: number of exported files
+        """
+        records = self.read(**filters)
+        for pc_method, dataset, rate, pc_file, data in records:
+            eval_file = Path(expt_dir).joinpath(pc_method, dataset, rate, 'eval', pc_file + '.json')
+            eval_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(eval_file, 'w') as f:
+                json.dump(data, f, indent=4)
+        return len(records)
+
+
+# One store per (process, database), flushed when the process exits normally, e.g. a pool worker after close()
+_stores: Dict[tuple, ResultsStore] = {}
+
+
+def get_results_store(db_file: Union[str, Path]) -> ResultsStore:
+    """
+    Get the results store of the current process, creating it on first use.
+    :param db_file: SQLite database of the run
+    :return: results store
+    """
+    key = (os.getpid(), str(db_file))
+    if key not in _stores:
+        store = ResultsStore(db_file)
+        util.Finalize(store, store.flush, exitpriority=10)
+        _stores[key] = store
+    return _stores[key]
+
+
+def flush_results_stores():
+    """
+    Commit the pending records of every results store of the current process.
+    :return: None
+    """
+    for (pid, _), store in _stores.items():
+        if pid == os.getpid():
+            store.flush()
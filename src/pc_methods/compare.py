@@ -0,0 +1,111 @@
+import os
+import logging
+import tempfile
+import functools
+from tqdm import tqdm
+from pathlib import Path
+from multiprocessing import Pool, Value
+from typing import List, Tuple
+from src.pc_methods.pc_base import Base
+from src.pc_methods.timing import init_worker
+from src.pc_methods.tracing import export_trace
+from src.evaluation.dataset_index import DatasetIndex
+from src.evaluation.reference_cache import set_reference_cache_size, REFERENCE_CACHE_POINTS
+from src.evaluation.results_store import flush_results_stores
+
+logger = logging.getLogger(__name__)
+
+
+def process_comparison_task(
+        pc_methods: List[Base],
+        task: Tuple[int, Tuple[Path, int]]
+) -> bool:
+    """
+    Process a (PC method, file, rate) task of a comparison run. A failed task is logged and does not stop the others.
+    :param pc_methods: PC methods being compared
+    :param task: (index of the PC method, (original PC file, index of the rate in cfg['params']))
+    :return: False if the task failed
+    """
+    method_id, method_task = task
+    try:
+        pc_methods[method_id].process_task(method_task)
+    except Exception:
+        logger.exception(f'{pc_methods[method_id].get_pc_method_name()} failed for {method_task}')
+        return False
+    return True
+
+
+def run_comparison(
+        pc_methods: List[Base],
+        dataset_name: str,
+        resolution: int,
+        color: bool,
+        metric_backend: str = 'pc_error',
+        use_cache: bool = True,
+        num_processes: int = None,
+        reference_cache_points: int = REFERENCE_CACHE_POINTS,
+        **options
+):
+    """
+    Run several PC methods on one dataset in a single pool. The dataset is validated and indexed once,
+    and the (PC method, file, rate) tasks are ordered by original PC, largest first, and scheduled one by one,
+    so the tasks of one PC run side by side in different workers. The workers share the reference (points,
+    normals, colors) of every original PC through the reference cache, see ReferenceCache: the first worker
+    loads it, the others memory-map it and only build their own KD-tree.
+    Every PC method writes its results exactly as run_experiments does. Not available with pipeline, orchestrator,
+    batch_size or sequence_mode.
+    :param pc_methods: PC methods to compare, e.g. [Draco(), GPCC(), VPCC()]
+    :param dataset_name: dataset's name
+    :param resolution: dataset's resolution
+    :param color: dataset's color
+    :param metric_backend: distortion backend, see run_experiments. The reference cache only serves the
+                           'in_process' backend. Default: 'pc_error'
+    :param use_cache: skip tasks whose results are already cached, see run_experiments. Default: True
+    :param num_processes:   [optional]
+                            number of CPU pool workers/ processes. If None, num_processes = cpu_count. Default: None
+    :param reference_cache_points:  maximum number of original PC points the reference caches of all workers keep
+                                    together. Default: REFERENCE_CACHE_POINTS
+    :param options: further options for every PC method, e.g. timing, skip_decode or trace. See configure
+    :return: number of failed tasks
+    """
+    unsupported = [name for name in ('pipeline', 'orchestrator', 'batch_size', 'sequence_mode') if options.get(name)]
+    if unsupported:
+        logger.error(f'{", ".join(unsupported)} cannot be used in a comparison run')
+        raise ValueError
+    for pc_method in pc_methods:
+        pc_method.configure(resolution, color, metric_backend, use_cache, **options)
+    files = pc_methods[0].is_valid_dataset(dataset_name)
+    dataset_index = DatasetIndex(Path(pc_methods[0].dataset_dir).joinpath('.index', dataset_name),
+                                 normals=any(pc_method.needs_normals() for pc_method in pc_methods))
+    dataset_index.update(files, num_processes)
+
+    # get_tasks orders the original PCs by expected cost, the tasks of every PC keep method and rate order
+    groups = {f: [] for f, _ in pc_methods[0].get_tasks(files)}
+    for method_id, pc_method in enumerate(pc_methods):
+        pc_method.dataset_index = dataset_index
+        for task in pc_method.prepare_tasks(files):
+            groups[task[0]].append((method_id, task))
+    tasks = [task for group in groups.values() for task in group]
+    logger.info(f'Comparing {len(pc_methods)} PC methods in {len(tasks)} tasks '
+                f'of {sum(1 for group in groups.values() if group)} original PCs')
+
+    num_processes = num_processes or os.cpu_count()
+    Path(pc_methods[0].expt_dir).mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='.reference-', dir=pc_methods[0].expt_dir) as share_dir:
+        with Pool(processes=num_processes, initializer=init_worker,
+                  initargs=(Value('i', 0), num_processes, set_reference_cache_size,
+                            (max(reference_cache_points // num_processes, 1), share_dir))) as p:
+            process_f = functools.partial(process_comparison_task, pc_methods)
+            failed = sum(not ok for ok in tqdm(p.imap_unordered(process_f, tasks), total=len(tasks)))
+            # Let the workers exit normally, so that they flush their results stores
+            p.close()
+            p.join()
+    flush_results_stores()
+    for pc_method in pc_methods:
+        if pc_method.result_cache is not None:
+            logger.info(f'{pc_method.get_pc_method_name()}: {pc_method.result_cache.report()}')
+        if pc_method.trace_dir is not None:
+            export_trace(pc_method.trace_dir)
+    if failed:
+        logger.error(f'{failed} of {len(tasks)} tasks failed')
+    return failed
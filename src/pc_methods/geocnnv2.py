@@ -3,14 +3,22 @@ from src.pc_methods.pc_base import Base
 
 
 class GeoCNNv2(Base):
+    supports_batching = True
+
     def __init__(self):
         super().__init__()
 
     def encode(self, orig_pc, enc_pc) -> List[str]:
+        return self.encode_batch([orig_pc], [enc_pc])
+
+    def decode(self, enc_file, dec_file) -> List[str]:
+        return self.decode_batch([enc_file], [dec_file])
+
+    def encode_batch(self, orig_pcs, enc_pcs) -> List[str]:
         cmd = ['python3',
                self.cfg['encoder'],
-               '--input_files=' + str(orig_pc),
-               '--output_files=' + str(enc_pc),
+               '--input_files', *[str(f) for f in orig_pcs],
+               '--output_files', *[str(f) for f in enc_pcs],
                '--opt_metrics=' + str(self.cfg['opt_metrics']),
                '--checkpoint_dir=' + str(self.cfg['params'][self.id]['checkpoint_dir']),
                '--model_config=' + str(self.cfg['params'][self.id]['model_config']),
@@ -19,12 +27,16 @@ class GeoCNNv2(Base):
                ]
         return cmd
 
-    def decode(self, enc_file, dec_file) -> List[str]:
+    def decode_batch(self, enc_files, dec_files) -> List[str]:
         cmd = ['python3',
                self.cfg['decoder'],
-               '--input_files=' + enc_file,
-               '--output_files=' + dec_file,
+               '--input_files', *[str(f) for f in enc_files],
+               '--output_files', *[str(f) for f in dec_files],
                '--checkpoint_dir=' + str(self.cfg['params'][self.id]['checkpoint_dir']),
                '--model_config=' + str(self.cfg['params'][self.id]['model_config']),
                ]
-        return cmd
\ No newline at end of file
+        return cmd
+
+    def get_model_key(self):
+        params = self.cfg['params'][self.id]
+        return f"{params['checkpoint_dir']}/{params['model_config']}"
@@ -3,10 +3,12 @@ from src.pc_methods.pc_base import Base
 
 
 class GPCC(Base):
+    emits_reconstruction = True
+
     def __init__(self):
         super().__init__()
 
-    def encode(self, orig_pc, enc_pc) -> List[str]:
+    def encode(self, orig_pc, enc_pc, dec_pc=None) -> List[str]:
         cmd = [self.cfg['encoder'],
                '--uncompressedDataPath=' + str(orig_pc),
                '--compressedStreamPath=' + str(enc_pc),
@@ -21,12 +23,16 @@ class GPCC(Base):
                ]
         if self.color:
             cmd.append('--attribute=color')
+        if dec_pc is not None:
+            # Same output format as decode, so the reconstruction and a verification decode can be compared
+            cmd.extend(['--reconstructedDataPath=' + str(dec_pc),
+                        '--outputBinaryPly=1'])
         return cmd
 
     def decode(self, enc_file, dec_file) -> List[str]:
         cmd = [self.cfg['decoder'],
-               '--compressedStreamPath=' + enc_file,
-               '--reconstructedDataPath=' + dec_file,
+               '--compressedStreamPath=' + str(enc_file),
+               '--reconstructedDataPath=' + str(dec_file),
                '--mode=1',
                '--outputBinaryPly=1'
                ]
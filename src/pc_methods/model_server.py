@@ -0,0 +1,280 @@
+"""
+Long-lived worker for the Python-based (neural) codecs.
+
+The server is started with the codec's own interpreter, e.g. `python3 model_server.py --capacity 2` from the
+codec's pcc_directory, so this module only uses the standard library. It reads one JSON request per line from
+stdin and answers one JSON line on stdout. Every request names a coder script and its argv, exactly as the
+subprocess command would: the interpreter and the framework imports (TensorFlow/PyTorch) stay resident across
+requests instead of being paid for every file and every rate.
+
+A coder script is served only if it keeps its checkpoint resident by defining two hooks:
+    load_model(argv) -> model       load the checkpoint the request refers to
+    serve(model, argv)              run the compress/decompress request with the loaded model
+Loaded models are cached by model key (ckpt_dir/modelname) with LRU eviction. Runs asking for a server for
+scripts without the hooks are rejected up front, see has_serve_hooks: re-running a TF1 script as __main__ in one
+long-lived interpreter would pile up graphs and variables across requests. Requests that still reach the server
+for such a script are answered as unsupported and the client runs them as separate processes.
+"""
+import os
+import ast
+import sys
+import json
+import time
+import runpy
+import select
+import argparse
+import resource
+import subprocess as sp
+from pathlib import Path
+from multiprocessing import util
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Union, List, Dict, Any
+
+
+class ModelServerError(RuntimeError):
+    pass
+
+
+class ModelServerUnsupported(ModelServerError):
+    pass
+
+
+@dataclass
+class ModelCache:
+    capacity: int = 1
+    models: OrderedDict = field(default_factory=OrderedDict)
+
+    def get(
+            self,
+            key: str,
+            namespace: Dict[str, Any],
+            argv: List[str]
+    ):
+        """
+        Get a resident model, loading it with the script's load_model hook on a miss
+        and evicting the least recently used model when the cache is full.
+        :param key: model key, i.e. ckpt_dir/modelname
+        :param namespace: globals of the coder script
+        :param argv: argv of the request
+        :return: loaded model
+        """
+        if key in self.models:
+            self.models.move_to_end(key)
+            return self.models[key]
+        while len(self.models) >= max(self.capacity, 1):
+            self.models.popitem(last=False)
+        model = namespace['load_model'](argv)
+        self.models[key] = model
+        return model
+
+
+def has_serve_hooks(script: Union[str, Path]) -> bool:
+    """
+    Check if a coder script defines the load_model and serve hooks at module level, without importing it,
+    so the frameworks it imports are not loaded.
+    :param script: coder script
+    :return: True if both hooks are defined
+    """
+    with open(script, 'r') as f:
+        tree = ast.parse(f.read(), filename=str(script))
+    names = {node.name for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    return {'load_model', 'serve'} <= names
+
+
+def run_script(
+        script: str,
+        argv: List[str],
+        model_key: str,
+        scripts: Dict[str, Dict[str, Any]],
+        cache: ModelCache
+) -> bool:
+    """
+    Run one request in this process, if the coder script defines the load_model and serve hooks.
+    :param script: coder script, relative to the working directory of the server
+    :param argv: argv of the request, argv[0] is the script
+    :param model_key: [optional] model key of the request, i.e. ckpt_dir/modelname
+    :param scripts: namespaces of the coder scripts loaded so far
+    :param cache: resident models
+    :return: False if the request is not supported, i.e. the script has no hooks or the request no model key
+    """
+    script_dir = str(Path(script).resolve().parent)
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+    sys.argv = list(argv)
+    if script not in scripts:
+        scripts[script] = runpy.run_path(script, run_name='pcc_model_server')
+    namespace = scripts[script]
+    if model_key is None or 'load_model' not in namespace or 'serve' not in namespace:
+        return False
+    namespace['serve'](cache.get(model_key, namespace, argv), argv)
+    return True
+
+
+def serve_forever(capacity: int):
+    """
+    Answer requests from stdin until it is closed, i.e. until the client exits.
+    The protocol streams are moved off fds 0/1 first, so whatever the coders print cannot corrupt them.
+    :param capacity: maximum number of resident models
+    :return: None
+    """
+    requests = os.fdopen(os.dup(0), 'r')
+    replies = os.fdopen(os.dup(1), 'w')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+    scripts = {}
+    cache = ModelCache(capacity=capacity)
+    for line in requests:
+        request = json.loads(line)
+        if request.get('cpus'):
+            os.sched_setaffinity(0, request['cpus'])
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        begin = time.perf_counter()
+        error = None
+        supported = True
+        try:
+            supported = run_script(request['script'], request['argv'], request.get('model_key'), scripts, cache)
+        except BaseException as e:
+            error = f'{type(e).__name__}: {e}'
+        wall = time.perf_counter() - begin
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        replies.write(json.dumps({'error': error,
+                                  'supported': supported,
+                                  'wall': wall,
+                                  'user': after.ru_utime - before.ru_utime,
+                                  'sys': after.ru_stime - before.ru_stime,
+                                  'rss': after.ru_maxrss}) + '\n')
+        replies.flush()
+
+
+@dataclass
+class ModelServer:
+    python: str
+    cwd: Union[str, Path]
+    capacity: int = 1
+    timeout: float = None
+    process: sp.Popen = None
+    unsupported: set = field(default_factory=set)
+
+    def start(self):
+        """
+        Start the server with the codec's interpreter, in the codec's directory.
+        :return: None
+        """
+        self.process = sp.Popen(
+            [self.python, str(Path(__file__).resolve()), '--capacity', str(self.capacity)],
+            cwd=self.cwd,
+            stdin=sp.PIPE,
+            stdout=sp.PIPE,
+            text=True,
+        )
+
+    def run_trial(
+            self,
+            cmd: List[str],
+            cwd: Union[str, Path] = None,
+            cpus: List[int] = None,
+            model_key: str = None
+    ) -> Dict[str, float]:
+        """
+        Run a `python3 script args...` command on the server. Same measurements as timing.run_trial,
+        except that peak RSS is the peak of the server so far, which includes every resident model.
+        :param cmd: command that would otherwise be run as a subprocess
+        :param cwd: unused, the server always runs from the codec's directory
+        :param cpus: [optional] cores to pin the server to for this request. Default: None
+        :param model_key: [optional] model key, i.e. ckpt_dir/modelname. Default: None
+        :return: wall time, user and system CPU time in sec, and peak RSS in KB
+        """
+        if cmd[1] in self.unsupported:
+            raise ModelServerUnsupported(f'{cmd[1]} does not define the load_model and serve hooks')
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        request = {'script': cmd[1], 'argv': [str(arg) for arg in cmd[1:]], 'model_key': model_key, 'cpus': cpus}
+        try:
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+            ready, _, _ = select.select([self.process.stdout], [], [], self.timeout)
+            if not ready:
+                self.kill()
+                raise ModelServerError(f'{cmd[1]} timed out after {self.timeout} sec on the model server')
+            reply = self.process.stdout.readline()
+        except OSError as e:
+            raise ModelServerError(f'Model server in {self.cwd} is not reachable: {e}')
+        if not reply:
+            raise ModelServerError(f'Model server in {self.cwd} exited with code {self.process.wait()}')
+        reply = json.loads(reply)
+        if not reply['supported']:
+            self.unsupported.add(cmd[1])
+            raise ModelServerUnsupported(f'{cmd[1]} does not define the load_model and serve hooks')
+        if reply['error'] is not None:
+            raise ModelServerError(f'{cmd[1]} failed on the model server: {reply["error"]}')
+        return {key: reply[key] for key in ('wall', 'user', 'sys', 'rss')}
+
+    def close(self, timeout: float = 60):
+        """
+        Stop the server. Closing stdin lets it finish the request in flight and exit, it is killed after timeout.
+        :param timeout: seconds to wait for the server to exit. Default: 60
+        :return: None
+        """
+        if self.process is not None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout)
+            except sp.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def kill(self):
+        """
+        Kill the server, e.g. when a request timed out. The next request starts a new one.
+        :return: None
+        """
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+# One server per (process, interpreter, codec directory): pool workers never share a server started before a fork
+_servers: Dict[tuple, ModelServer] = {}
+
+
+def get_model_server(
+        python: str,
+        cwd: Union[str, Path],
+        capacity: int = 1,
+        timeout: float = None
+) -> ModelServer:
+    """
+    Get the model server of the current process for a codec, creating it on first use. Servers are closed
+    when the process exits normally, e.g. a pool worker after close(), see close_model_servers.
+    :param python: interpreter of the codec, e.g. 'python3'
+    :param cwd: directory of the codec
+    :param capacity: maximum number of resident models. Default: 1
+    :param timeout: [optional] seconds a request may take before the server is killed. Default: None
+    :return: model server
+    """
+    key = (os.getpid(), python, str(cwd))
+    if key not in _servers:
+        if not any(k[0] == os.getpid() for k in _servers):
+            util.Finalize(None, close_model_servers, exitpriority=10)
+        _servers[key] = ModelServer(python, cwd, capacity, timeout)
+    return _servers[key]
+
+
+def close_model_servers():
+    """
+    Close the model servers of the current process.
+    :return: None
+    """
+    for key in [k for k in _servers if k[0] == os.getpid()]:
+        _servers.pop(key).close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve compress/decompress requests of a Python-based codec.')
+    parser.add_argument('--capacity', type=int, default=1, help='maximum number of resident models')
+    serve_forever(parser.parse_args().capacity)
@@ -0,0 +1,258 @@
+import os
+import re
+import time
+import signal
+import asyncio
+import logging
+from tqdm import tqdm
+from pathlib import Path
+from typing import Union, List, Dict, Tuple, Callable
+from src.pc_methods.timing import skipped_timing
+from src.pc_methods.tracing import trace_span
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('encode', 'decode', 'evaluate')
+
+
+class CommandTimeout(RuntimeError):
+    pass
+
+
+def kill_group(process: asyncio.subprocess.Process):
+    """
+    Kill a command together with everything it started, e.g. the video encoders of TMC2.
+    The command runs in its own session, so its process group id is its pid.
+    :param process: process started by run_command
+    :return: None
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def run_command(
+        cmd: List[str],
+        cwd: Union[str, Path],
+        timeout: float = None,
+        on_line: Callable[[str], None] = None
+) -> Dict[str, float]:
+    """
+    Run a command from the event loop. On timeout or cancellation its whole process group is killed.
+    :param cmd: command to run
+    :param cwd: directory the command is run from
+    :param timeout: [optional] seconds after which the command is killed. Default: None
+    :param on_line: [optional] called with every stdout line as it arrives, stdout is discarded if None. Default: None
+    :return: timing summary, see time_command. User/system time and peak RSS of the child are NaN,
+             the event loop reaps children without their resource usage
+    """
+    begin = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE if on_line is not None else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+    async def communicate():
+        if on_line is not None:
+            async for line in process.stdout:
+                on_line(line.decode(errors='replace'))
+        return await process.wait()
+
+    try:
+        returncode = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        kill_group(process)
+        await process.wait()
+        raise CommandTimeout(f'{cmd[0]} timed out after {timeout} sec')
+    except BaseException:
+        # Cancelled, e.g. on KeyboardInterrupt
+        kill_group(process)
+        raise
+    wall = time.perf_counter() - begin
+    if returncode != 0:
+        logger.warning(f'{cmd[0]} exited with code {returncode}')
+    summary = skipped_timing()
+    summary.update({'wall time median in sec': wall, 'wall time min in sec': wall, 'wall time std in sec': 0.0,
+                    'trials': 1})
+    return summary
+
+
+async def run_pcerror(
+        evaluator,
+        orig_pc: Path,
+        dec_pc: Path,
+        timeout: float = None
+) -> Dict[str, str]:
+    """
+    Run pc_error from the event loop, keeping only the stdout lines that hold one of the metrics.
+    :param evaluator: Evaluator of the task
+    :param orig_pc: Original PC file to be evaluated
+    :param dec_pc: Decoded PC file to be evaluated
+    :param timeout: [optional] seconds after which pc_error is killed. Default: None
+    :return: geometry distortion values, see Evaluator.evaluate_geometry_distortion
+    """
+    metrics = evaluator.get_metrics()
+    pattern = re.compile('|'.join(metrics))
+    lines = []
+
+    def on_line(line):
+        if pattern.search(line):
+            lines.append(line)
+
+    await run_command(evaluator.get_pcerror_cmd(orig_pc, dec_pc), evaluator.pcerror, timeout, on_line)
+    return dict(zip(metrics, evaluator.find_pattern(metrics, lines)))
+
+
+async def run_task(
+        pc_method,
+        task: Tuple[Path, int],
+        semaphores: Dict[str, asyncio.Semaphore],
+        timeout: Dict[str, float],
+        lane: int = None
+):
+    """
+    Run the encode, decode and evaluate stages of a (file, rate) task, each within the concurrency of its stage.
+    :param pc_method: PC method (Base subclass) the sweep runs
+    :param task: (original PC file, index of the rate in cfg['params'])
+    :param semaphores: semaphore per stage
+    :param timeout: timeout per stage in sec, stages without one never time out
+    :param lane: [optional] timeline row of the task's spans, see trace_span. Default: None
+    :return: None
+    """
+    worker = pc_method.get_task_worker(*task)
+    try:
+        await run_task_stages(worker, semaphores, timeout, lane)
+    finally:
+        # Only the scratch reservation is left once the result is recorded, a failed stage also leaves its files
+        worker.discard_scratch()
+
+
+async def run_task_stages(
+        worker,
+        semaphores: Dict[str, asyncio.Semaphore],
+        timeout: Dict[str, float],
+        lane: int = None
+):
+    """
+    Run the stages of the task a PC method instance is bound to, see run_task.
+    :param worker: PC method instance bound to the task, see get_task_worker
+    :param semaphores: semaphore per stage
+    :param timeout: timeout per stage in sec, stages without one never time out
+    :param lane: [optional] timeline row of the task's spans, see trace_span. Default: None
+    :return: None
+    """
+    cwd = worker.cfg['pcc_directory']
+    if worker.scratch is not None:
+        with worker.span('scratch wait', lane):
+            await worker.scratch.reserve_async(worker.get_scratch_key(), worker.get_scratch_size())
+    with worker.span('encode wait', lane):
+        await semaphores['encode'].acquire()
+    try:
+        with worker.span('encode', lane):
+            enc_t = await run_command(worker.get_encode_cmd(worker.orig_pc, worker.enc_pc, worker.dec_pc), cwd,
+                                      timeout.get('encode'))
+    finally:
+        semaphores['encode'].release()
+    if worker.skip_decode and worker.emits_reconstruction:
+        dec_t = skipped_timing()
+    else:
+        with worker.span('decode wait', lane):
+            await semaphores['decode'].acquire()
+        try:
+            with worker.span('decode', lane):
+                dec_t = await run_command(worker.decode(worker.enc_pc, worker.dec_pc), cwd, timeout.get('decode'))
+        finally:
+            semaphores['decode'].release()
+    evaluator = worker.get_evaluator(worker.orig_pc, worker.enc_pc, worker.dec_pc)
+    with worker.span('evaluate wait', lane):
+        await semaphores['evaluate'].acquire()
+    try:
+        with worker.span('distortion', lane):
+            if worker.metric_backend == 'pc_error' and worker.approximate is None:
+                distortion = await run_pcerror(evaluator, worker.orig_pc, worker.dec_pc, timeout.get('evaluate'))
+            else:
+                # CPU-bound in Python, keep it off the event loop
+                distortion = await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(
+                    None, evaluator.evaluate_geometry_distortion, worker.orig_pc, worker.dec_pc),
+                    timeout.get('evaluate'))
+    finally:
+        semaphores['evaluate'].release()
+    with worker.span('bpp', lane):
+        bpp = evaluator.evaluate_bpp(worker.orig_pc, worker.enc_pc, worker.dec_pc, worker.enc_share)
+    worker.record_result(enc_t, dec_t, distortion, bpp)
+
+
+async def orchestrate(
+        pc_method,
+        tasks: List[Tuple[Path, int]],
+        num_workers: Dict[str, int],
+        queue_size: int,
+        timeout: Dict[str, float]
+) -> int:
+    """
+    Run every task as a coroutine of one event loop, see run_orchestrator.
+    :return: number of failed tasks
+    """
+    semaphores = {stage: asyncio.Semaphore(num_workers[stage]) for stage in STAGES}
+    # Caps the tasks between their encode and their evaluation, i.e. the decoded PCs waiting on disk
+    max_in_flight = sum(num_workers.values()) + queue_size
+    in_flight = asyncio.Semaphore(max_in_flight)
+    # Every task in flight gets its own row in the trace timeline
+    lanes = list(range(max_in_flight))
+    failed = 0
+    with tqdm(total=len(tasks)) as progress:
+        async def run(task):
+            nonlocal failed
+            async with in_flight:
+                lane = lanes.pop()
+                try:
+                    with trace_span(pc_method.trace_dir, 'task', lane, codec=pc_method.get_pc_method_name(),
+                                    rate=pc_method.cfg['params'][task[1]]['id'], file=Path(task[0]).name):
+                        await run_task(pc_method, task, semaphores, timeout, lane)
+                except CommandTimeout as e:
+                    logger.error(f'Task {task} failed: {e}')
+                    failed += 1
+                except Exception:
+                    logger.exception(f'Task {task} failed')
+                    failed += 1
+                finally:
+                    lanes.append(lane)
+            progress.update()
+
+        await asyncio.gather(*(run(task) for task in tasks))
+    return failed
+
+
+def run_orchestrator(
+        pc_method,
+        tasks: List[Tuple[Path, int]],
+        encode: int = 4,
+        decode: int = 4,
+        evaluate: int = 2,
+        queue_size: int = 4,
+        timeout: Dict[str, float] = None
+) -> int:
+    """
+    Run (file, rate) tasks from a single process: every encoder, decoder and pc_error run is an asyncio subprocess,
+    so no Python worker sits blocked on a child process. Each stage runs at most its number of commands at once,
+    a command that exceeds the timeout of its stage is killed with its process group and fails its task only.
+    Tasks are started in order, i.e. longest expected task first.
+    :param pc_method: PC method (Base subclass) the sweep runs
+    :param tasks: list of (original PC file, index of the rate in cfg['params'])
+    :param encode: number of concurrent encoder runs. Default: 4
+    :param decode: number of concurrent decoder runs. Default: 4
+    :param evaluate: number of concurrent evaluations. Default: 2
+    :param queue_size: number of decoded PCs that may wait for evaluation. Default: 4
+    :param timeout: [optional] timeout per stage in sec, e.g. {'encode': 600, 'decode': 600, 'evaluate': 300}.
+                    Default: None
+    :return: number of failed tasks
+    """
+    num_workers = dict(zip(STAGES, (encode, decode, evaluate)))
+    failed = asyncio.run(orchestrate(pc_method, tasks, num_workers, queue_size, timeout or {}))
+    if failed:
+        logger.error(f'{failed} of {len(tasks)} tasks failed')
+    return failed
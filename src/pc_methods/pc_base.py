@@ -1,22 +1,48 @@
+import os
+import copy
+import time
+import zlib
 import yaml
 import json
-import time
 import logging
 import functools
 from tqdm import tqdm
-import subprocess as sp
 from pathlib import Path
-from multiprocessing import Pool
+from multiprocessing import Pool, Value
 from dataclasses import dataclass
 from src.pc_methods.dir_base import Directory
 from src.evaluation.evaluate import Evaluator
-from typing import Union, List, Iterable, Dict
+from src.evaluation.metrics import METRICS_VERSION
+from src.evaluation.ply_io import count_points, same_vertices
+from src.evaluation.dataset_index import DatasetIndex
+from src.evaluation.results_store import get_results_store, flush_results_stores
+from src.pc_methods.pipeline import run_pipeline
+from src.pc_methods.orchestrator import run_orchestrator
+from src.pc_methods.scratch import Scratch
+from src.pc_methods.tracing import trace_span, record_span, export_trace, QUEUE_WAIT_SPAN, QUEUE_WAIT_LANE
+from src.pc_methods.scheduler import get_budget, run_scheduled
+from src.pc_methods.sequence import FrameSequence, detect_sequences
+from src.pc_methods.timing import init_worker, time_command, apportion_timing, skipped_timing
+from src.pc_methods.model_server import get_model_server, close_model_servers, has_serve_hooks, \
+    ModelServerError, ModelServerUnsupported
+from src.pc_methods.result_cache import ResultCache, hash_binary
+from src.utils.hashing import hash_file, make_key
+from typing import Union, List, Iterable, Dict, Tuple, ClassVar
 
 logger = logging.getLogger(__name__)
 
+# Top-level cfg entries that do not change the results of a task, left out of its cache key
+CACHE_IGNORED_CFG = ('params', 'pcc_directory', 'resources', 'search', 'model_server_timeout')
+
 
 @dataclass
 class Base:
+    # PC methods whose encoder/decoder take many files per invocation set this and implement encode/decode_batch
+    supports_batching: ClassVar[bool] = False
+    # PC methods that code a whole frame sequence per invocation set this and implement encode/decode_sequence
+    supports_sequences: ClassVar[bool] = False
+    # PC methods whose encoder can write the reconstructed PC to dec_pc set this and do so when skip_decode is set
+    emits_reconstruction: ClassVar[bool] = False
     orig_pc: Union[str, Path] = None
     enc_pc: Union[str, Path] = None
     dec_pc: Union[str, Path] = None
@@ -26,6 +52,23 @@ class Base:
     rate_name: str = None
     resolution: int = None
     color: bool = None
+    metric_backend: str = 'pc_error'
+    eval_file: Union[str, Path] = None
+    result_cache: ResultCache = None
+    dataset_index: DatasetIndex = None
+    cache_keys: Dict[str, str] = None
+    timing: Dict[str, int] = None
+    model_server: int = None
+    batch_size: int = None
+    sequence_mode: bool = False
+    enc_share: float = None
+    skip_decode: bool = False
+    verify_decode: float = 0.0
+    results_sink: str = 'json'
+    scratch: Scratch = None
+    trace_dir: Union[str, Path] = None
+    approximate: Dict = None
+    precomputed_normals: bool = False
 
     def __post_init__(self):
         directory = Directory()
@@ -71,77 +114,756 @@ class Base:
         self.color = color
         return self.color
 
-    def encode(self, orig_pc, enc_pc) -> List[str]:
+    def encode(self, orig_pc, enc_pc, dec_pc=None) -> List[str]:
+        # PC methods with emits_reconstruction get dec_pc with skip_decode and write the reconstruction to it
         raise NotImplementedError("Please implement encode method!")
 
     def decode(self, enc_file, dec_file) -> List[str]:
         raise NotImplementedError("Please implement decode method!")
 
+    def encode_batch(self, orig_pcs, enc_pcs) -> List[str]:
+        raise NotImplementedError("Please implement encode_batch method!")
+
+    def decode_batch(self, enc_files, dec_files) -> List[str]:
+        raise NotImplementedError("Please implement decode_batch method!")
+
+    def encode_sequence(self, sequence, enc_file) -> List[str]:
+        raise NotImplementedError("Please implement encode_sequence method!")
+
+    def decode_sequence(self, sequence, enc_file, dec_pattern) -> List[str]:
+        raise NotImplementedError("Please implement decode_sequence method!")
+
     def run_experiments(
             self,
             dataset_name: str,
             resolution: int,
-            color: bool
+            color: bool,
+            metric_backend: str = 'pc_error',
+            use_cache: bool = True,
+            use_index: bool = True,
+            pipeline: Dict[str, int] = None,
+            timing: Dict[str, int] = None,
+            model_server: int = None,
+            batch_size: int = None,
+            sequence_mode: bool = False,
+            skip_decode: bool = False,
+            verify_decode: float = 0.0,
+            results_sink: str = 'json',
+            orchestrator: Dict = None,
+            scratch: Dict = None,
+            trace: bool = False,
+            approximate: Dict = None,
+            precomputed_normals: bool = False,
+            schedule_resources: bool = False,
+            num_processes: int = None
     ):
         """
         Begin run experiments & evaluation
         :param dataset_name: dataset's name
         :param resolution: dataset's resolution
         :param color: dataset's color
+        :param metric_backend: distortion backend, 'pc_error' (external binary) or 'in_process' (NumPy/KD-tree).
+                               Default: 'pc_error'
+        :param use_cache: skip (file, rate) tasks whose results are already cached for an identical
+                          configuration, so interrupted sweeps resume where they left off. Default: True
+        :param use_index:   keep an index of the original PCs (point count, bounding box, size, content hash and
+                            normals) under dataset_dir/.index, built once and updated when files change, and take
+                            these facts from it during scheduling and evaluation. Normals are only estimated
+                            if the evaluation reads them, see needs_normals. Default: True
+        :param pipeline:    [optional]
+                            run encode, decode and evaluation as separate stages with their own workers, e.g.
+                            {'encode': 4, 'decode': 4, 'evaluate': 2, 'queue_size': 8}. See run_pipeline.
+                            If None, every task runs all stages in one pool worker. Default: None
+        :param timing:  [optional]
+                        how encode/decode are timed, e.g. {'trials': 5, 'warmup': 1, 'cores_per_task': 2}.
+                        See time_command. If None, every command runs once, unpinned. Default: None
+        :param model_server:    [optional]
+                                for PC methods with a model key (see get_model_key), serve encode/decode requests
+                                from one long-lived process per pool worker keeping up to this many models
+                                resident. Every coder script has to define the load_model and serve hooks,
+                                otherwise the run stops before it starts, see model_server. A request taking
+                                longer than the cfg's model_server_timeout (sec) kills the server.
+                                If None, every command runs as a separate process. Default: None
+        :param batch_size:  [optional]
+                            for PC methods that support batching, encode/decode up to this many files of the same
+                            rate per invocation. Not available together with pipeline.
+                            If None, every file is encoded/decoded on its own. Default: None
+        :param sequence_mode:   for PC methods that support sequences, detect frame-numbered PC files and code
+                                every sequence at every rate with one encoder and one decoder run.
+                                Not available together with pipeline or batch_size. Default: False
+        :param skip_decode: for PC methods that emit the reconstruction while encoding, evaluate the encoder's
+                            reconstruction and skip the decode process. Default: False
+        :param verify_decode:   with skip_decode, fraction of tasks that still run a real decode and check that
+                                it matches the encoder's reconstruction. Default: 0.0
+        :param results_sink:    'json' to write one JSON file per (file, rate), or 'sqlite' to append the results
+                                of the run to expt_dir/results.sqlite in batched commits. The store then also
+                                serves as the result cache, no per-task cache files are written.
+                                See ResultsStore.export_json for the per-file JSON layout. Default: 'json'
+        :param orchestrator:    [optional]
+                                run every encoder, decoder and pc_error as an asyncio subprocess of this process
+                                instead of a pool worker per task, e.g. {'encode': 8, 'decode': 8, 'evaluate': 4,
+                                'timeout': {'encode': 600, 'decode': 600, 'evaluate': 300}}. See run_orchestrator.
+                                Measures wall time only, not available together with pipeline, timing,
+                                model_server, batch_size, sequence_mode or verify_decode. Default: None
+        :param scratch: [optional]
+                        write the encoded and decoded PCs to a scratch directory, e.g. a tmpfs, and delete them once
+                        their task is evaluated, e.g. {'directory': '/dev/shm/pcc', 'keep': ['enc'],
+                        'min_free_mb': 2048}. Kinds listed in keep ('enc', 'dec') are moved to the experiments
+                        directory instead. Before encoding, a task reserves reserve_factor (default 2) times the
+                        size of its original PC, and waits while the free space less the reservations of the
+                        tasks in flight would drop below min_free_mb.
+                        See Scratch. If None, all files are written to the experiments directory. Default: None
+        :param trace:   record a span per stage of every task (file paths, encode, decode, distortion, bpp, result
+                        writing, queue waits) and export them to expt_dir/.trace/<pc_method>-<time>-<pid> as a
+                        Chrome trace with a per-stage latency summary. See export_trace. Default: False
+        :param approximate: [optional]
+                            estimate the distortion in-process from a random sample of the points of both PCs, with
+                            confidence intervals of the PSNR values, e.g. {'fraction': 0.05} or {'count': 100000,
+                            'stratified': False, 'confidence': 0.9}. The eval JSON is marked with
+                            'Approximate distortion'. bpp is always exact. See approximate_distortion.
+                            If None, the distortion is computed by metric_backend on all points. Default: None
+        :param precomputed_normals: with use_index, pass the normals estimated by the index (PCA over 12 neighbours)
+                                    to pc_error as --inputNorm, instead of letting pc_error estimate its own.
+                                    This changes the p2plane values against runs without it. Default: False
+        :param schedule_resources:  admit the pool tasks within the memory and thread budget of the 'resources'
+                                    block of the cfg instead of running num_processes tasks at once.
+                                    See run_scheduled. Default: False
+        :param num_processes:   [optional]
+                                number of pool workers, see multiprocessing. If None, num_processes = cpu_count.
+                                Default: None
+        :return: None
+        """
+        if orchestrator is not None and (pipeline is not None or timing is not None or model_server is not None
+                                         or batch_size is not None or sequence_mode or verify_decode):
+            logger.error('pipeline, timing, model_server, batch_size, sequence_mode and verify_decode '
+                         'cannot be used together with orchestrator')
+            raise ValueError
+        if pipeline is not None and (batch_size is not None or sequence_mode):
+            logger.error('batch_size and sequence_mode cannot be used together with pipeline')
+            raise ValueError
+        if batch_size is not None and sequence_mode:
+            logger.error('batch_size cannot be used together with sequence_mode')
+            raise ValueError
+        self.configure(resolution, color, metric_backend, use_cache, timing=timing, model_server=model_server,
+                       batch_size=batch_size, sequence_mode=sequence_mode, skip_decode=skip_decode,
+                       verify_decode=verify_decode, results_sink=results_sink, scratch=scratch, trace=trace,
+                       approximate=approximate, precomputed_normals=precomputed_normals)
+        files = self.is_valid_dataset(dataset_name)
+        self.dataset_index = None
+        if use_index:
+            self.dataset_index = DatasetIndex(Path(self.dataset_dir).joinpath('.index', dataset_name),
+                                              normals=self.needs_normals())
+            self.dataset_index.update(files)
+            self.check_resolution(files)
+        if orchestrator is not None:
+            run_orchestrator(self, self.prepare_tasks(files), **orchestrator)
+        elif pipeline is not None:
+            run_pipeline(self, self.prepare_tasks(files), **pipeline)
+        else:
+            self.multiprocessing(files, num_processes, schedule_resources=schedule_resources)
+        flush_results_stores()
+        close_model_servers()
+        if self.result_cache is not None:
+            logger.info(self.result_cache.report())
+        if self.trace_dir is not None:
+            export_trace(self.trace_dir)
+
+    def needs_normals(self) -> bool:
+        """
+        Check if the evaluation reads the normals of the dataset index, i.e. pc_error with precomputed_normals or
+        the in-process and approximate metrics. Otherwise the index does not estimate them.
+        :return: True if the dataset index has to provide normals
+        """
+        return self.precomputed_normals or self.metric_backend != 'pc_error' or self.approximate is not None
+
+    def check_resolution(
+            self,
+            files: Iterable
+    ):
+        """
+        Warn if the dataset index shows coordinates outside of [0, 2**resolution - 1], i.e. the resolution does
+        not match the voxelization of the dataset (see prepare_dataset) and the PSNR peak would be wrong.
+        :param files: point cloud files
+        :return: None
+        """
+        peak = 2 ** self.resolution - 1
+        entries = [e for e in (self.dataset_index.get(f) for f in files) if e is not None]
+        if not entries:
+            return
+        bbox_min = min(min(e['bbox_min']) for e in entries)
+        bbox_max = max(max(e['bbox_max']) for e in entries)
+        if bbox_min < 0 or bbox_max > peak:
+            logger.warning(f'Coordinates span [{bbox_min}, {bbox_max}], outside of [0, {peak}] '
+                           f'of resolution {self.resolution}')
+
+    def configure(
+            self,
+            resolution: int,
+            color: bool,
+            metric_backend: str = 'pc_error',
+            use_cache: bool = True,
+            timing: Dict[str, int] = None,
+            model_server: int = None,
+            batch_size: int = None,
+            sequence_mode: bool = False,
+            skip_decode: bool = False,
+            verify_decode: float = 0.0,
+            results_sink: str = 'json',
+            scratch: Dict = None,
+            trace: bool = False,
+            approximate: Dict = None,
+            precomputed_normals: bool = False
+    ):
+        """
+        Set the options of a run. See run_experiments for the parameters.
         :return: None
         """
         self.resolution = self.set_resolution(resolution)
         self.color = self.set_color(color)
-        files = self.is_valid_dataset(dataset_name)
-        self.multiprocessing(files)
+        self.metric_backend = metric_backend
+        if timing is not None and timing.get('trials', 1) < 1:
+            logger.error(f"timing trials must be at least 1, got {timing['trials']}")
+            raise ValueError
+        self.timing = timing
+        if model_server is not None:
+            self.check_model_server()
+        self.model_server = model_server
+        self.batch_size = batch_size
+        self.sequence_mode = sequence_mode
+        self.skip_decode = skip_decode
+        self.verify_decode = verify_decode
+        self.results_sink = results_sink
+        self.scratch = Scratch(**scratch) if scratch is not None else None
+        self.approximate = approximate
+        self.precomputed_normals = precomputed_normals
+        self.trace_dir = None
+        if trace:
+            self.trace_dir = Path(self.expt_dir).joinpath(
+                '.trace', f'{self.get_pc_method_name()}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}')
+        self.result_cache = None
+        if use_cache:
+            self.result_cache = ResultCache(Path(self.expt_dir).joinpath('.cache', self.get_pc_method_name()))
 
     def multiprocessing(
             self,
             files: Iterable,
             num_processes: int = None,
-            is_multiprocessing: bool = True
+            is_multiprocessing: bool = True,
+            schedule_resources: bool = False
     ):
         """
-        Multiprocessing all point cloud files in the dataset
+        Multiprocessing all (point cloud file, rate) tasks in the dataset, longest expected task first.
+        Tasks are grouped into batches (see get_batches) if batch_size is set and the PC method supports batching,
+        or into frame sequences (see get_sequence_tasks) in sequence mode.
+        With schedule_resources, tasks are admitted within the memory and thread budget of the 'resources' block
+        of the cfg (see get_budget).
         :param files: point cloud files
         :param num_processes:   [optional]
                                 number of CPU pool workers/ processes. If None, num_processes = cpu_count. Default: None
         :param is_multiprocessing: options to run experiments IN/ NOT IN multiprocessing. Default: True
+        :param schedule_resources: admit tasks within the resource budget of the cfg. Default: False
         :return: None
         """
-        with Pool(processes=num_processes) as p:
-            process_f = functools.partial(self.process)
+        tasks = self.prepare_tasks(files)
+        process_f = functools.partial(self.process_task)
+        if self.batch_size is not None and self.supports_batching:
+            tasks = self.get_batches(tasks)
+            process_f = functools.partial(self.process_batch)
+        elif self.sequence_mode and self.supports_sequences:
+            tasks = self.get_sequence_tasks(tasks)
+            process_f = functools.partial(self.process_sequence)
+        if self.trace_dir is not None:
+            # All tasks are handed to the pool at once, so each one waits from now until a worker picks it up
+            submitted = time.monotonic_ns()
+            tasks = [(submitted, t) for t in tasks]
+            process_f = functools.partial(self.process_queued, process_f)
+        if is_multiprocessing and schedule_resources:
+            budget = get_budget(self.cfg, Path(self.expt_dir).joinpath('.cache', self.get_pc_method_name()))
+            if num_processes is not None:
+                budget.max_concurrency = min(budget.max_concurrency or num_processes, num_processes)
+            run_scheduled(process_f, tasks, budget)
+            return
+        num_processes = num_processes or os.cpu_count()
+        with Pool(processes=num_processes, initializer=init_worker, initargs=(Value('i', 0), num_processes)) as p:
             if is_multiprocessing:
                 # With multiprocessing
-                list(tqdm(p.imap(process_f, files), total=len(files)))
+                list(tqdm(p.imap_unordered(process_f, tasks), total=len(tasks)))
             else:
                 # Without multiprocessing
-                list(tqdm((process_f(f) for f in files), total=len(files)))
+                list(tqdm((process_f(t) for t in tasks), total=len(tasks)))
+            # Let the workers exit normally, so that they flush their results stores
+            p.close()
+            p.join()
+
+    def get_tasks(
+            self,
+            files: Iterable
+    ) -> List[Tuple[Path, int]]:
+        """
+        Expand PC files into one task per (file, rate), ordered by expected cost so that the largest frames
+        are scheduled first and do not end up as a long tail on a single worker.
+        The expected cost of a file is its point count, ties are broken by its file size.
+        :param files: point cloud files
+        :return: list of (original PC file, index of the rate in cfg['params'])
+        """
+        files = [Path(f) for f in files]
+        costs = {}
+        for f in files:
+            entry = self.dataset_index.get(f) if self.dataset_index is not None else None
+            costs[f] = (entry['num_points'], entry['size']) if entry is not None else \
+                (count_points(f), Path.stat(f).st_size)
+        ordered = sorted(files, key=lambda f: costs[f], reverse=True)
+        return [(f, i) for f in ordered for i in range(len(self.cfg['params']))]
+
+    def get_batches(
+            self,
+            tasks: List[Tuple[Path, int]]
+    ) -> List[Tuple[List[Path], int]]:
+        """
+        Group the tasks of every rate into batches of up to batch_size files, keeping the order of the tasks,
+        so the largest files of a rate share the first batch.
+        :param tasks: list of (original PC file, index of the rate in cfg['params'])
+        :return: list of (original PC files, index of the rate in cfg['params'])
+        """
+        files_per_rate = {}
+        for orig_pc, rate_id in tasks:
+            files_per_rate.setdefault(rate_id, []).append(orig_pc)
+        return [(files[i:i + self.batch_size], rate_id)
+                for rate_id, files in files_per_rate.items()
+                for i in range(0, len(files), self.batch_size)]
+
+    def get_sequence_tasks(
+            self,
+            tasks: List[Tuple[Path, int]]
+    ) -> List[Tuple[FrameSequence, int]]:
+        """
+        Group the tasks of every rate into frame sequences, longest sequence first, so that sequences are spread
+        across the pool workers. Files without a frame number become sequences of their own.
+        :param tasks: list of (original PC file, index of the rate in cfg['params'])
+        :return: list of (frame sequence, index of the rate in cfg['params'])
+        """
+        files_per_rate = {}
+        for orig_pc, rate_id in tasks:
+            files_per_rate.setdefault(rate_id, []).append(orig_pc)
+        sequence_tasks = []
+        for rate_id, files in files_per_rate.items():
+            sequences, others = detect_sequences(files)
+            sequence_tasks += [(s, rate_id) for s in sequences]
+            sequence_tasks += [(FrameSequence(f.stem, 0, 0, [f]), rate_id) for f in others]
+        return sorted(sequence_tasks, key=lambda t: len(t[0].frames), reverse=True)
+
+    def prepare_tasks(
+            self,
+            files: Iterable
+    ) -> List[Tuple[Path, int]]:
+        """
+        Get the ordered (file, rate) tasks that still have to be processed.
+        :param files: point cloud files
+        :return: list of (original PC file, index of the rate in cfg['params'])
+        """
+        tasks = self.get_tasks(files)
+        if self.result_cache is not None:
+            tasks = self.skip_cached_tasks(tasks)
+        return tasks
+
+    def get_cache_slot(
+            self,
+            orig_pc,
+            rate_id: int
+    ) -> str:
+        """
+        Get the cache slot of a (file, rate) task, i.e. dataset/rate/PC file name.
+        :param orig_pc: Original PC file of the task
+        :param rate_id: index of the rate in cfg['params']
+        :return: cache slot
+        """
+        return f"{Path(orig_pc).parent.name}/{self.cfg['params'][rate_id]['id']}/{Path(orig_pc).name}"
+
+    def get_cache_keys(
+            self,
+            tasks: List[Tuple[Path, int]]
+    ) -> Dict[str, str]:
+        """
+        Compute the cache key of every task from the original PC content, the cfg (see CACHE_IGNORED_CFG), the
+        resolved rate parameters, the content of every file the cfg refers to, e.g. binaries and codec cfg files,
+        and the evaluation settings. Every file is hashed only once.
+        :param tasks: list of (original PC file, index of the rate in cfg['params'])
+        :return: cache key per cache slot
+        """
+        cfg_hashes = {}
+        cfg = {name: value for name, value in self.cfg.items() if name not in CACHE_IGNORED_CFG}
+        cfg_files = self.hash_cfg_files(cfg, cfg_hashes)
+        evaluation = {'metric_backend': self.metric_backend,
+                      'resolution': self.resolution,
+                      'color': self.color}
+        if self.metric_backend == 'pc_error':
+            evaluation['pc_error'] = hash_binary('./test/pc_error', self.pcerror)
+        if self.metric_backend != 'pc_error' or self.approximate is not None:
+            evaluation['metrics_version'] = METRICS_VERSION
+        if self.approximate is not None:
+            evaluation['approximate'] = self.approximate
+        # Normals from the dataset index replace the ones pc_error would estimate
+        evaluation['precomputed_normals'] = self.precomputed_normals and self.dataset_index is not None
+        file_hashes = {}
+        keys = {}
+        for orig_pc, rate_id in tasks:
+            if orig_pc not in file_hashes:
+                entry = self.dataset_index.get(orig_pc) if self.dataset_index is not None else None
+                file_hashes[orig_pc] = entry['sha256'] if entry is not None else hash_file(orig_pc)
+            keys[self.get_cache_slot(orig_pc, rate_id)] = make_key({
+                'pc_method': self.get_pc_method_name(),
+                'orig_pc': file_hashes[orig_pc],
+                'cfg': cfg,
+                'cfg_files': cfg_files,
+                'params': self.cfg['params'][rate_id],
+                'params_files': self.hash_cfg_files(self.cfg['params'][rate_id], cfg_hashes),
+                'evaluation': evaluation,
+                'timing': self.timing,
+                'sequence_mode': self.sequence_mode and self.supports_sequences,
+                'skip_decode': self.skip_decode and self.emits_reconstruction,
+            })
+        return keys
+
+    def hash_cfg_files(
+            self,
+            entries: Dict,
+            hashes: Dict[str, str]
+    ) -> Dict[str, str]:
+        """
+        Hash the content of the files cfg entries refer to, relative to the pcc_directory the codecs run from,
+        e.g. encoder binaries, codec cfg files or checkpoints. Entries that are not files are left out.
+        :param entries: cfg entries, e.g. cfg['params'][rate_id]
+        :param hashes: content hash per entry value computed so far, updated in place
+        :return: content hash per entry name
+        """
+        files = {}
+        for name, value in entries.items():
+            if not isinstance(value, str):
+                continue
+            if value not in hashes:
+                path = Path(self.cfg['pcc_directory']).joinpath(value)
+                hashes[value] = hash_file(path) if path.is_file() else None
+            if hashes[value] is not None:
+                files[name] = hashes[value]
+        return files
+
+    def skip_cached_tasks(
+            self,
+            tasks: List[Tuple[Path, int]]
+    ) -> List[Tuple[Path, int]]:
+        """
+        Drop the tasks that hit the result cache, restoring their evaluation logs if they are missing.
+        With the sqlite sink, the records of the results store count as cache entries (see ResultsStore),
+        and hits of the result cache that are missing from the store are restored into it.
+        :param tasks: list of (original PC file, index of the rate in cfg['params'])
+        :return: tasks that still have to be processed
+        """
+        self.cache_keys = self.get_cache_keys(tasks)
+        store, stored_keys = None, {}
+        if self.results_sink == 'sqlite':
+            store = get_results_store(self.get_results_db())
+            stored_keys = store.cache_keys(self.get_pc_method_name())
+        pending = []
+        for orig_pc, rate_id in tasks:
+            slot = self.get_cache_slot(orig_pc, rate_id)
+            rate_name = self.cfg['params'][rate_id]['id']
+            if stored_keys.get((orig_pc.parent.name, rate_name, orig_pc.name)) == self.cache_keys[slot]:
+                self.result_cache.hits += 1
+                continue
+            data = self.result_cache.lookup(slot, self.cache_keys[slot])
+            if data is None:
+                pending.append((orig_pc, rate_id))
+                continue
+            if store is not None:
+                store.append(self.get_pc_method_name(), orig_pc.parent.name, rate_name, orig_pc.name, data,
+                             self.cache_keys[slot])
+                continue
+            _, _, eval_file = self.set_filepath(orig_pc=orig_pc, rate_name=rate_name)
+            if not eval_file.exists():
+                self.write_eval_log(data, eval_file)
+        if store is not None:
+            store.flush()
+        return pending
+
+    def get_task_worker(
+            self,
+            orig_pc,
+            rate_id: int
+    ):
+        """
+        Get a private copy of this PC method bound to one (file, rate) task,
+        so that concurrent tasks never share id, rate_name, orig_pc, enc_pc or dec_pc.
+        :param orig_pc: Original PC file of the task
+        :param rate_id: index of the rate in cfg['params']
+        :return: PC method instance for the task
+        """
+        worker = copy.copy(self)
+        worker.id = rate_id
+        worker.rate_name = self.cfg['params'][rate_id]['id']
+        worker.orig_pc = orig_pc
+        with worker.span('set_filepath'):
+            worker.enc_pc, worker.dec_pc, worker.eval_file = worker.set_filepath(orig_pc=orig_pc,
+                                                                                 rate_name=worker.rate_name)
+        return worker
+
+    def span(
+            self,
+            name: str,
+            lane: int = None
+    ):
+        """
+        Span of a stage of the task this PC method instance is bound to, tagged with codec, rate and file.
+        :param name: stage name
+        :param lane: [optional] timeline row of the span, see trace_span. Default: None
+        :return: context manager, see trace_span
+        """
+        return trace_span(self.trace_dir, name, lane, codec=self.get_pc_method_name(), rate=self.rate_name,
+                          file=Path(self.orig_pc).name if self.orig_pc is not None else None)
+
+    def process_queued(
+            self,
+            process_f,
+            item: Tuple[int, Tuple]
+    ):
+        """
+        Record the time a task waited in the pool's queue as a QUEUE_WAIT_SPAN span, then process it.
+        :param process_f: process_task, process_batch or process_sequence
+        :param item: (time.monotonic_ns() when the task was submitted, task)
+        :return: None
+        """
+        submitted, task = item
+        files, rate_id = task
+        if isinstance(files, FrameSequence):
+            name = files.name
+        else:
+            name = Path(files[0] if isinstance(files, list) else files).name
+        record_span(self.trace_dir, QUEUE_WAIT_SPAN, submitted, time.monotonic_ns(), QUEUE_WAIT_LANE,
+                    codec=self.get_pc_method_name(), rate=self.cfg['params'][rate_id]['id'], file=name)
+        process_f(task)
+
+    def process_task(
+            self,
+            task: Tuple[Path, int]
+    ):
+        """
+        Process a (PC file, rate) task, including encode, decode, get inference time, distortion values,
+        bpp values, and write logs.
+        :param task: (original PC file, index of the rate in cfg['params'])
+        :return: None
+        """
+        with trace_span(self.trace_dir, 'task', codec=self.get_pc_method_name(), rate=self.cfg['params'][task[1]]['id'],
+                        file=Path(task[0]).name):
+            worker = self.get_task_worker(*task)
+            try:
+                enc_t, dec_t = worker.encode_and_decode(worker.orig_pc, worker.enc_pc, worker.dec_pc)
+                worker.evaluate_task(enc_t, dec_t)
+            finally:
+                # Only the reservation is left once the result is recorded, a failed step also leaves its files
+                worker.discard_scratch()
+
+    def process_batch(
+            self,
+            batch: Tuple[List[Path], int]
+    ):
+        """
+        Process a batch of PC files at one rate: encode and decode all files with one invocation each,
+        then evaluate and write logs per file.
+        The batch's encode/decode time is apportioned to the files by their share of the batch's points.
+        :param batch: (original PC files, index of the rate in cfg['params'])
+        :return: None
+        """
+        files, rate_id = batch
+        with trace_span(self.trace_dir, 'batch', codec=self.get_pc_method_name(),
+                        rate=self.cfg['params'][rate_id]['id'], file=Path(files[0]).name):
+            workers = [self.get_task_worker(orig_pc, rate_id) for orig_pc in files]
+            try:
+                workers[0].reserve_scratch(sum(w.get_scratch_size() for w in workers))
+                with workers[0].span('encode'):
+                    enc_t = workers[0].time_command(workers[0].encode_batch([w.orig_pc for w in workers],
+                                                                            [w.enc_pc for w in workers]))
+                with workers[0].span('decode'):
+                    dec_t = workers[0].time_command(workers[0].decode_batch([w.enc_pc for w in workers],
+                                                                            [w.dec_pc for w in workers]))
+                num_points = [count_points(w.orig_pc) for w in workers]
+                for worker, n in zip(workers, num_points):
+                    share = n / sum(num_points)
+                    worker.evaluate_task(apportion_timing(enc_t, share), apportion_timing(dec_t, share))
+            finally:
+                for worker in workers:
+                    worker.discard_scratch()
+
+    def process_sequence(
+            self,
+            task: Tuple[FrameSequence, int]
+    ):
+        """
+        Process a frame sequence at one rate: encode the whole sequence into one bitstream and decode it in one pass,
+        then evaluate and write logs per frame. Encode/decode time and the bitstream size are attributed
+        to the frames by their share of the sequence's points.
+        :param task: (frame sequence, index of the rate in cfg['params'])
+        :return: None
+        """
+        sequence, rate_id = task
+        if sequence.width == 0:
+            # Not frame-numbered, code the file on its own
+            self.process_task((sequence.frames[0], rate_id))
+            return
+        with trace_span(self.trace_dir, 'sequence', codec=self.get_pc_method_name(),
+                        rate=self.cfg['params'][rate_id]['id'], file=sequence.name):
+            workers = [self.get_task_worker(orig_pc, rate_id) for orig_pc in sequence.frames]
+            enc_file = workers[0].enc_pc.parent / (sequence.name + str(self.cfg['bin_extension']))
+            # Decoded frames follow the naming of set_filepath, i.e. <frame>.ply.ply
+            dec_pattern = sequence.pattern(workers[0].dec_pc.parent, suffix='.ply.ply')
+            try:
+                workers[0].reserve_scratch(sum(w.get_scratch_size() for w in workers))
+                with workers[0].span('encode'):
+                    enc_t = workers[0].time_command(workers[0].encode_sequence(sequence, enc_file))
+                with workers[0].span('decode'):
+                    dec_t = workers[0].time_command(workers[0].decode_sequence(sequence, enc_file, dec_pattern))
+                num_points = [count_points(w.orig_pc) for w in workers]
+                for worker, n in zip(workers, num_points):
+                    worker.enc_pc = enc_file
+                    worker.enc_share = n / sum(num_points)
+                    worker.evaluate_task(apportion_timing(enc_t, worker.enc_share),
+                                         apportion_timing(dec_t, worker.enc_share))
+                if self.scratch is not None:
+                    # Every frame is evaluated, the shared bitstream can go
+                    self.scratch.release(enc_file, self.get_persistent_file(enc_file), 'enc')
+            finally:
+                for worker in workers:
+                    worker.discard_scratch()
+                if self.scratch is not None:
+                    self.scratch.discard(enc_file)
+
+    def evaluate_task(
+            self,
+            enc_t,
+            dec_t
+    ):
+        """
+        Evaluate the task this PC method instance is bound to (see get_task_worker) and write its logs.
+        :param enc_t: Timing summary of encoding the PC file
+        :param dec_t: Timing summary of decoding the PC file
+        :return: None
+        """
+        distortion, bpp = self.eval_geom_distortion_bpp(
+            self.orig_pc,
+            self.enc_pc,
+            self.dec_pc,
+        )
+        self.record_result(enc_t, dec_t, distortion, bpp)
+
+    def record_result(
+            self,
+            enc_t,
+            dec_t,
+            distortion,
+            bpp
+    ):
+        """
+        Combine the timings and evaluation values of the task this PC method instance is bound to,
+        write them into the results sink and store them in the result cache.
+        :param enc_t: Timing summary of encoding the PC file
+        :param dec_t: Timing summary of decoding the PC file
+        :param distortion: geometry distortion values, see Evaluator.evaluate_geometry_distortion
+        :param bpp: bpp values, see Evaluator.evaluate_bpp
+        :return: None
+        """
+        inference_time = self.get_inference_time(enc_t, dec_t)
+        data = {**inference_time, **distortion, **bpp}
+        with self.span('release_scratch'):
+            self.release_scratch(data)
+        slot = self.get_cache_slot(self.orig_pc, self.id)
+        cache_key = None
+        if self.result_cache is not None and self.cache_keys:
+            cache_key = self.cache_keys.get(slot)
+        with self.span('write_result'):
+            self.write_result(data, cache_key)
+        # The sqlite sink commits the cache key with the result, see ResultsStore
+        if cache_key is not None and self.results_sink != 'sqlite':
+            with self.span('cache_store'):
+                self.result_cache.store(slot, cache_key, data)
+
+    def get_persistent_file(self, scratch_file) -> Path:
+        """
+        Get the path a file in the scratch directory has in the experiments directory.
+        :param scratch_file: file in the scratch directory
+        :return: path in the experiments directory
+        """
+        return Path(self.expt_dir).joinpath(Path(scratch_file).relative_to(self.scratch.directory))
+
+    def release_scratch(self, data):
+        """
+        Delete the encoded and decoded PC of the task this PC method instance is bound to from the scratch directory,
+        or move them to the experiments directory. A bitstream shared with other PCs (see enc_share) is left to
+        the caller. The paths in data are updated to the files that were moved.
+        :param data: results of the task
+        :return: None
+        """
+        if self.scratch is None:
+            return
+        files = {'enc': (self.enc_pc, 'Encoded bitstream'), 'dec': (self.dec_pc, 'Decoded PC')}
+        if self.enc_share is not None:
+            del files['enc']
+        for kind, (scratch_file, key) in files.items():
+            kept = self.scratch.release(scratch_file, self.get_persistent_file(scratch_file), kind)
+            if kept is not None:
+                data[key] = str(kept)
+
+    def get_scratch_key(self) -> str:
+        """
+        Get the key of the scratch reservation of the task this PC method instance is bound to, the same in every
+        process working on the task.
+        :return: reservation key
+        """
+        return f'{Path(self.dec_pc).name}.{zlib.crc32(str(self.dec_pc).encode()):08x}'
+
+    def get_scratch_size(self) -> int:
+        """
+        Estimate the scratch space of the task this PC method instance is bound to, i.e. scratch.reserve_factor
+        times the size of its original PC.
+        :return: expected size of the encoded and decoded PC in bytes
+        """
+        return int(self.scratch.reserve_factor * os.path.getsize(self.orig_pc)) if self.scratch is not None else 0
+
+    def reserve_scratch(self, nbytes: int = None):
+        """
+        Reserve scratch space for the task this PC method instance is bound to before it writes its first file,
+        waiting while the scratch is full. See Scratch.reserve.
+        :param nbytes: [optional] space to reserve in bytes. If None, see get_scratch_size. Default: None
+        :return: None
+        """
+        if self.scratch is None:
+            return
+        self.scratch.reserve(self.get_scratch_key(), self.get_scratch_size() if nbytes is None else nbytes)
+
+    def discard_scratch(self):
+        """
+        Delete the files the task this PC method instance is bound to left in the scratch directory, e.g. when a step
+        failed, and drop its reservation. A bitstream shared with other PCs (see enc_share) is left to the caller.
+        :return: None
+        """
+        if self.scratch is None:
+            return
+        files = [self.dec_pc, Path(self.dec_pc).parent / (Path(self.dec_pc).name + '.verify.ply')]
+        if self.enc_share is None:
+            files.append(self.enc_pc)
+        for scratch_file in files:
+            self.scratch.discard(scratch_file)
+        self.scratch.unreserve(self.get_scratch_key())
 
     def process(
             self,
             orig_pc,
     ):
         """
-        Process a PC file, including encode, decode, get inference time, distortion values, bpp values, and write logs.
+        Process a PC file at every rate, including encode, decode, get inference time, distortion values,
+        bpp values, and write logs.
         :param orig_pc: Original PC file that is in processing
         :return: None
         """
-
-        for i, param in enumerate(self.cfg['params']):
-            self.id = i
-            self.rate_name = param['id']
-            self.orig_pc = orig_pc
-            self.enc_pc, self.dec_pc, eval_file = self.set_filepath(orig_pc=orig_pc, rate_name=self.rate_name)
-            enc_t, dec_t = self.encode_and_decode(self.orig_pc, self.enc_pc, self.dec_pc)
-            inference_time = self.get_inference_time(enc_t, dec_t)
-            distortion, bpp = self.eval_geom_distortion_bpp(
-                self.orig_pc,
-                self.enc_pc,
-                self.dec_pc,
-            )
-            data = {**inference_time, **distortion, **bpp}
-            self.write_eval_log(data, eval_file)
+        for i in range(len(self.cfg['params'])):
+            self.process_task((orig_pc, i))
 
     def is_valid_dataset(
             self,
@@ -189,11 +911,13 @@ class Base:
         dataset_name = orig_pc.parent.name
         plyfile_name = orig_pc.name
 
-        enc_file = Path(self.expt_dir).joinpath(pc_methods_name, dataset_name, rate_name, 'enc', plyfile_name)
+        # Encoded and decoded PCs only live until their task is evaluated in scratch mode
+        work_dir = Path(self.scratch.directory) if self.scratch is not None else Path(self.expt_dir)
+        enc_file = work_dir.joinpath(pc_methods_name, dataset_name, rate_name, 'enc', plyfile_name)
         enc_file = enc_file.parent / (enc_file.name + str(self.cfg['bin_extension']))
         enc_file.parent.mkdir(parents=True, exist_ok=True)
 
-        dec_file = Path(self.expt_dir).joinpath(pc_methods_name, dataset_name, rate_name, 'dec', plyfile_name)
+        dec_file = work_dir.joinpath(pc_methods_name, dataset_name, rate_name, 'dec', plyfile_name)
         dec_file = dec_file.parent / (dec_file.name + '.ply')
         dec_file.parent.mkdir(parents=True, exist_ok=True)
 
@@ -214,31 +938,139 @@ class Base:
         :param enc_pc: Encoded PC file that is in processing
         :param dec_pc: Decoded PC file that is in processing
         :return:
-            enc_time: Time it takes to encode a PC file
-            dec_time: Time it takes to decode a PC file
-        """
-        encode_cmd = self.encode(orig_pc, enc_pc)
-        enc_begin = time.time()
-        sp.run(
-            encode_cmd,
-            cwd=self.cfg['pcc_directory'],
-            stdout=sp.DEVNULL,
-            stderr=sp.DEVNULL,
-        )
-        enc_end = time.time()
-        enc_time = enc_end - enc_begin
+            enc_time: Timing summary of encoding a PC file
+            dec_time: Timing summary of decoding a PC file
+        """
+        enc_time = self.run_encode(orig_pc, enc_pc, dec_pc)
+        dec_time = self.run_decode(enc_pc, dec_pc)
+        return enc_time, dec_time
+
+    def run_encode(
+            self,
+            orig_pc,
+            enc_pc,
+            dec_pc=None
+    ):
+        """
+        Run encode command and compute encode time.
+        :param orig_pc: Original PC file that is in processing
+        :param enc_pc: Encoded PC file that is in processing
+        :param dec_pc: [optional] Decoded PC file the encoder's reconstruction goes to, see get_encode_cmd
+        :return: enc_time: Timing summary of encoding a PC file, see time_command
+        """
+        self.reserve_scratch()
+        encode_cmd = self.get_encode_cmd(orig_pc, enc_pc, dec_pc)
+        with self.span('encode'):
+            return self.time_command(encode_cmd)
 
+    def get_encode_cmd(
+            self,
+            orig_pc,
+            enc_pc,
+            dec_pc=None
+    ) -> List[str]:
+        """
+        Get the encode command, writing the reconstruction to dec_pc if the PC method emits it and decode is skipped.
+        :param orig_pc: Original PC file that is in processing
+        :param enc_pc: Encoded PC file that is in processing
+        :param dec_pc: [optional] Decoded PC file that is in processing
+        :return: encode command
+        """
+        if dec_pc is not None and self.skip_decode and self.emits_reconstruction:
+            return self.encode(orig_pc, enc_pc, dec_pc)
+        return self.encode(orig_pc, enc_pc)
+
+    def run_decode(
+            self,
+            enc_pc,
+            dec_pc
+    ):
+        """
+        Run decode command and compute decode time.
+        :param enc_pc: Encoded PC file that is in processing
+        :param dec_pc: Decoded PC file that is in processing
+        :return: dec_time: Timing summary of decoding a PC file, see time_command
+        """
+        if self.skip_decode and self.emits_reconstruction:
+            return self.verify_reconstruction(enc_pc, dec_pc)
         decode_cmd = self.decode(enc_pc, dec_pc)
-        dec_begin = time.time()
-        sp.run(
-            decode_cmd,
-            cwd=self.cfg['pcc_directory'],
-            stdout=sp.DEVNULL,
-            stderr=sp.DEVNULL,
-        )
-        dec_end = time.time()
-        dec_time = dec_end - dec_begin
-        return enc_time, dec_time
+        with self.span('decode'):
+            return self.time_command(decode_cmd)
+
+    def verify_reconstruction(
+            self,
+            enc_pc,
+            dec_pc
+    ):
+        """
+        Stand-in for the decode step when the encoder already wrote the reconstructed PC to dec_pc.
+        A verify_decode fraction of the tasks, picked by a hash of dec_pc so reruns verify the same tasks,
+        still decode and compare the points of both PCs, see same_vertices. On a mismatch the decoded PC replaces the
+        reconstruction.
+        :param enc_pc: Encoded PC file that is in processing
+        :param dec_pc: Decoded PC file, holding the encoder's reconstruction
+        :return: dec_time: Timing summary of decoding a PC file, NaN if the decode was skipped
+        """
+        if zlib.crc32(str(dec_pc).encode()) / 2 ** 32 >= self.verify_decode:
+            return skipped_timing()
+        verify_pc = Path(dec_pc).parent / (Path(dec_pc).name + '.verify.ply')
+        dec_time = self.time_command(self.decode(enc_pc, verify_pc))
+        if same_vertices(verify_pc, dec_pc):
+            verify_pc.unlink()
+        else:
+            logger.error(f'Decoded {verify_pc} does not match the encoder reconstruction, evaluating the decoded PC')
+            verify_pc.replace(dec_pc)
+        return dec_time
+
+    def check_model_server(self):
+        """
+        Make sure every coder script of the PC method can be served by a model server, i.e. defines the load_model
+        and serve hooks (see model_server), before any server is started.
+        :return: None
+        """
+        if type(self).get_model_key is Base.get_model_key:
+            logger.error(f'{self.get_pc_method_name()} has no model key and cannot run on a model server')
+            raise ValueError
+        for name in ('encoder', 'decoder', 'coder'):
+            if name not in self.cfg:
+                continue
+            script = Path(self.cfg['pcc_directory']).joinpath(self.cfg[name])
+            if script.suffix != '.py' or not script.is_file() or not has_serve_hooks(script):
+                logger.error(f'{script} does not define the load_model and serve hooks, '
+                             f'run {self.get_pc_method_name()} without model_server')
+                raise ValueError
+
+    def get_model_key(self):
+        """
+        Get the key of the model the current rate uses, e.g. ckpt_dir/modelname.
+        PC methods that can be served by a model server (see run_experiments) override this.
+        :return: model key, or None if the PC method runs every command as a separate process
+        """
+        return None
+
+    def time_command(
+            self,
+            cmd: List[str]
+    ):
+        """
+        Run an encode/decode command with the configured timing, on the model server of the current pool worker
+        if there is one for this PC method. Falls back to a separate process when the server fails.
+        :param cmd: command to run
+        :return: Timing summary of the command, see time_command
+        """
+        timing = self.timing or {}
+        model_key = self.get_model_key()
+        if self.model_server is not None and model_key is not None:
+            server = get_model_server(cmd[0], self.cfg['pcc_directory'], self.model_server,
+                                      self.cfg.get('model_server_timeout'))
+            runner = functools.partial(server.run_trial, model_key=model_key)
+            try:
+                return time_command(cmd, self.cfg['pcc_directory'], runner=runner, **timing)
+            except ModelServerUnsupported:
+                pass
+            except ModelServerError as e:
+                logger.warning(f'{e}. Running {cmd[1]} as a separate process')
+        return time_command(cmd, self.cfg['pcc_directory'], **timing)
 
     def get_inference_time(
             self,
@@ -248,8 +1080,9 @@ class Base:
         """
         Get a summary of inference time,
         containing pcc algorithm, original PC, encoded bitstream, decoded PC, encode time, decode time.
-        :param enc_time: Time it took to encode a PC file
-        :param dec_time: Time it took to decode a PC file
+        Encode/decode time is the median wall time over the trials, the full summaries are kept alongside.
+        :param enc_time: Timing summary of encoding a PC file
+        :param dec_time: Timing summary of decoding a PC file
         :return: inference_time
         """
         inference_time = {
@@ -257,39 +1090,84 @@ class Base:
             'Original PC': str(self.orig_pc),
             'Encoded bitstream': str(self.enc_pc),
             'Decoded PC': str(self.dec_pc),
-            'Encode time in sec': enc_time,
-            'Decode time in sec': dec_time
+            'Encode time in sec': enc_time['wall time median in sec'],
+            'Decode time in sec': dec_time['wall time median in sec'],
+            **{f'Encode {key}': value for key, value in enc_time.items()},
+            **{f'Decode {key}': value for key, value in dec_time.items()},
         }
         return inference_time
 
-    def eval_geom_distortion_bpp(
+    def get_evaluator(
             self,
             orig_pc,
             enc_pc,
-            dec_pc,
-    ):
+            dec_pc
+    ) -> Evaluator:
         """
-        Evaluate geometry distortion and bits per point (bpp) between the original PC and decoded PC
+        Get the evaluator of a (original PC, encoded PC, decoded PC) triple with the configured backend and index.
         :param orig_pc: Original PC file to be evaluated
         :param enc_pc: Encoded PC file to be evaluated
         :param dec_pc: Decoded PC file to be evaluated
-        :return:
-            distortion: MSE-PSNR, H-PSNR, Y-PSNR (if applicable)
-            bpp: bits per point
+        :return: evaluator
         """
-        evaluate = Evaluator(
+        return Evaluator(
             orig_pc,
             enc_pc,
             dec_pc,
             self.pcerror,
             self.color,
-            self.resolution
+            self.resolution,
+            self.metric_backend,
+            self.dataset_index,
+            self.approximate,
+            self.precomputed_normals
         )
 
-        distortion = evaluate.evaluate_geometry_distortion(orig_pc, dec_pc)
-        bpp = evaluate.evaluate_bpp(orig_pc, enc_pc, dec_pc)
+    def eval_geom_distortion_bpp(
+            self,
+            orig_pc,
+            enc_pc,
+            dec_pc,
+    ):
+        """
+        Evaluate geometry distortion and bits per point (bpp) between the original PC and decoded PC
+        :param orig_pc: Original PC file to be evaluated
+        :param enc_pc: Encoded PC file to be evaluated
+        :param dec_pc: Decoded PC file to be evaluated
+        :return:
+            distortion: MSE-PSNR, H-PSNR, Y-PSNR (if applicable)
+            bpp: bits per point
+        """
+        evaluate = self.get_evaluator(orig_pc, enc_pc, dec_pc)
+        with self.span('distortion'):
+            distortion = evaluate.evaluate_geometry_distortion(orig_pc, dec_pc)
+        with self.span('bpp'):
+            bpp = evaluate.evaluate_bpp(orig_pc, enc_pc, dec_pc, self.enc_share)
         return distortion, bpp
 
+    def get_results_db(self) -> Path:
+        """
+        Get the SQLite results store of the sqlite sink.
+        :return: expt_dir/results.sqlite
+        """
+        return Path(self.expt_dir).joinpath('results.sqlite')
+
+    def write_result(self, data, cache_key=None):
+        """
+        Write the results of the task this PC method instance is bound to into the configured results sink.
+        :param data: results combined from evaluation steps.
+        :param cache_key: [optional] cache key of the task, stored with the record by the sqlite sink
+        :return: None
+        """
+        if self.results_sink == 'sqlite':
+            store = get_results_store(self.get_results_db())
+            store.append(self.get_pc_method_name(), self.orig_pc.parent.name, self.rate_name, self.orig_pc.name, data,
+                         cache_key)
+        elif self.results_sink == 'json':
+            self.write_eval_log(data, self.eval_file)
+        else:
+            raise ValueError(f'Unknown results sink: {self.results_sink}')
+
     @staticmethod
     def write_eval_log(data, eval_file):
         """
@@ -33,3 +33,7 @@ class PCGCv1(Base):
                '--mode=' + str(self.cfg['params'][self.id]['mode'])
                ]
         return cmd
+
+    def get_model_key(self):
+        params = self.cfg['params'][self.id]
+        return f"{params['ckpt_dir']}/{params['modelname']}"
@@ -0,0 +1,152 @@
+import queue
+import logging
+from tqdm import tqdm
+from pathlib import Path
+from multiprocessing import Process, Queue
+from typing import List, Tuple, Dict
+from src.pc_methods.tracing import trace_span
+from src.pc_methods.timing import set_worker_index
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('encode', 'decode', 'evaluate')
+
+# Seconds between liveness checks of the stage workers while waiting for finished tasks
+LIVENESS_POLL_SEC = 5.0
+
+
+def run_stage(
+        stage: str,
+        pc_method,
+        task: Tuple[Path, int],
+        times: Tuple[Dict[str, float], ...]
+) -> Tuple[Dict[str, float], ...]:
+    """
+    Run one stage of a (file, rate) task.
+    :param stage: 'encode', 'decode' or 'evaluate'
+    :param pc_method: PC method (Base subclass) the sweep runs
+    :param task: (original PC file, index of the rate in cfg['params'])
+    :param times: timings collected by the previous stages
+    :return: timings collected up to and including this stage
+    """
+    worker = pc_method.get_task_worker(*task)
+    try:
+        if stage == 'encode':
+            return times + (worker.run_encode(worker.orig_pc, worker.enc_pc, worker.dec_pc),)
+        if stage == 'decode':
+            return times + (worker.run_decode(worker.enc_pc, worker.dec_pc),)
+        worker.evaluate_task(*times)
+    except BaseException:
+        # A failed task never reaches the later stages, so nothing else would delete its scratch files
+        worker.discard_scratch()
+        raise
+    # Only the scratch reservation is left once the result is recorded
+    worker.discard_scratch()
+    return times
+
+
+def stage_worker(
+        stage: str,
+        pc_method,
+        in_queue: Queue,
+        out_queue: Queue,
+        done_queue: Queue,
+        worker_index: int = 0
+):
+    """
+    Worker loop of a stage: take tasks from in_queue until a None sentinel arrives, pass them on to out_queue.
+    Failed tasks are logged and reported to done_queue directly, so they never reach the later stages.
+    :param stage: 'encode', 'decode' or 'evaluate'
+    :param pc_method: PC method (Base subclass) the sweep runs
+    :param in_queue: queue of (task, times) from the previous stage
+    :param out_queue: queue of (task, times) to the next stage. Blocks when full, which throttles this stage
+    :param done_queue: queue of finished tasks
+    :param worker_index: index of this worker among all stage workers, see get_worker_cpus. Default: 0
+    :return: None
+    """
+    set_worker_index(worker_index)
+    while True:
+        with trace_span(pc_method.trace_dir, 'queue wait', stage=stage):
+            item = in_queue.get()
+        if item is None:
+            break
+        task, times = item
+        try:
+            with trace_span(pc_method.trace_dir, f'{stage} stage', stage=stage, file=Path(task[0]).name):
+                times = run_stage(stage, pc_method, task, times)
+        except Exception:
+            logger.exception(f'{stage} failed for {task}')
+            done_queue.put((task, False))
+            continue
+        with trace_span(pc_method.trace_dir, 'queue put', stage=stage):
+            out_queue.put((task, times))
+
+
+def run_pipeline(
+        pc_method,
+        tasks: List[Tuple[Path, int]],
+        encode: int = 1,
+        decode: int = 1,
+        evaluate: int = 1,
+        queue_size: int = 4
+):
+    """
+    Run (file, rate) tasks through separate encode -> decode -> evaluate stages, each with its own worker
+    processes. Stages are connected by bounded queues: when evaluation falls behind, decoders block on the
+    full queue, which caps the number of decoded PCs waiting on disk at roughly queue_size + decode + evaluate.
+    A stage worker that dies, e.g. killed by the OOM killer, stops the run with a RuntimeError, as its task would
+    never finish.
+    :param pc_method: PC method (Base subclass) the sweep runs
+    :param tasks: list of (original PC file, index of the rate in cfg['params'])
+    :param encode: number of encode workers. Default: 1
+    :param decode: number of decode workers. Default: 1
+    :param evaluate: number of evaluation workers. Default: 1
+    :param queue_size: capacity of the queues between stages. Default: 4
+    :return: number of failed tasks
+    """
+    num_workers = dict(zip(STAGES, (encode, decode, evaluate)))
+    done_queue = Queue()
+    # The task queue is unbounded so the parent never blocks while feeding it
+    queues = [Queue()] + [Queue(maxsize=queue_size) for _ in STAGES[1:]] + [done_queue]
+    processes = []
+    for i, stage in enumerate(STAGES):
+        for _ in range(num_workers[stage]):
+            p = Process(target=stage_worker,
+                        args=(stage, pc_method, queues[i], queues[i + 1], done_queue, len(processes)))
+            p.start()
+            processes.append(p)
+
+    for task in tasks:
+        queues[0].put((task, ()))
+
+    failed = 0
+    with tqdm(total=len(tasks)) as progress:
+        for _ in range(len(tasks)):
+            # Finished tasks arrive with their timings, failed ones with False
+            while True:
+                try:
+                    _, result = done_queue.get(timeout=LIVENESS_POLL_SEC)
+                    break
+                except queue.Empty:
+                    # Workers only exit on their sentinel, which is sent once every task is done
+                    dead = [p for p in processes if p.exitcode is not None]
+                    if dead:
+                        for p in processes:
+                            p.terminate()
+                        for p in processes:
+                            p.join()
+                        msg = ', '.join(f'{p.name} (exit code {p.exitcode})' for p in dead)
+                        logger.error(f'Stage workers died: {msg}')
+                        raise RuntimeError(f'Stage workers died: {msg}')
+            failed += result is False
+            progress.update()
+
+    # Every task is done, so all stage queues are drained and each worker picks up exactly one sentinel
+    for i, stage in enumerate(STAGES):
+        for _ in range(num_workers[stage]):
+            queues[i].put(None)
+    for p in processes:
+        p.join()
+    if failed:
+        logger.error(f'{failed} of {len(tasks)} tasks failed')
+    return failed
@@ -0,0 +1,220 @@
+import os
+import copy
+import math
+import logging
+import tempfile
+from pathlib import Path
+from multiprocessing import Pool, Value
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Optional
+from src.pc_methods.pc_base import Base
+from src.pc_methods.timing import init_worker
+from src.evaluation.ply_io import count_points
+
+logger = logging.getLogger(__name__)
+
+
+def encode_sample(
+        pc_method: Base,
+        orig_pc: Path
+) -> Optional[Tuple[int, int]]:
+    """
+    Encode one sample PC at the first (and only) rate of pc_method.
+    :param pc_method: PC method whose cfg['params'] holds the candidate parameters
+    :param orig_pc: Original PC file
+    :return: size of the bitstream in bits, number of points of the original PC, or None if the encode failed
+    """
+    worker = pc_method.get_task_worker(orig_pc, 0)
+    worker.run_encode(worker.orig_pc, worker.enc_pc)
+    enc_pc = Path(worker.enc_pc)
+    # Some codecs write the bitstream as a directory of files, see bin_extension
+    enc_files = [f for f in enc_pc.rglob('*') if f.is_file()] if enc_pc.is_dir() else [enc_pc]
+    size = sum(f.stat().st_size for f in enc_files if f.exists())
+    if size == 0:
+        logger.warning(f'Encoding {orig_pc} with {pc_method.cfg["params"][0]} wrote no bitstream')
+        return None
+    return size * 8, count_points(orig_pc)
+
+
+def get_sample(
+        files: List[Path],
+        sample_size: int
+) -> List[Path]:
+    """
+    Pick sample_size files spread evenly over the dataset, e.g. over the frames of a sequence.
+    :param files: point cloud files
+    :param sample_size: number of files to pick
+    :return: sample files
+    """
+    files = sorted(files)
+    if len(files) <= sample_size:
+        return files
+    step = len(files) / sample_size
+    return [files[int(i * step)] for i in range(sample_size)]
+
+
+# Searches the value of one codec parameter that reaches a target bpp on a sample of PC files.
+# The bpp is assumed to be monotonic in the parameter, the direction is found from the bounds.
+# The first cfg['params'] entry of pc_method is the template of the candidate rates.
+@dataclass
+class RateSearch:
+    pc_method: Base
+    files: List[Path]
+    parameter: str
+    low: float
+    high: float
+    integer: bool = False
+    num_processes: int = None
+    measured: Dict[float, float] = field(default_factory=dict)
+
+    def get_params(
+            self,
+            value: float,
+            rate_id: str
+    ) -> Dict:
+        """
+        Rate parameters with the searched parameter set to value.
+        :param value: value of the searched parameter
+        :param rate_id: id of the rate
+        :return: rate parameters
+        """
+        params = dict(self.pc_method.cfg['params'][0])
+        params['id'] = rate_id
+        params[self.parameter] = value
+        return params
+
+    def measure(self, value: float) -> Optional[float]:
+        """
+        Encode the sample with the searched parameter set to value. Every value is encoded only once.
+        Probes are encoded into a temporary directory under the experiments directory, removed afterwards.
+        :param value: value of the searched parameter
+        :return: bpp of the sample, i.e. total bitstream bits over total points, or None if an encode failed
+        """
+        if value not in self.measured:
+            method = copy.copy(self.pc_method)
+            params = self.get_params(value, f'search_{self.parameter}_{value}')
+            method.cfg = {**self.pc_method.cfg, 'params': [params]}
+            method.scratch = None
+            Path(self.pc_method.expt_dir).mkdir(parents=True, exist_ok=True)
+            num_processes = self.num_processes or os.cpu_count()
+            with tempfile.TemporaryDirectory(prefix='.rate_search-', dir=self.pc_method.expt_dir) as probe_dir:
+                method.expt_dir = probe_dir
+                with Pool(processes=num_processes, initializer=init_worker,
+                          initargs=(Value('i', 0), num_processes)) as p:
+                    sizes = p.starmap(encode_sample, [(method, f) for f in self.files])
+            if any(s is None for s in sizes):
+                logger.warning(f'{self.parameter}={value}: encode failed, skipping this value')
+                self.measured[value] = None
+            else:
+                self.measured[value] = sum(bits for bits, _ in sizes) / sum(n for _, n in sizes)
+                logger.info(f'{self.parameter}={value}: {self.measured[value]:.4f} bpp')
+        return self.measured[value]
+
+    def search(
+            self,
+            target: float,
+            tol: float = 0.05,
+            max_steps: int = 8
+    ) -> float:
+        """
+        Bracketed secant search on log(bpp): every step interpolates between the bracket ends,
+        falling back to bisection when the interpolation does not shrink the bracket or its value fails to encode.
+        :param target: target bpp
+        :param tol: relative bpp tolerance. Default: 0.05
+        :param max_steps: maximum number of encodes of the sample after the bounds. Default: 8
+        :return: value of the parameter whose bpp is closest to the target
+        """
+        def error(v):
+            bpp = self.measure(v)
+            return math.log(bpp / target) if bpp is not None else None
+
+        lo, hi = self.low, self.high
+        err_lo, err_hi = error(lo), error(hi)
+        if err_lo is None or err_hi is None:
+            logger.warning(f'A bound of [{self.low}, {self.high}] failed to encode, using the other one')
+        elif err_lo * err_hi > 0:
+            logger.warning(f'Target {target} bpp is outside of [{self.low}, {self.high}], using the closest bound')
+        else:
+            for _ in range(max_steps):
+                if min(abs(err_lo), abs(err_hi)) <= math.log(1 + tol):
+                    break
+                if self.integer and abs(hi - lo) <= 1:
+                    break
+                value = lo - err_lo * (hi - lo) / (err_hi - err_lo)
+                if self.integer:
+                    value = round(value)
+                # Keep the bracket shrinking, interpolation can get stuck next to one end
+                if not min(lo, hi) < value < max(lo, hi) or abs(value - lo) < abs(hi - lo) / 10 \
+                        or abs(hi - value) < abs(hi - lo) / 10:
+                    value = (lo + hi) / 2
+                    if self.integer:
+                        value = math.floor(value)
+                err = error(value)
+                if err is None:
+                    # Skip the failed value, bisect instead, and give up if that fails as well
+                    value = (lo + hi) / 2
+                    if self.integer:
+                        value = math.floor(value)
+                    err = error(value) if value not in self.measured else None
+                    if err is None:
+                        break
+                if err * err_lo > 0:
+                    lo, err_lo = value, err
+                else:
+                    hi, err_hi = value, err
+        measured = {v: bpp for v, bpp in self.measured.items() if bpp is not None}
+        if not measured:
+            logger.error(f'No value of {self.parameter} in [{self.low}, {self.high}] could be encoded')
+            raise ValueError
+        return min(measured, key=lambda v: abs(math.log(measured[v] / target)))
+
+
+def run_rate_search(
+        pc_method: Base,
+        dataset_name: str,
+        resolution: int,
+        color: bool,
+        targets: List[float] = None,
+        sample_size: int = 4,
+        tol: float = 0.05,
+        max_steps: int = 8,
+        num_processes: int = None,
+        **options
+):
+    """
+    Search the codec parameter values that reach target bpp values on a sample of the dataset, then run the
+    experiments on the whole dataset at these rates only, instead of sweeping a grid of hand-picked rates.
+    The searched parameter and its bounds come from cfg['search'], e.g.
+        search:
+          parameter: positionQuantizationScale
+          low: 0.01
+          high: 1.0
+          integer: false
+          targets:
+            8iVFB_100_depth10_color_normal: [0.25, 0.5, 1.0]
+    Every other parameter is taken from the first cfg['params'] entry. The rates are named by their target,
+    e.g. bpp0.5.
+    :param pc_method: PC method to run
+    :param dataset_name: dataset's name
+    :param resolution: dataset's resolution
+    :param color: dataset's color
+    :param targets: [optional] target bpp values. Default: cfg['search']['targets'][dataset_name]
+    :param sample_size: number of PC files the search encodes. Default: 4
+    :param tol: relative bpp tolerance of the search. Default: 0.05
+    :param max_steps: maximum number of search steps per target. Default: 8
+    :param num_processes: [optional] number of pool workers encoding the sample. Default: None
+    :param options: further options of run_experiments
+    :return: rate parameters found for every target
+    """
+    search_cfg = pc_method.cfg['search']
+    if targets is None:
+        targets = search_cfg['targets'][dataset_name]
+    pc_method.configure(resolution, color, use_cache=False)
+    files = pc_method.is_valid_dataset(dataset_name)
+    search = RateSearch(pc_method, get_sample(files, sample_size), search_cfg['parameter'], search_cfg['low'],
+                        search_cfg['high'], search_cfg.get('integer', False), num_processes)
+    params = [search.get_params(search.search(target, tol, max_steps), f'bpp{target}') for target in targets]
+    logger.info(f'Found {len(params)} rates with {len(search.measured)} sample encodes of {len(search.files)} files')
+    pc_method.cfg['params'] = params
+    pc_method.run_experiments(dataset_name, resolution, color, **options)
+    return params
@@ -0,0 +1,104 @@
+import re
+import json
+import hashlib
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Union, Dict, Optional
+from src.utils.hashing import hash_file
+
+logger = logging.getLogger(__name__)
+
+
+def hash_binary(
+        binary: Union[str, Path],
+        cwd: Union[str, Path] = None
+) -> str:
+    """
+    Hash a codec/metric binary or script. Commands that are not files (e.g. found on PATH) are hashed by name.
+    :param binary: path to the binary, absolute or relative to cwd
+    :param cwd: directory the binary is run from
+    :return: hex digest
+    """
+    path = Path(cwd).joinpath(binary) if cwd is not None else Path(binary)
+    if path.is_file():
+        return hash_file(path)
+    return hashlib.sha256(str(binary).encode()).hexdigest()
+
+
+@dataclass
+class ResultCache:
+    cache_dir: Union[str, Path]
+    hits: int = 0
+    misses: int = 0
+
+    def get_entry(
+            self,
+            slot: str,
+            key: str
+    ) -> Path:
+        """
+        Get the cache entry path of a result.
+        :param slot: task slot, i.e. dataset/rate/PC file name
+        :param key: cache key of the task
+        :return: path to the cache entry
+        """
+        return Path(self.cache_dir).joinpath(f'{slot}.{key}.json')
+
+    def lookup(
+            self,
+            slot: str,
+            key: str
+    ) -> Optional[Dict]:
+        """
+        Look up a cached result and count the hit/miss.
+        :param slot: task slot, i.e. dataset/rate/PC file name
+        :param key: cache key of the task
+        :return: cached evaluation data, or None on a miss
+        """
+        entry = self.get_entry(slot, key)
+        if entry.exists():
+            try:
+                with open(entry, 'r') as f:
+                    data = json.load(f)
+                self.hits += 1
+                return data
+            except ValueError:
+                logger.warning(f'Corrupted cache entry {entry}, recomputing')
+        self.misses += 1
+        return None
+
+    def store(
+            self,
+            slot: str,
+            key: str,
+            data: Dict
+    ):
+        """
+        Store a result, invalidating the entries of the same slot made with any other key.
+        :param slot: task slot, i.e. dataset/rate/PC file name
+        :param key: cache key of the task
+        :param data: evaluation data
+        :return: None
+        """
+        entry = self.get_entry(slot, key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # Match the file name literally, it may contain glob characters or be a prefix of another file's name
+        entry_pattern = re.compile(re.escape(Path(slot).name) + r'\.[0-9a-f]{64}\.json')
+        for stale in entry.parent.iterdir():
+            if stale != entry and entry_pattern.fullmatch(stale.name):
+                stale.unlink()
+        # Write then rename, so an interrupted run never leaves a truncated entry behind
+        tmp_entry = entry.parent / (entry.name + '.tmp')
+        with open(tmp_entry, 'w') as f:
+            json.dump(data, f)
+        tmp_entry.replace(entry)
+
+    def report(self) -> str:
+        """
+        Summary of cache hits and misses.
+        :return: report line
+        """
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return f'Result cache: {self.hits} hits, {self.misses} misses ({ratio:.1%} hit rate)'
@@ -0,0 +1,160 @@
+import os
+import json
+import queue
+import logging
+from tqdm import tqdm
+from pathlib import Path
+from multiprocessing import Pool, Value
+from dataclasses import dataclass
+from typing import Union, List, Dict, Callable
+from src.pc_methods.timing import init_worker
+
+logger = logging.getLogger(__name__)
+
+# Thread pools of the common numeric runtimes honour these
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS')
+# Head room on top of the peak RSS learned from past runs
+LEARNED_RSS_MARGIN = 1.2
+
+
+@dataclass
+class ResourceBudget:
+    rss_mb: float = None
+    threads: int = 1
+    max_concurrency: int = None
+
+
+def available_memory_mb() -> float:
+    """
+    Memory that can be given to new processes without swapping, MemAvailable on Linux.
+    :return: available memory in MB
+    """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+
+def learn_rss_mb(cache_dir: Union[str, Path]) -> float:
+    """
+    Peak RSS of the encoder/decoder children over the past runs recorded in a result cache.
+    :param cache_dir: result cache directory of a PC method
+    :return: peak RSS in MB, None if no past run recorded it
+    """
+    peak_kb = None
+    for entry in Path(cache_dir).glob('**/*.json'):
+        try:
+            with open(entry, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            continue
+        for key in ('Encode peak RSS in KB', 'Decode peak RSS in KB'):
+            value = data.get(key)
+            if isinstance(value, (int, float)) and value == value:
+                peak_kb = value if peak_kb is None else max(peak_kb, value)
+    return None if peak_kb is None else peak_kb / 1024
+
+
+def get_budget(
+        cfg: Dict,
+        cache_dir: Union[str, Path] = None
+) -> ResourceBudget:
+    """
+    Get the resource budget of a PC method from the 'resources' block of its cfg, used with
+    run_experiments(..., schedule_resources=True), e.g.
+        resources:
+          rss_mb: 6000          # expected peak RSS of one task
+          threads: 4            # threads one task uses
+          max_concurrency: 8    # tasks running at once
+          learn_rss: true       # use the peak RSS recorded in the result cache instead of rss_mb
+    :param cfg: PC method cfg
+    :param cache_dir: [optional] result cache directory of the PC method, used with learn_rss. Default: None
+    :return: resource budget
+    """
+    resources = cfg.get('resources') or {}
+    budget = ResourceBudget(resources.get('rss_mb'), resources.get('threads', 1), resources.get('max_concurrency'))
+    if resources.get('learn_rss') and cache_dir is not None:
+        learned = learn_rss_mb(cache_dir)
+        if learned is not None:
+            budget.rss_mb = learned * LEARNED_RSS_MARGIN
+            logger.info(f'Learned a peak RSS of {learned:.0f} MB per task from {cache_dir}')
+    return budget
+
+
+def set_thread_env(threads: int):
+    """
+    Limit the thread pools of the codecs started by this process, e.g. as a pool initializer.
+    :param threads: threads per task
+    :return: None
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+
+
+def run_scheduled(
+        process_f: Callable,
+        tasks: List,
+        budget: ResourceBudget,
+        memory_fraction: float = 0.9
+) -> int:
+    """
+    Run tasks on a pool, admitting a task only when its memory and cores are free: the tasks in flight reserve
+    budget.rss_mb each out of memory_fraction of the memory available at start, and budget.threads cores each
+    out of cpu_count, and at most budget.max_concurrency tasks run at once. This static cap, fixed when the pool
+    starts, is the real bound on memory. A task also waits while the memory available right now, less
+    budget.rss_mb for every task admitted since it was read, is below budget.rss_mb, e.g. used by other jobs on
+    the machine. This live check is advisory only: tasks admitted earlier may not have reached their peak yet,
+    so it cannot keep concurrent tasks from overcommitting and a budget.rss_mb below the real peak is not caught.
+    A task is always admitted when nothing else runs, so a budget larger than the machine still makes progress
+    one task at a time.
+    :param process_f: function run on every task
+    :param tasks: tasks, admitted in order
+    :param budget: resource budget of one task
+    :param memory_fraction: share of the available memory the tasks may reserve. Default: 0.9
+    :return: number of failed tasks
+    """
+    num_cpus = os.cpu_count()
+    threads = max(budget.threads, 1)
+    max_running = max(min(budget.max_concurrency or num_cpus, num_cpus // threads), 1)
+    memory_mb = available_memory_mb() * memory_fraction
+    if budget.rss_mb:
+        max_running = min(max_running, max(int(memory_mb // budget.rss_mb), 1))
+    logger.info(f'Running up to {max_running} tasks at once, {threads} threads and '
+                f'{budget.rss_mb or 0:.0f} MB each, {memory_mb:.0f} MB available')
+
+    done = queue.Queue()
+    failed = 0
+    running = 0
+    pending = list(reversed(tasks))
+    with Pool(processes=max_running, initializer=init_worker,
+              initargs=(Value('i', 0), max_running, set_thread_env, (threads,))) as p:
+        with tqdm(total=len(tasks)) as progress:
+            while pending or running:
+                # The pool has exactly max_running workers, so an admitted task starts right away
+                live_mb = available_memory_mb() if budget.rss_mb else None
+                while pending and running < max_running and \
+                        (running == 0 or not budget.rss_mb or live_mb >= budget.rss_mb):
+                    if budget.rss_mb:
+                        # The task has not allocated yet, so the reading does not account for it
+                        live_mb -= budget.rss_mb
+                    task = pending.pop()
+                    p.apply_async(process_f, (task,),
+                                  callback=lambda _: done.put(None),
+                                  error_callback=lambda e, t=task: done.put((t, e)))
+                    running += 1
+                error = done.get()
+                running -= 1
+                progress.update()
+                if error is not None:
+                    failed += 1
+                    logger.error(f'Task {error[0]} failed: {error[1]!r}')
+        p.close()
+        p.join()
+    if failed:
+        logger.error(f'{failed} of {len(tasks)} tasks failed')
+    return failed
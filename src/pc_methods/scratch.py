@@ -0,0 +1,160 @@
+import os
+import time
+import fcntl
+import shutil
+import asyncio
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Union, List
+
+logger = logging.getLogger(__name__)
+
+
+# Scratch space, e.g. a tmpfs, for the encoded and decoded PCs of the tasks in flight. They are deleted
+# once their task is evaluated, or moved to the experiments directory for the kinds listed in keep.
+# Before writing, a task reserves the space it expects to use, so that tasks starting at the same time
+# do not all pass the free space check before any of them has written a file.
+@dataclass
+class Scratch:
+    directory: Union[str, Path]
+    keep: List[str] = ()
+    min_free_mb: float = 1024
+    reserve_factor: float = 2.0
+    poll: float = 1.0
+    max_wait: float = 600
+
+    def try_reserve(
+            self,
+            key: str,
+            nbytes: int,
+            force: bool = False
+    ) -> bool:
+        """
+        Reserve nbytes of scratch space for a task if the free space, less the reservations of the tasks in flight,
+        stays above min_free_mb. Reservations are files under directory/.reserved, checked and created under a lock
+        of the scratch directory, so workers in other processes see them. Reservations of dead processes are dropped.
+        The files a task has already written count both as used space and as reserved, which errs on the safe side.
+        :param key: reservation key of the task, see Base.get_scratch_key
+        :param nbytes: expected size of the files of the task
+        :param force: reserve even if the space is short. Default: False
+        :return: True if the space was reserved
+        """
+        reserved_dir = Path(self.directory).joinpath('.reserved')
+        reserved_dir.mkdir(parents=True, exist_ok=True)
+        with open(Path(self.directory).joinpath('.reserved.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            reserved = 0
+            for f in reserved_dir.iterdir():
+                try:
+                    pid, size = (int(v) for v in f.read_text().split())
+                except (OSError, ValueError):
+                    continue
+                if not is_alive(pid):
+                    f.unlink(missing_ok=True)
+                    continue
+                reserved += size
+            free = shutil.disk_usage(self.directory).free - reserved
+            # A task is always admitted when no other task holds a reservation, as long as min_free_mb is free
+            if force or free - nbytes >= self.min_free_mb * 1024 ** 2 or \
+                    (reserved == 0 and free >= self.min_free_mb * 1024 ** 2):
+                reserved_dir.joinpath(key).write_text(f'{os.getpid()} {int(nbytes)}')
+                return True
+            return False
+
+    def reserve(
+            self,
+            key: str,
+            nbytes: int
+    ):
+        """
+        Block until nbytes of scratch space are reserved for a task, before it writes its first file.
+        Reserves anyway after max_wait seconds, so files that are not ours cannot stall the sweep forever.
+        :param key: reservation key of the task, see Base.get_scratch_key
+        :param nbytes: expected size of the files of the task
+        :return: None
+        """
+        begin = time.monotonic()
+        while not self.try_reserve(key, nbytes):
+            if time.monotonic() - begin > self.max_wait:
+                logger.warning(f'{self.directory} is still nearly full after {self.max_wait} sec, continuing')
+                self.try_reserve(key, nbytes, force=True)
+                return
+            time.sleep(self.poll)
+
+    async def reserve_async(
+            self,
+            key: str,
+            nbytes: int
+    ):
+        """
+        Same as reserve, for tasks of an event loop.
+        :return: None
+        """
+        begin = time.monotonic()
+        while not self.try_reserve(key, nbytes):
+            if time.monotonic() - begin > self.max_wait:
+                logger.warning(f'{self.directory} is still nearly full after {self.max_wait} sec, continuing')
+                self.try_reserve(key, nbytes, force=True)
+                return
+            await asyncio.sleep(self.poll)
+
+    def unreserve(
+            self,
+            key: str
+    ):
+        """
+        Drop the reservation of a task whose files are released.
+        :param key: reservation key of the task, see Base.get_scratch_key
+        :return: None
+        """
+        Path(self.directory).joinpath('.reserved', key).unlink(missing_ok=True)
+
+    def discard(
+            self,
+            scratch_file: Union[str, Path]
+    ):
+        """
+        Delete a file of a failed task from the scratch directory, whatever its kind.
+        :param scratch_file: file in the scratch directory
+        :return: None
+        """
+        Path(scratch_file).unlink(missing_ok=True)
+
+    def release(
+            self,
+            scratch_file: Union[str, Path],
+            persistent_file: Union[str, Path],
+            kind: str
+    ) -> Path:
+        """
+        Free the scratch space of a file whose task is done.
+        :param scratch_file: file in the scratch directory
+        :param persistent_file: path of the file in the experiments directory
+        :param kind: 'enc' or 'dec'
+        :return: persistent_file if the file was moved there (kind in keep), None if it was deleted
+        """
+        scratch_file = Path(scratch_file)
+        if not scratch_file.exists():
+            return None
+        if kind in self.keep:
+            Path(persistent_file).parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(scratch_file), str(persistent_file))
+            return Path(persistent_file)
+        scratch_file.unlink()
+        return None
+
+
+def is_alive(pid: int) -> bool:
+    """
+    Check if a process is running on this machine.
+    :param pid: process id
+    :return: True if the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
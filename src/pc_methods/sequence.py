@@ -0,0 +1,70 @@
+import re
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Union, List, Tuple
+
+FRAME_PATTERN = re.compile(r'^(?P<prefix>.*?)(?P<frame>\d+)$')
+
+
+@dataclass
+class FrameSequence:
+    prefix: str
+    start: int
+    width: int
+    frames: List[Path]
+
+    @property
+    def name(self) -> str:
+        """
+        Name of the sequence, i.e. the common file name prefix and the frame range.
+        :return: sequence name
+        """
+        return f'{self.prefix}{self.start:0{self.width}d}-{self.start + len(self.frames) - 1:0{self.width}d}'
+
+    def pattern(
+            self,
+            directory: Union[str, Path] = None,
+            suffix: str = '.ply'
+    ) -> str:
+        """
+        printf-style path pattern of the frames, e.g. dir/longdress_vox10_%04d.ply, as taken by TMC2.
+        :param directory: [optional] directory of the frames. Default: directory of the original frames
+        :param suffix: file name suffix of the frames. Default: '.ply'
+        :return: frame path pattern
+        """
+        directory = self.frames[0].parent if directory is None else Path(directory)
+        return str(directory.joinpath(f'{self.prefix}%0{self.width}d{suffix}'))
+
+
+def detect_sequences(files: List[Union[str, Path]]) -> Tuple[List[FrameSequence], List[Path]]:
+    """
+    Group frame-numbered PC files, e.g. longdress_vox10_1051.ply ... longdress_vox10_1350.ply, into sequences
+    of consecutive frames. Files sharing a directory, prefix and frame number width belong together,
+    a gap in the frame numbers starts a new sequence.
+    :param files: point cloud files
+    :return:
+        sequences: frame sequences, longest first
+        others: files without a frame number
+    """
+    groups = {}
+    others = []
+    for f in map(Path, files):
+        m = FRAME_PATTERN.match(f.stem)
+        if m is None:
+            others.append(f)
+            continue
+        key = (f.parent, m.group('prefix'), len(m.group('frame')))
+        groups.setdefault(key, []).append((int(m.group('frame')), f))
+
+    sequences = []
+    for (_, prefix, width), frames in groups.items():
+        frames.sort()
+        for frame, f in frames:
+            last = sequences[-1] if sequences else None
+            if last is not None and (last.prefix, last.width, last.frames[0].parent) == (prefix, width, f.parent) \
+                    and last.start + len(last.frames) == frame:
+                last.frames.append(f)
+            else:
+                sequences.append(FrameSequence(prefix, frame, width, [f]))
+    sequences.sort(key=lambda s: len(s.frames), reverse=True)
+    return sequences, others
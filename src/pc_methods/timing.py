@@ -0,0 +1,148 @@
+import os
+import time
+import logging
+import numpy as np
+import subprocess as sp
+from pathlib import Path
+from multiprocessing import Value
+from typing import Union, List, Dict, Callable
+
+logger = logging.getLogger(__name__)
+
+# Index of the current process among the workers of its pool, see init_worker. None outside of a pool
+_worker_index = None
+
+
+def set_worker_index(index: int):
+    """
+    Set the index of the current worker, e.g. of a pipeline stage process.
+    :param index: worker index, from 0
+    :return: None
+    """
+    global _worker_index
+    _worker_index = index
+
+
+def init_worker(
+        counter: Value,
+        num_workers: int,
+        initializer: Callable = None,
+        initargs: tuple = ()
+):
+    """
+    Pool initializer numbering the workers 0 .. num_workers - 1, then running initializer. A worker replacing
+    one that exited takes the next number modulo num_workers.
+    E.g. Pool(n, initializer=init_worker, initargs=(Value('i', 0), n))
+    :param counter: shared counter of the pool, starting at 0
+    :param num_workers: number of pool workers
+    :param initializer: [optional] further initializer. Default: None
+    :param initargs: arguments of initializer. Default: ()
+    :return: None
+    """
+    with counter.get_lock():
+        set_worker_index(counter.value % num_workers)
+        counter.value += 1
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def get_worker_cpus(cores_per_task: int) -> List[int]:
+    """
+    Get dedicated cores for the current pool worker: worker k gets cores [k * cores_per_task, (k + 1) * cores_per_task).
+    Outside of a pool the main process uses the first block.
+    :param cores_per_task: number of cores given to every task
+    :return: core ids
+    """
+    worker_id = _worker_index or 0
+    num_cpus = os.cpu_count()
+    return [(worker_id * cores_per_task + i) % num_cpus for i in range(cores_per_task)]
+
+
+def run_trial(
+        cmd: List[str],
+        cwd: Union[str, Path],
+        cpus: List[int] = None
+) -> Dict[str, float]:
+    """
+    Run a command once and measure it from the parent with wait4, so the figures cover only this child.
+    :param cmd: command to run
+    :param cwd: directory the command is run from
+    :param cpus: [optional] cores to pin the child to. Default: None
+    :return: wall time (perf_counter), user and system CPU time in sec, and peak RSS in KB of the child
+    """
+    preexec_fn = (lambda: os.sched_setaffinity(0, cpus)) if cpus else None
+    begin = time.perf_counter()
+    p = sp.Popen(cmd, cwd=cwd, stdout=sp.DEVNULL, stderr=sp.DEVNULL, preexec_fn=preexec_fn)
+    _, status, rusage = os.wait4(p.pid, 0)
+    wall = time.perf_counter() - begin
+    # The child is reaped already, so Popen must not wait for it again
+    p.returncode = os.waitstatus_to_exitcode(status)
+    if p.returncode != 0:
+        logger.warning(f'{cmd[0]} exited with code {p.returncode}')
+    return {'wall': wall,
+            'user': rusage.ru_utime,
+            'sys': rusage.ru_stime,
+            'rss': rusage.ru_maxrss}
+
+
+def skipped_timing() -> Dict[str, float]:
+    """
+    Timing summary of a command that was not run, e.g. a decode that was skipped.
+    :return: timing summary with every figure NaN and no trials
+    """
+    summary = dict.fromkeys(['wall time median in sec', 'wall time min in sec', 'wall time std in sec',
+                             'user time median in sec', 'sys time median in sec', 'peak RSS in KB'], float('nan'))
+    summary['trials'] = 0
+    return summary
+
+
+def apportion_timing(
+        summary: Dict[str, float],
+        share: float
+) -> Dict[str, float]:
+    """
+    Apportion the timing summary of a batched command to one of its files.
+    :param summary: timing summary of the whole command, see time_command
+    :param share: share of the command that goes to the file, e.g. its share of the batch's points
+    :return: timing summary with every time scaled by share. Peak RSS and trials are kept as they are
+    """
+    return {key: value * share if key.endswith('in sec') else value for key, value in summary.items()}
+
+
+def time_command(
+        cmd: List[str],
+        cwd: Union[str, Path],
+        trials: int = 1,
+        warmup: int = 0,
+        cores_per_task: int = None,
+        runner: Callable[..., Dict[str, float]] = run_trial
+) -> Dict[str, float]:
+    """
+    Time a command over repeated trials.
+    :param cmd: command to run
+    :param cwd: directory the command is run from
+    :param trials: number of measured trials, at least 1. Default: 1
+    :param warmup: number of unmeasured trials run first, e.g. to warm the page cache. Default: 0
+    :param cores_per_task:  [optional]
+                            pin every trial to this many dedicated cores of the current pool worker. Default: None
+    :param runner: runs one trial with the signature of run_trial, e.g. ModelServer.run_trial. Default: run_trial
+    :return: summary of wall/user/sys time in sec and peak RSS in KB
+    """
+    if trials < 1:
+        logger.error(f'trials must be at least 1, got {trials}')
+        raise ValueError
+    cpus = get_worker_cpus(cores_per_task) if cores_per_task else None
+    for _ in range(warmup):
+        runner(cmd, cwd, cpus)
+    runs = [runner(cmd, cwd, cpus) for _ in range(trials)]
+    wall = np.array([r['wall'] for r in runs])
+    user = np.array([r['user'] for r in runs])
+    system = np.array([r['sys'] for r in runs])
+    return {'wall time median in sec': float(np.median(wall)),
+            'wall time min in sec': float(wall.min()),
+            'wall time std in sec': float(wall.std()),
+            'user time median in sec': float(np.median(user)),
+            'sys time median in sec': float(np.median(system)),
+            'peak RSS in KB': max(r['rss'] for r in runs),
+            'trials': trials,
+            }
@@ -0,0 +1,182 @@
+import os
+import csv
+import json
+import time
+import logging
+import threading
+import contextvars
+import numpy as np
+from pathlib import Path
+from contextlib import contextmanager
+from multiprocessing import util
+from typing import Union, List, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_COLUMNS = ('stage', 'count', 'total in sec', 'mean in sec', 'p50 in sec', 'p95 in sec', 'max in sec')
+
+# Spans of a task waiting for a pool worker. They overlap the previous task of the worker, so they get a
+# timeline row of their own and do not count as busy time
+QUEUE_WAIT_SPAN = 'queue_wait'
+QUEUE_WAIT_LANE = 0
+
+# Nesting depth of the current span, per thread and per asyncio task
+_depth = contextvars.ContextVar('depth', default=0)
+# Spans of the current process not yet written, per trace directory
+_buffers: Dict[Tuple[int, str], List[Dict]] = {}
+
+
+def flush_spans():
+    """
+    Append the buffered spans of the current process to its spans file in every trace directory.
+    :return: None
+    """
+    for (pid, trace_dir), spans in _buffers.items():
+        if pid != os.getpid() or not spans:
+            continue
+        with open(Path(trace_dir).joinpath(f'spans-{pid}.jsonl'), 'a') as f:
+            f.writelines(json.dumps(s) + '\n' for s in spans)
+        spans.clear()
+
+
+def get_buffer(trace_dir: Union[str, Path]) -> List[Dict]:
+    """
+    Get the span buffer of the current process, flushed when the process exits normally, e.g. a pool worker
+    after close().
+    :param trace_dir: trace directory of the run
+    :return: span buffer
+    """
+    key = (os.getpid(), str(trace_dir))
+    if key not in _buffers:
+        Path(trace_dir).mkdir(parents=True, exist_ok=True)
+        _buffers[key] = []
+        util.Finalize(None, flush_spans, exitpriority=10)
+    return _buffers[key]
+
+
+@contextmanager
+def trace_span(
+        trace_dir: Union[str, Path],
+        name: str,
+        lane: int = None,
+        **tags
+):
+    """
+    Record the time spent in the with-block as a span of the current process. Does nothing if trace_dir is None.
+    :param trace_dir: trace directory of the run, or None if tracing is off
+    :param name: stage name, e.g. 'encode' or 'queue wait'
+    :param lane: [optional] timeline row of the span, e.g. for concurrent asyncio tasks. Default: current thread
+    :param tags: tags of the span, e.g. codec, rate and file
+    """
+    if trace_dir is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    begin = time.monotonic_ns()
+    try:
+        yield
+    finally:
+        _depth.reset(token)
+        record_span(trace_dir, name, begin, time.monotonic_ns(), lane, **tags)
+
+
+def record_span(
+        trace_dir: Union[str, Path],
+        name: str,
+        begin: int,
+        end: int,
+        lane: int = None,
+        **tags
+):
+    """
+    Record a span of the current process between two time.monotonic_ns() readings, e.g. one taken in another
+    process, as the monotonic clock is shared by all processes of the machine. Does nothing if trace_dir is None.
+    :param trace_dir: trace directory of the run, or None if tracing is off
+    :param name: stage name
+    :param begin: begin of the span in ns
+    :param end: end of the span in ns
+    :param lane: [optional] timeline row of the span. Default: current thread
+    :param tags: tags of the span, e.g. codec, rate and file
+    :return: None
+    """
+    if trace_dir is None:
+        return
+    buffer = get_buffer(trace_dir)
+    buffer.append({'name': name, 'pid': os.getpid(), 'lane': threading.get_ident() if lane is None else lane,
+                   'begin': begin // 1000, 'dur': (end - begin) // 1000, 'depth': _depth.get(), 'tags': tags})
+    if len(buffer) >= 256:
+        flush_spans()
+
+
+def load_spans(trace_dir: Union[str, Path]) -> List[Dict]:
+    """
+    Load the spans of every process of a run.
+    :param trace_dir: trace directory of the run
+    :return: spans, times in microseconds
+    """
+    spans = []
+    for spans_file in sorted(Path(trace_dir).glob('spans-*.jsonl')):
+        with open(spans_file, 'r') as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+
+def idle_times(spans: List[Dict]) -> Dict[int, float]:
+    """
+    Time every process spent outside of its top-level spans, between its first and its last span,
+    e.g. a pool worker waiting for its next task.
+    :param spans: spans of a run
+    :return: idle time in sec per process
+    """
+    intervals = {}
+    for s in spans:
+        if s['depth'] == 0 and s['name'] != QUEUE_WAIT_SPAN:
+            intervals.setdefault(s['pid'], []).append((s['begin'], s['begin'] + s['dur']))
+    idle = {}
+    for pid, spans_pid in intervals.items():
+        spans_pid.sort()
+        busy, end = 0, spans_pid[0][0]
+        for b, e in spans_pid:
+            busy += max(e - max(b, end), 0)
+            end = max(end, e)
+        idle[pid] = (end - spans_pid[0][0] - busy) / 1e6
+    return idle
+
+
+def export_trace(
+        trace_dir: Union[str, Path]
+) -> Tuple[Path, Path]:
+    """
+    Export the spans of a run as a Chrome trace, to be opened in Perfetto or chrome://tracing, and summarize
+    the latency of every stage. Process idle time is summarized as the stage 'idle', one sample per process.
+    :param trace_dir: trace directory of the run
+    :return:
+        trace_file: trace_dir/trace.json
+        summary_file: trace_dir/stage_summary.csv
+    """
+    flush_spans()
+    spans = load_spans(trace_dir)
+    origin = min((s['begin'] for s in spans), default=0)
+    events = [{'name': s['name'], 'cat': s['tags'].get('codec', ''), 'ph': 'X', 'ts': s['begin'] - origin,
+               'dur': s['dur'], 'pid': s['pid'], 'tid': s['lane'], 'args': s['tags']} for s in spans]
+    trace_file = Path(trace_dir).joinpath('trace.json')
+    with open(trace_file, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    durations = {}
+    for s in spans:
+        durations.setdefault(s['name'], []).append(s['dur'] / 1e6)
+    idle = idle_times(spans)
+    if idle:
+        durations['idle'] = list(idle.values())
+    summary_file = Path(trace_dir).joinpath('stage_summary.csv')
+    with open(summary_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_COLUMNS)
+        for stage, values in sorted(durations.items()):
+            values = np.array(values)
+            writer.writerow([stage, len(values), values.sum(), values.mean(), np.percentile(values, 50),
+                             np.percentile(values, 95), values.max()])
+    logger.info(f'Wrote {len(events)} spans of {len({s["pid"] for s in spans})} processes to {trace_file}')
+    return trace_file, summary_file
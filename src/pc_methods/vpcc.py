@@ -3,13 +3,29 @@ from src.pc_methods.pc_base import Base
 
 
 class VPCC(Base):
+    supports_sequences = True
+
     def __init__(self):
         super().__init__()
 
     def encode(self, orig_pc, enc_pc) -> List[str]:
+        return self.encode_frames(orig_pc, enc_pc, frame_count=1)
+
+    def decode(self, enc_file, dec_file) -> List[str]:
+        return self.decode_frames(enc_file, dec_file)
+
+    def encode_sequence(self, sequence, enc_file) -> List[str]:
+        return self.encode_frames(sequence.pattern(), enc_file,
+                                  frame_count=len(sequence.frames),
+                                  start_frame=sequence.start)
+
+    def decode_sequence(self, sequence, enc_file, dec_pattern) -> List[str]:
+        return self.decode_frames(enc_file, dec_pattern, start_frame=sequence.start)
+
+    def encode_frames(self, orig_pc, enc_pc, frame_count, start_frame=None) -> List[str]:
         cmd = [self.cfg['encoder'],
-               '--uncompressedDataPath=' + orig_pc,
-               '--compressedStreamPath=' + enc_pc,
+               '--uncompressedDataPath=' + str(orig_pc),
+               '--compressedStreamPath=' + str(enc_pc),
                '--configurationFolder=./' + self.cfg['cfg_folder'],
                '--config=./' + self.cfg['cfg_common'],
                '--config=./' + self.cfg['cfg_condition'],
@@ -20,16 +36,18 @@ class VPCC(Base):
                '--videoEncoderOccupancyPath=./' + self.cfg['vid_encoder'],
                '--videoEncoderGeometryPath=./' + self.cfg['vid_encoder'],
                '--videoEncoderAttributePath=./' + self.cfg['vid_encoder'],
-               '--frameCount=1',
+               '--frameCount=' + str(frame_count),
                '--computeMetrics=0',
                '--computeChecksum=0'
                ]
+        if start_frame is not None:
+            cmd.append('--startFrameNumber=' + str(start_frame))
         return cmd
 
-    def decode(self, enc_file, dec_file) -> List[str]:
+    def decode_frames(self, enc_file, dec_file, start_frame=None) -> List[str]:
         cmd = [self.cfg['decoder'],
-               '--compressedStreamPath=' + enc_file,
-               '--reconstructedDataPath=' + dec_file,
+               '--compressedStreamPath=' + str(enc_file),
+               '--reconstructedDataPath=' + str(dec_file),
                '--videoDecoderOccupancyPath=' + self.cfg['vid_decoder'],
                '--videoDecoderGeometryPath=' + self.cfg['vid_decoder'],
                '--videoDecoderAttributePath=' + self.cfg['vid_decoder'],
@@ -37,4 +55,6 @@ class VPCC(Base):
                '--computeMetrics=0',
                '--computeChecksum=0'
                ]
+        if start_frame is not None:
+            cmd.append('--startFrameNumber=' + str(start_frame))
         return cmd
@@ -0,0 +1,309 @@
+import os
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from multiprocessing import Process
+from dataclasses import dataclass
+from typing import Union, List, Dict, Tuple, Optional
+from src.pc_methods.pc_base import Base
+from src.evaluation.dataset_index import DatasetIndex
+from src.evaluation.results_store import flush_results_stores
+from src.pc_methods.tracing import export_trace
+from src.pc_methods.timing import set_worker_index
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    slot TEXT NOT NULL UNIQUE,
+    pc_file TEXT NOT NULL,
+    rate_id INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    cache_key TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id);
+"""
+
+
+# Work queue of (file, rate) tasks in an SQLite file on a filesystem shared by all hosts. Workers claim tasks
+# under a lease that they renew with heartbeats; a lease that runs out, e.g. of a crashed host, is claimed again.
+# The rollback journal is used instead of WAL, which needs shared memory and does not work across hosts.
+# Lease times are wall clock times, so the clocks of the hosts need to be in sync (e.g. NTP).
+@dataclass
+class WorkQueue:
+    db_file: Union[str, Path]
+    lease_sec: float = 300
+    max_attempts: int = 3
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the queue, creating it on first use, and add the cache_key column to queues of earlier versions.
+        Transactions are started explicitly, see claim.
+        :return: connection
+        """
+        Path(self.db_file).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_file), timeout=60, isolation_level=None)
+        conn.executescript(SCHEMA)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(tasks)')]
+        if 'cache_key' not in columns:
+            conn.execute('ALTER TABLE tasks ADD COLUMN cache_key TEXT')
+        return conn
+
+    def enqueue(
+            self,
+            tasks: List[Tuple[Path, int]],
+            slots: List[str],
+            cache_keys: List[str]
+    ) -> Tuple[int, int]:
+        """
+        Add tasks to the queue. Tasks whose slot is queued already with the same cache key are left as they are,
+        so every host of a sweep can enqueue the same tasks. Done or failed tasks whose cache key differs, e.g. after
+        the rate parameters or a binary changed, are pending again with fresh attempts.
+        :param tasks: list of (original PC file, index of the rate in cfg['params'])
+        :param slots: cache slot of every task, see Base.get_cache_slot
+        :param cache_keys: cache key of every task, see Base.get_cache_keys
+        :return:
+            added: number of added tasks
+            requeued: number of done or failed tasks that are pending again
+        """
+        rows = [(slot, str(f), rate_id, key) for (f, rate_id), slot, key in zip(tasks, slots, cache_keys)]
+        conn = self.connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            before = conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            conn.executemany('INSERT OR IGNORE INTO tasks (slot, pc_file, rate_id, cache_key) VALUES (?, ?, ?, ?)',
+                             rows)
+            added = conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] - before
+            requeued = conn.total_changes
+            conn.executemany("UPDATE tasks SET state = 'pending', pc_file = ?, rate_id = ?, cache_key = ?, "
+                             "worker = NULL, lease_until = NULL, attempts = 0, error = NULL "
+                             "WHERE slot = ? AND state IN ('done', 'failed') AND cache_key IS NOT ?",
+                             [(f, rate_id, key, slot, key) for slot, f, rate_id, key in rows])
+            requeued = conn.total_changes - requeued
+            # Pending tasks run with the parameters of this host anyway
+            conn.executemany("UPDATE tasks SET pc_file = ?, rate_id = ?, cache_key = ? "
+                             "WHERE slot = ? AND state = 'pending' AND cache_key IS NOT ?",
+                             [(f, rate_id, key, slot, key) for slot, f, rate_id, key in rows])
+        conn.close()
+        return added, requeued
+
+    def claim(
+            self,
+            worker: str
+    ) -> Optional[Tuple[int, Tuple[Path, int]]]:
+        """
+        Lease the oldest pending task. Expired leases are put back first, tasks out of attempts are marked failed.
+        :param worker: worker id, e.g. host:pid
+        :return: (task id, (original PC file, index of the rate)), or None if no task is pending
+        """
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                         "worker = NULL, error = 'lease expired' WHERE state = 'leased' AND lease_until < ?",
+                         (self.max_attempts, now))
+            row = conn.execute("SELECT id, pc_file, rate_id FROM tasks WHERE state = 'pending' ORDER BY id LIMIT 1"
+                               ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                             "WHERE id = ?", (worker, now + self.lease_sec, row[0]))
+        conn.close()
+        if row is None:
+            return None
+        return row[0], (Path(row[1]), row[2])
+
+    def heartbeat(
+            self,
+            task_id: int,
+            worker: str
+    ) -> bool:
+        """
+        Renew the lease of a task.
+        :param task_id: task id
+        :param worker: worker id holding the lease
+        :return: False if the lease was lost, e.g. it expired and another worker claimed the task
+        """
+        conn = self.connect()
+        with conn:
+            renewed = conn.execute("UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                                   (time.time() + self.lease_sec, task_id, worker)).rowcount
+        conn.close()
+        return renewed > 0
+
+    def finish(
+            self,
+            task_id: int,
+            worker: str,
+            error: str = None
+    ):
+        """
+        Release a task after it ran: done, or on error pending again until it is out of attempts.
+        :param task_id: task id
+        :param worker: worker id holding the lease
+        :param error: [optional] error of a failed run. Default: None
+        :return: None
+        """
+        conn = self.connect()
+        with conn:
+            if error is None:
+                conn.execute("UPDATE tasks SET state = 'done', lease_until = NULL WHERE id = ? AND worker = ?",
+                             (task_id, worker))
+            else:
+                conn.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                             "worker = NULL, lease_until = NULL, error = ? WHERE id = ? AND worker = ?",
+                             (self.max_attempts, error, task_id, worker))
+        conn.close()
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Count the tasks per state.
+        :return: number of tasks per state, i.e. pending, leased, done and failed
+        """
+        conn = self.connect()
+        rows = conn.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall()
+        conn.close()
+        return dict(rows)
+
+
+def keep_alive(
+        queue: WorkQueue,
+        task_id: int,
+        worker: str,
+        stop: threading.Event
+):
+    """
+    Renew the lease of a running task every third of the lease time until stop is set.
+    :param queue: work queue
+    :param task_id: task id
+    :param worker: worker id holding the lease
+    :param stop: set when the task is done
+    :return: None
+    """
+    while not stop.wait(queue.lease_sec / 3):
+        if not queue.heartbeat(task_id, worker):
+            logger.warning(f'{worker} lost the lease of task {task_id}')
+            return
+
+
+def run_worker(
+        pc_method: Base,
+        queue: WorkQueue,
+        poll: float = 5.0,
+        worker_index: int = 0
+) -> int:
+    """
+    Claim and process tasks until none is pending or leased. While other workers hold leases, keep polling,
+    so the tasks of a worker that dies are picked up once its leases expire.
+    :param pc_method: configured PC method, see run_distributed
+    :param queue: work queue
+    :param poll: seconds between claims while every remaining task is leased. Default: 5.0
+    :param worker_index: index of this worker among the workers of the host, see get_worker_cpus. Default: 0
+    :return: number of tasks done by this worker
+    """
+    set_worker_index(worker_index)
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    done = 0
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            if not queue.counts().get('leased'):
+                break
+            time.sleep(poll)
+            continue
+        task_id, task = claimed
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=keep_alive, args=(queue, task_id, worker, stop), daemon=True)
+        heartbeat.start()
+        error = None
+        try:
+            pc_method.process_task(task)
+            # Commit the result before the task is done, so a crash cannot lose the result of a done task
+            flush_results_stores()
+            done += 1
+        except Exception as e:
+            logger.exception(f'Task {task} failed on {worker}')
+            error = repr(e)
+        finally:
+            stop.set()
+            heartbeat.join()
+        queue.finish(task_id, worker, error)
+    flush_results_stores()
+    return done
+
+
+def run_distributed(
+        pc_method: Base,
+        dataset_name: str,
+        resolution: int,
+        color: bool,
+        queue_file: Union[str, Path] = None,
+        num_workers: int = None,
+        lease_sec: float = 300,
+        max_attempts: int = 3,
+        use_index: bool = True,
+        **options
+) -> Dict[str, int]:
+    """
+    Run a sweep on any number of hosts sharing the experiments directory: start the same call on every host.
+    Every host enqueues the tasks that are not cached yet (tasks queued already are kept unless their cache key
+    changed, see WorkQueue.enqueue) and runs num_workers worker processes claiming tasks from the shared queue,
+    see WorkQueue. Results are written exactly as run_experiments does, e.g. one JSON file per task into the shared
+    experiments directory.
+    Paths of the dataset and of the experiments directory have to be the same on all hosts.
+    :param pc_method: PC method to run
+    :param dataset_name: dataset's name
+    :param resolution: dataset's resolution
+    :param color: dataset's color
+    :param queue_file:  [optional]
+                        SQLite queue on the shared filesystem. Default: expt_dir/.queue/<pc_method>-<dataset>.sqlite
+    :param num_workers: [optional]
+                        number of worker processes on this host. If None, num_workers = cpu_count. Default: None
+    :param lease_sec: lease time of a claimed task, renewed every third of it while the task runs. Default: 300
+    :param max_attempts: number of times a task is claimed before it is marked failed. Default: 3
+    :param use_index: see run_experiments. Default: True
+    :param options: further options, see configure
+    :return: number of tasks per state after this host's workers stopped
+    """
+    pc_method.configure(resolution, color, **options)
+    files = pc_method.is_valid_dataset(dataset_name)
+    pc_method.dataset_index = None
+    if use_index:
+        pc_method.dataset_index = DatasetIndex(Path(pc_method.dataset_dir).joinpath('.index', dataset_name),
+                                               normals=pc_method.needs_normals())
+        pc_method.dataset_index.update(files)
+        pc_method.check_resolution(files)
+    if queue_file is None:
+        queue_file = Path(pc_method.expt_dir).joinpath('.queue',
+                                                        f'{pc_method.get_pc_method_name()}-{dataset_name}.sqlite')
+    queue = WorkQueue(queue_file, lease_sec, max_attempts)
+    tasks = pc_method.prepare_tasks(files)
+    slots = [pc_method.get_cache_slot(*task) for task in tasks]
+    # Without the result cache, prepare_tasks does not compute the cache keys
+    cache_keys = pc_method.cache_keys if pc_method.result_cache is not None else pc_method.get_cache_keys(tasks)
+    added, requeued = queue.enqueue(tasks, slots, [cache_keys[slot] for slot in slots])
+    logger.info(f'Queued {added} of {len(tasks)} tasks in {queue_file}, {requeued} done or failed tasks '
+                f'with changed parameters are pending again')
+
+    workers = [Process(target=run_worker, args=(pc_method, queue), kwargs={'worker_index': i})
+               for i in range(num_workers or os.cpu_count())]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    if pc_method.result_cache is not None:
+        logger.info(pc_method.result_cache.report())
+    if pc_method.trace_dir is not None:
+        export_trace(pc_method.trace_dir)
+    counts = queue.counts()
+    if counts.get('failed'):
+        logger.error(f'{counts["failed"]} tasks failed, see the error column of {queue_file}')
+    return counts
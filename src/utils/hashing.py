@@ -0,0 +1,30 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import Union, Dict
+
+
+def hash_file(
+        path: Union[str, Path],
+        chunk_size: int = 1 << 20
+) -> str:
+    """
+    Compute the SHA-256 content hash of a file.
+    :param path: file to be hashed
+    :param chunk_size: bytes read at a time
+    :return: hex digest
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def make_key(components: Dict) -> str:
+    """
+    Content-addressed cache key over all components that determine a result.
+    :param components: JSON-serializable key components
+    :return: hex digest
+    """
+    return hashlib.sha256(json.dumps(components, sort_keys=True, default=str).encode()).hexdigest()
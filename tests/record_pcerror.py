@@ -0,0 +1,87 @@
+"""
+Record a pc_error run on a real frame for tests/test_metrics.py.
+
+    python tests/record_pcerror.py --pc-error /path/to/pc_error --frame longdress_vox10_1300.ply --resolution 10
+
+writes tests/data/pcerror/<frame name>/ with the original and decoded PCs, the normals pc_error and the in-process
+backend share, case.json and pc_error's stdout. Without --decoded, the decoded PC is the frame requantized by
+--drop-bits bits with averaged colors, which gives non-zero geometry and color errors.
+"""
+import sys
+import json
+import argparse
+import subprocess as sp
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.evaluation.ply_io import read_vertex, write_vertex  # noqa: E402
+from src.evaluation.dataset_index import index_file  # noqa: E402
+
+DATA_DIR = Path(__file__).parent.joinpath('data', 'pcerror')
+
+COLORS = ('red', 'green', 'blue')
+
+
+def requantize(vertex: np.ndarray, drop_bits: int) -> np.ndarray:
+    """
+    Requantize a PC to a coarser grid, merging the points of a voxel and averaging their colors.
+    :param vertex: vertex element of the frame
+    :param drop_bits: bits dropped from every coordinate
+    :return: vertex element of the requantized PC, in the coordinates of the frame
+    """
+    points = np.column_stack([vertex[axis] for axis in ('x', 'y', 'z')]).astype(np.int64)
+    voxels, inverse = np.unique(points >> drop_bits, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    fields = [(axis, 'f4') for axis in ('x', 'y', 'z')]
+    if all(c in vertex.dtype.names for c in COLORS):
+        fields += [(c, 'u1') for c in COLORS]
+    dec = np.empty(len(voxels), dtype=fields)
+    for i, axis in enumerate(('x', 'y', 'z')):
+        dec[axis] = (voxels[:, i] << drop_bits) + ((1 << drop_bits) - 1) / 2
+    counts = np.bincount(inverse)
+    for c in COLORS if len(fields) > 3 else ():
+        dec[c] = np.round(np.bincount(inverse, weights=vertex[c].astype(np.float64)) / counts)
+    return dec
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record pc_error output on a real frame for the metric tests')
+    parser.add_argument('--pc-error', required=True, help='pc_error binary')
+    parser.add_argument('--frame', required=True, help='original frame, e.g. an 8i or MVUB PLY')
+    parser.add_argument('--decoded', help='decoded frame, e.g. from a codec. Default: the requantized frame')
+    parser.add_argument('--resolution', type=int, required=True, help='bit depth of the frame')
+    parser.add_argument('--drop-bits', type=int, default=1)
+    parser.add_argument('--name', help='case name. Default: the frame name')
+    args = parser.parse_args()
+
+    frame = Path(args.frame)
+    case_dir = DATA_DIR.joinpath(args.name or frame.stem)
+    case_dir.mkdir(parents=True, exist_ok=True)
+    orig_pc, dec_pc = case_dir.joinpath('orig.ply'), case_dir.joinpath('dec.ply')
+    vertex = read_vertex(frame)
+    write_vertex(orig_pc, vertex)
+    write_vertex(dec_pc, read_vertex(args.decoded) if args.decoded else requantize(vertex, args.drop_bits))
+
+    entry = index_file(orig_pc, case_dir)
+    pcerror_cmd = [args.pc_error,
+                   '--fileA=' + str(orig_pc),
+                   '--fileB=' + str(dec_pc),
+                   '--resolution=' + str(2 ** args.resolution - 1),
+                   '--hausdorff=1',
+                   '--color=1'
+                   ]
+    case = {'resolution': args.resolution, 'frame': frame.name, 'normals': None}
+    if entry['normals'] is not None:
+        normals_pc = case_dir.joinpath(entry['normals']).rename(case_dir.joinpath('normals.ply'))
+        pcerror_cmd.append('--inputNorm=' + str(normals_pc))
+        case['normals'] = normals_pc.name
+    pcerror = sp.run(pcerror_cmd, stdout=sp.PIPE, universal_newlines=True, check=True)
+    case_dir.joinpath('pc_error.txt').write_text(pcerror.stdout)
+    case_dir.joinpath('case.json').write_text(json.dumps(case, indent=4))
+    print(f'Recorded {case_dir}')
+
+
+if __name__ == '__main__':
+    main()
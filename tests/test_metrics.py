@@ -0,0 +1,104 @@
+import os
+import json
+import subprocess as sp
+import numpy as np
+import pytest
+from pathlib import Path
+from src.evaluation.ply_io import write_vertex
+from src.evaluation.evaluate import Evaluator, GEOMETRY_METRICS, COLOR_METRICS
+from src.evaluation.metrics import geometry_distortion, compare_with_pcerror
+
+RESOLUTION = 10
+
+# Relative tolerance of the comparison, pc_error prints 6 significant digits
+RTOL = 1e-4
+
+# pc_error runs on real frames, recorded with tests/record_pcerror.py
+RECORDED_DIR = Path(__file__).parent.joinpath('data', 'pcerror')
+RECORDED_CASES = sorted(f.parent for f in RECORDED_DIR.glob('*/pc_error.txt'))
+
+# Final (symmetric) metrics pc_error prints for the fixture below with
+# --resolution=1023 --hausdorff=1 --color=1, worked out by hand from pc_error's definitions:
+#   D1: B->A squared errors 1, 0, 1, 0, 0 -> 0.4 and A->B 1, 0, 0, 0 -> 0.25, Hausdorff 1
+#   D2: the normals of A are (0, 0, 1), only the z offset of b0 counts -> 1 / 5 and 1 / 4, Hausdorff 1
+#   Y:  b2 is equidistant to a2 and a3 and compares with their average color 20, not with 10 or 30 as a single
+#       nearest neighbour would -> B->A 100 / 5 and A->B 100 / 4, Hausdorff 100
+#   Cb, Cr: all colors are gray -> 0
+PCERROR_STDOUT = """\
+3. Final (symmetric).
+   mseF      (p2point): 0.4
+   mseF,PSNR (p2point): 68.9481
+   mseF      (p2plane): 0.25
+   mseF,PSNR (p2plane): 70.9893
+   c[0],    F         : 25
+   c[1],    F         : 0
+   c[2],    F         : 0
+   c[0],PSNRF         : 34.1514
+   c[1],PSNRF         : inf
+   c[2],PSNRF         : inf
+   h.        (p2point): 1
+   h.,PSNR   (p2point): 64.9687
+   h.        (p2plane): 1
+   h.,PSNR   (p2plane): 64.9687
+   h.c[0],    F         : 100
+   h.c[1],    F         : 0
+   h.c[2],    F         : 0
+   h.c[0],PSNRF         : 28.1308
+   h.c[1],PSNRF         : inf
+   h.c[2],PSNRF         : inf
+"""
+
+
+def write_pc(pc_file, points, gray, normals=None):
+    fields = [(axis, 'f4') for axis in ('x', 'y', 'z')] + [(c, 'u1') for c in ('red', 'green', 'blue')]
+    if normals is not None:
+        fields += [(n, 'f4') for n in ('nx', 'ny', 'nz')]
+    vertex = np.empty(len(points), dtype=fields)
+    for i, axis in enumerate(('x', 'y', 'z')):
+        vertex[axis] = np.asarray(points)[:, i]
+    for c in ('red', 'green', 'blue'):
+        vertex[c] = gray
+    if normals is not None:
+        for i, n in enumerate(('nx', 'ny', 'nz')):
+            vertex[n] = np.asarray(normals)[:, i]
+    write_vertex(pc_file, vertex)
+
+
+@pytest.fixture
+def fixture_pair(tmp_path):
+    orig_pc, dec_pc = tmp_path / 'orig.ply', tmp_path / 'dec.ply'
+    write_pc(orig_pc, [(0, 0, 0), (2, 0, 0), (0, 2, 0), (2, 2, 0)], [100, 50, 10, 30], [(0, 0, 1)] * 4)
+    write_pc(dec_pc, [(0, 0, 1), (2, 0, 0), (1, 2, 0), (2, 2, 0), (0, 2, 0)], [100, 60, 20, 30, 10])
+    return orig_pc, dec_pc
+
+
+def test_geometry_distortion_matches_definitions(fixture_pair):
+    values = geometry_distortion(*fixture_pair, RESOLUTION, color=True)
+    expected = Evaluator.find_pattern(GEOMETRY_METRICS + COLOR_METRICS, PCERROR_STDOUT.splitlines())
+    assert compare_with_pcerror(values, expected, rtol=RTOL) == []
+
+
+@pytest.mark.skipif('PC_ERROR' not in os.environ, reason='set PC_ERROR to the pc_error binary to compare with it')
+def test_pcerror_binary_matches_recorded_output(fixture_pair):
+    orig_pc, dec_pc = fixture_pair
+    pcerror = sp.run([os.environ['PC_ERROR'], f'--fileA={orig_pc}', f'--fileB={dec_pc}',
+                      f'--resolution={2 ** RESOLUTION - 1}', '--hausdorff=1', '--color=1'],
+                     stdout=sp.PIPE, stderr=sp.DEVNULL, universal_newlines=True, check=True)
+    metrics = GEOMETRY_METRICS + COLOR_METRICS
+    values = Evaluator.find_pattern(metrics, pcerror.stdout.splitlines())
+    expected = Evaluator.find_pattern(metrics, PCERROR_STDOUT.splitlines())
+    assert compare_with_pcerror([float(v) for v in values], expected, rtol=RTOL) == []
+
+
+@pytest.mark.skipif(not RECORDED_CASES, reason='no recorded pc_error output, see tests/record_pcerror.py')
+@pytest.mark.parametrize('case_dir', RECORDED_CASES, ids=[c.name for c in RECORDED_CASES])
+def test_in_process_matches_recorded_pcerror(case_dir):
+    case = json.loads(case_dir.joinpath('case.json').read_text())
+    metrics = GEOMETRY_METRICS + COLOR_METRICS
+    expected = Evaluator.find_pattern(metrics, case_dir.joinpath('pc_error.txt').read_text().splitlines())
+    # The recording has to cover the p2plane and the color lines, not only p2point
+    assert 'NaN' not in expected
+    normals_pc = case_dir.joinpath(case['normals']) if case['normals'] else None
+    values = geometry_distortion(case_dir.joinpath('orig.ply'), case_dir.joinpath('dec.ply'), case['resolution'],
+                                 normals_pc=normals_pc, color=True)
+    assert compare_with_pcerror(values, expected, rtol=RTOL) == []